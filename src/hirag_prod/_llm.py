@@ -1,4 +1,5 @@
 import os
+from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
 import numpy as np
@@ -55,11 +56,39 @@ api_retry = retry(
 )
 
 
+@dataclass
+class TokenUsage:
+    """Token usage reported by the provider, to track the prompt cache hit rate"""
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    # Prompt tokens served from the provider's prompt cache
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add(self, usage: Any) -> None:
+        if usage is None:
+            return
+        self.requests += 1
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_prompt_tokens += getattr(details, "cached_tokens", None) or 0
+
+    @property
+    def prompt_cache_hit_rate(self) -> float:
+        """Share of the prompt tokens which were served from the prompt cache"""
+        if not self.prompt_tokens:
+            return 0.0
+        return self.cached_prompt_tokens / self.prompt_tokens
+
+
 class ChatCompletion:
     """Handler for OpenAI chat completions"""
 
     def __init__(self):
         self.client = OpenAIClient().client
+        self.token_usage = TokenUsage()
 
     @api_retry
     async def complete(
@@ -96,6 +125,7 @@ class ChatCompletion:
         response = await self.client.chat.completions.create(
             model=model, messages=messages, **kwargs
         )
+        self.token_usage.add(response.usage)
 
         return response.choices[0].message.content
 
@@ -1,5 +1,6 @@
 import asyncio
 import html
+import inspect
 import json
 import logging
 import numbers
@@ -9,10 +10,11 @@ from contextlib import contextmanager
 from dataclasses import dataclass
 from functools import wraps
 from hashlib import md5
-from typing import Any, Coroutine, Iterable, List, TypeVar
+from typing import Any, Callable, Coroutine, Iterable, List, Optional, TypeVar
 
 import numpy as np
 import tiktoken
+import xxhash
 
 logger = logging.getLogger("HiRAG")
 ENCODER = None
@@ -123,6 +125,16 @@ def convert_response_to_json(response: str) -> dict:
     return prediction_json
 
 
+# Encoders by name, loaded once per (pool) process
+_ENCODERS: dict[str, tiktoken.Encoding] = {}
+
+
+def get_encoder(encoding_name: str) -> tiktoken.Encoding:
+    if encoding_name not in _ENCODERS:
+        _ENCODERS[encoding_name] = tiktoken.get_encoding(encoding_name)
+    return _ENCODERS[encoding_name]
+
+
 def encode_string_by_tiktoken(content: str, model_name: str = "gpt-4o"):
     global ENCODER
     if ENCODER is None:
@@ -131,6 +143,14 @@ def encode_string_by_tiktoken(content: str, model_name: str = "gpt-4o"):
     return tokens
 
 
+def encode_strings_by_tiktoken(contents: list[str], model_name: str = "gpt-4o"):
+    """Encode many strings at once, with tiktoken's batched (multi-threaded) encoder"""
+    global ENCODER
+    if ENCODER is None:
+        ENCODER = tiktoken.encoding_for_model(model_name)
+    return ENCODER.encode_batch(contents)
+
+
 def decode_tokens_by_tiktoken(tokens: list[int], model_name: str = "gpt-4o"):
     global ENCODER
     if ENCODER is None:
@@ -155,6 +175,23 @@ def compute_mdhash_id(content, prefix: str = ""):
     return prefix + md5(content.encode()).hexdigest()
 
 
+def compute_xxhash_id(content: str) -> int:
+    """Compute a compact 64-bit id of the content with xxhash.
+
+    The sign bit is cleared so that the id always fits in a signed int64 column.
+    """
+    return xxhash.xxh64_intdigest(content.encode()) & 0x7FFFFFFFFFFFFFFF
+
+
+def compute_file_xxhash_id(file_path: str, block_size: int = 1 << 20) -> int:
+    """Compute the xxhash id of a file's bytes, reading it block by block."""
+    hasher = xxhash.xxh64()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.intdigest() & 0x7FFFFFFFFFFFFFFF
+
+
 def write_json(json_obj, file_name):
     with open(file_name, "w", encoding="utf-8") as f:
         json.dump(json_obj, f, indent=2, ensure_ascii=False)
@@ -338,3 +375,42 @@ async def _limited_gather(
 
     tasks = [asyncio.create_task(_worker(c)) for c in coros]
     return await asyncio.gather(*tasks)
+
+
+# Marks the end of the items flowing through a pipeline stage
+_STAGE_DONE = object()
+
+
+async def _pipeline_stage(
+    func: Callable[[Any], Coroutine[Any, Any, Any]],
+    inbox: asyncio.Queue,
+    outbox: Optional[asyncio.Queue] = None,
+    concurrency: int = 1,
+):
+    """Run a pipeline stage: apply func to the items of inbox with limited concurrency.
+
+    The results which are not None are put into outbox. When func is an async generator
+    function, each item it yields is put into outbox as soon as it is produced. A bounded outbox blocks the stage
+    when the next one falls behind, so that the items in flight stay bounded. The stage ends
+    when it gets _STAGE_DONE from inbox, and then passes it on to outbox.
+    """
+
+    async def _worker():
+        while True:
+            item = await inbox.get()
+            if item is _STAGE_DONE:
+                # let the other workers of the stage stop too
+                await inbox.put(_STAGE_DONE)
+                return
+            if inspect.isasyncgenfunction(func):
+                async for result in func(item):
+                    if outbox is not None and result is not None:
+                        await outbox.put(result)
+                continue
+            result = await func(item)
+            if outbox is not None and result is not None:
+                await outbox.put(result)
+
+    await asyncio.gather(*[_worker() for _ in range(concurrency)])
+    if outbox is not None:
+        await outbox.put(_STAGE_DONE)
@@ -1,4 +1,17 @@
 from .base_chunk import BaseChunk
 from .fix_token_chunk import FixTokenChunk
+from .markdown_chunk import MarkdownChunk, iter_markdown_blocks
+from .minhash_lsh import MinHashLSH
+from .token_chunk import TokenChunk
+from .worker_pool import ChunkWorkerPool, iter_unpacked_spans
 
-__all__ = ["FixTokenChunk", "BaseChunk"]
+__all__ = [
+    "FixTokenChunk",
+    "TokenChunk",
+    "MarkdownChunk",
+    "BaseChunk",
+    "MinHashLSH",
+    "iter_markdown_blocks",
+    "ChunkWorkerPool",
+    "iter_unpacked_spans",
+]
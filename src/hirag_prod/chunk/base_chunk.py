@@ -1,7 +1,69 @@
 from abc import ABC, abstractmethod
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Tuple
+
+from hirag_prod._utils import compute_xxhash_id
+from hirag_prod.schema import Chunk, File, TokenizedText
+
+# A [start, end) character span of a text
+Span = Tuple[int, int]
 
 
 class BaseChunk(ABC):
+    # Whether the chunks are made of spans of the document text, see iter_chunk_spans
+    yields_spans = False
+
     @abstractmethod
     def chunk(self, text: str) -> list[str]:
         pass
+
+    def iter_chunk_spans(self, tokenized: TokenizedText) -> Iterator[list[Span]]:
+        """
+        The spans of the text each chunk is made of, the spans of a chunk being joined by
+        line breaks. Only implemented by the chunkers whose yields_spans is True.
+        """
+        raise NotImplementedError
+
+    def iter_chunks(
+        self,
+        document: File,
+        batch_size: int = 256,
+        chunk_spans: Optional[Iterable[list[Span]]] = None,
+    ) -> Iterator[list[Chunk]]:
+        """
+        Chunk a document lazily, yielding its chunks in batches of up to batch_size.
+
+        Chunkers which produce their chunks one at a time override _generate_chunks, so
+        that a single batch of chunks is held at once; the others chunk the whole document
+        first. The chunk spans of the document may be given when they were computed
+        beforehand, e.g. by a ChunkWorkerPool, and the chunks are then only built from them.
+        """
+        if chunk_spans is not None:
+            chunks = self._chunks_from_spans(document, chunk_spans)
+        else:
+            chunks = self._generate_chunks(document)
+        while batch := list(islice(chunks, batch_size)):
+            yield batch
+
+    def _generate_chunks(self, document: File) -> Iterator[Chunk]:
+        return iter(self.chunk(document))
+
+    @staticmethod
+    def _chunks_from_spans(
+        document: File, chunk_spans: Iterable[list[Span]]
+    ) -> Iterator[Chunk]:
+        text = document.page_content
+        metadata = document.metadata
+        document_id = document.id
+
+        for chunk_idx, spans in enumerate(chunk_spans):
+            chunk = "\n".join(text[start:end] for start, end in spans)
+            yield Chunk(
+                id=compute_xxhash_id(chunk),
+                page_content=chunk,
+                metadata={
+                    **metadata.__dict__,  # Get all attributes from metadata object
+                    "chunk_idx": chunk_idx,
+                    "document_id": document_id,
+                },
+            )
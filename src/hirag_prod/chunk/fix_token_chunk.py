@@ -1,7 +1,7 @@
 from langchain_text_splitters import Tokenizer
 from langchain_text_splitters.base import split_text_on_tokens
 
-from hirag_prod._utils import compute_mdhash_id
+from hirag_prod._utils import compute_xxhash_id
 from hirag_prod.schema import Chunk, File
 
 from .base_chunk import BaseChunk
@@ -28,7 +28,7 @@ class FixTokenChunk(BaseChunk):
 
         return [
             Chunk(
-                id=compute_mdhash_id(chunk, prefix="chunk-"),
+                id=compute_xxhash_id(chunk),
                 page_content=chunk,
                 metadata={
                     **metadata.__dict__,  # Get all attributes from metadata object
@@ -0,0 +1,260 @@
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from hirag_prod.schema import Chunk, File, TokenizedText
+
+from .base_chunk import BaseChunk, Span
+from .token_chunk import TokenChunk
+
+_HEADING = re.compile(r"^#{1,6}\s")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_TABLE_ROW = re.compile(r"^\s*\|")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}")
+_LIST_ITEM = re.compile(r"^\s*([-*+]|\d+[.)])\s")
+_HTML_TABLE_START = re.compile(r"^\s*<table", re.IGNORECASE)
+_HTML_TABLE_END = re.compile(r"</table>", re.IGNORECASE)
+
+
+def iter_block_spans(text: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Split markdown into its blocks, in a single pass over the lines.
+
+    Yields (kind, start, end) triples, kind being "heading", "paragraph", "list", "table"
+    (markdown or HTML, as output by MinerU), or "code", and [start, end) the span of the
+    block in the text, without its leading and trailing line breaks. A block is never cut:
+    tables keep all their rows, code blocks and lists all their lines.
+    """
+
+    def _block(kind: str, start: int, end: int):
+        while start < end and text[start] == "\n":
+            start += 1
+        while end > start and text[end - 1] == "\n":
+            end -= 1
+        if not text[start:end].strip():
+            return None
+        return ("table" if kind == "html_table" else kind, start, end)
+
+    # the kind and the span of the lines of the current block
+    kind, start, end = None, 0, 0
+    position = 0
+    for line in text.splitlines(keepends=True):
+        line_start, position = position, position + len(line)
+        # blocks which only end on their closing line
+        if kind == "code":
+            end = position
+            if _FENCE.match(line):
+                yield _block(kind, start, end)
+                kind, start, end = None, position, position
+            continue
+        if kind == "html_table":
+            end = position
+            if _HTML_TABLE_END.search(line):
+                yield _block(kind, start, end)
+                kind, start, end = None, position, position
+            continue
+
+        if _FENCE.match(line):
+            new_kind = "code"
+        elif _HTML_TABLE_START.match(line):
+            new_kind = "html_table"
+        elif _HEADING.match(line):
+            new_kind = "heading"
+        elif not line.strip():
+            new_kind = None
+        elif _TABLE_ROW.match(line):
+            new_kind = "table"
+        elif _LIST_ITEM.match(line) or (kind == "list" and line[0].isspace()):
+            new_kind = "list"
+        else:
+            new_kind = "paragraph"
+
+        # a heading is a block of its own, a blank line ends any other block
+        if new_kind != kind or new_kind in ("heading", None):
+            if end > start and (block := _block(kind, start, end)) is not None:
+                yield block
+            kind, start, end = new_kind, line_start, line_start
+        if new_kind is not None:
+            end = position
+            if new_kind == "html_table" and _HTML_TABLE_END.search(line):
+                yield _block(kind, start, end)
+                kind, start, end = None, position, position
+
+    if end > start and (block := _block(kind, start, end)) is not None:
+        yield block
+
+
+def iter_markdown_blocks(text: str) -> Iterator[Tuple[str, str]]:
+    """Split markdown into its blocks, as (kind, text) pairs, see iter_block_spans"""
+    for kind, start, end in iter_block_spans(text):
+        yield kind, text[start:end]
+
+
+class MarkdownChunk(BaseChunk):
+    """
+    Structure-aware chunker for markdown, e.g. the MinerU output of Markify.
+
+    The markdown is parsed into heading, paragraph, list, table and code blocks, which are
+    packed into chunks of up to chunk_size tokens without overlap. A heading starts a new
+    chunk once the current one is half full, and moves to the next chunk rather than end
+    one. Only a block larger than chunk_size is split: tables by rows, repeating their
+    header, other blocks by lines, and single lines by token windows.
+
+    The text is encoded once, and the blocks are handled as character spans whose token
+    counts are looked up in the offsets of its tokens, so that nothing is encoded again.
+    A chunk made of consecutive blocks is the exact span of the text covering them.
+    """
+
+    yields_spans = True
+
+    # Tokens of the blank line joining two blocks
+    _SEPARATOR_TOKENS = 1
+
+    def __init__(self, chunk_size: int, encoding_name: str = "cl100k_base"):
+        self.chunk_size = chunk_size
+        self.encoding_name = encoding_name
+
+    def _split_block(
+        self, tokenized: TokenizedText, kind: str, start: int, end: int, reserved: int
+    ) -> Iterator[List[Span]]:
+        """Split a block larger than chunk_size, the first part leaving reserved tokens"""
+        text = tokenized.text
+        lines, line_start = [], start
+        for line in text[start:end].split("\n"):
+            lines.append((line_start, line_start + len(line)))
+            line_start += len(line) + 1
+        header = []
+        if (
+            kind == "table"
+            and len(lines) > 2
+            and _TABLE_SEPARATOR.match(text[lines[1][0] : lines[1][1]])
+        ):
+            header, lines = [(lines[0][0], lines[1][1])], lines[2:]
+        header_tokens = tokenized.count_tokens(*header[0]) if header else 0
+
+        budget = max(self.chunk_size - reserved, 1)
+        current, current_tokens = None, header_tokens
+        for line_start, line_end in lines:
+            tokens = tokenized.count_tokens(line_start, line_end) + 1
+            if current and current_tokens + tokens > budget:
+                yield header + [current]
+                current, current_tokens = None, header_tokens
+                budget = self.chunk_size
+            if header_tokens + tokens > budget:
+                # a single line over the budget, e.g. a one-line HTML table
+                windows = TokenChunk(budget, 0, self.encoding_name).split_spans(
+                    tokenized.span(line_start, line_end)
+                )
+                for window_start, window_end in windows:
+                    yield [(line_start + window_start, line_start + window_end)]
+                budget = self.chunk_size
+                continue
+            # the lines of a block are contiguous
+            current = (current[0] if current else line_start, line_end)
+            current_tokens += tokens
+        if current:
+            yield header + [current]
+
+    def pack_blocks(
+        self, tokenized: TokenizedText, blocks: Iterable[Tuple[str, int, int]]
+    ) -> Iterator[List[Span]]:
+        """Pack markdown blocks into chunks of up to chunk_size tokens, as span lists"""
+        # (kind, span, tokens) of the blocks of the current chunk
+        current, current_tokens = [], 0
+
+        def _size(blocks) -> int:
+            return sum(tokens for _, _, tokens in blocks) + self._SEPARATOR_TOKENS * (
+                len(blocks) - 1
+            )
+
+        def _spans(blocks) -> List[Span]:
+            return [span for _, span, _ in blocks]
+
+        for kind, start, end in blocks:
+            tokens = tokenized.count_tokens(start, end)
+            if tokens > self.chunk_size:
+                # the headings ending the chunk go with the first part of the block
+                cut = len(current)
+                while cut > 0 and current[cut - 1][0] == "heading":
+                    cut -= 1
+                if cut:
+                    yield _spans(current[:cut])
+                headings = current[cut:]
+                reserved = _size(headings) + self._SEPARATOR_TOKENS if headings else 0
+                if reserved > self.chunk_size // 2:
+                    # the headings would leave too little of the chunk to the first part of
+                    # the block, they make a chunk of their own
+                    yield _spans(headings)
+                    headings, reserved = [], 0
+                for i, part in enumerate(
+                    self._split_block(tokenized, kind, start, end, reserved)
+                ):
+                    yield _spans(headings) + part if i == 0 else part
+                current, current_tokens = [], 0
+                continue
+
+            new_size = current_tokens + self._SEPARATOR_TOKENS + tokens
+            starts_section = (
+                kind == "heading" and current_tokens >= self.chunk_size // 2
+            )
+            if current and (new_size > self.chunk_size or starts_section):
+                # the headings ending the chunk move to the next one, with their section
+                cut = len(current)
+                while cut > 0 and current[cut - 1][0] == "heading":
+                    cut -= 1
+                cut = cut or len(current)
+                yield _spans(current[:cut])
+                current = current[cut:]
+                current_tokens = _size(current) if current else 0
+                if current and current_tokens + self._SEPARATOR_TOKENS + tokens > (
+                    self.chunk_size
+                ):
+                    yield _spans(current)
+                    current, current_tokens = [], 0
+
+            current_tokens += tokens + (self._SEPARATOR_TOKENS if current else 0)
+            current.append((kind, (start, end), tokens))
+        if current:
+            yield _spans(current)
+
+    @staticmethod
+    def _merge_spans(text: str, spans: List[Span]) -> List[Span]:
+        """Merge the spans separated by blank lines only"""
+        merged = [spans[0]]
+        for start, end in spans[1:]:
+            if not text[merged[-1][1] : start].strip():
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    def iter_chunk_spans(self, tokenized: TokenizedText) -> Iterator[List[Span]]:
+        for spans in self.pack_blocks(tokenized, iter_block_spans(tokenized.text)):
+            yield self._merge_spans(tokenized.text, spans)
+
+    def split_tokenized(
+        self, tokenized: TokenizedText
+    ) -> Iterator[Tuple[str, Optional[Span]]]:
+        """
+        Split a tokenized text into chunks.
+        Args:
+            tokenized: The text and its tokens.
+        Returns:
+            The (text, span) of each chunk, span being None when the chunk is not a
+            contiguous part of the text, e.g. a table part with its repeated header.
+        """
+        text = tokenized.text
+        for spans in self.iter_chunk_spans(tokenized):
+            chunk = "\n".join(text[start:end] for start, end in spans)
+            yield chunk, spans[0] if len(spans) == 1 else None
+
+    def split_text(self, text: str) -> list[str]:
+        tokenized = TokenizedText.encode(text, self.encoding_name)
+        return [chunk for chunk, _ in self.split_tokenized(tokenized)]
+
+    def chunk(self, document: File) -> list[Chunk]:
+        return list(self._generate_chunks(document))
+
+    def _generate_chunks(self, document: File) -> Iterator[Chunk]:
+        return self._chunks_from_spans(
+            document, self.iter_chunk_spans(document.tokenized(self.encoding_name))
+        )
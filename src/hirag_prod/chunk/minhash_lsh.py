@@ -0,0 +1,118 @@
+import re
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+import xxhash
+
+# A prime larger than every 32-bit shingle hash
+_MERSENNE_PRIME = np.uint64(4294967311)
+_MAX_COEFFICIENT = 1 << 31
+
+
+class MinHashLSH:
+    """Near-duplicate detector for chunks, based on MinHash signatures and LSH banding.
+
+    Texts are normalized (lower-cased, whitespace collapsed) and shingled into character
+    n-grams, which makes the signature robust to OCR noise and small edits. Two texts are
+    near-duplicates when the estimated Jaccard similarity of their shingles reaches the
+    threshold. At most max_keys signatures are indexed, the least recently matched ones
+    being evicted first.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        threshold: float = 0.9,
+        seed: int = 1,
+        max_keys: int = 10_000,
+    ):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.max_keys = max_keys
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MAX_COEFFICIENT, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MAX_COEFFICIENT, size=num_perm, dtype=np.uint64)
+
+        # band index -> band hash -> keys in the bucket
+        self._buckets: List[Dict[int, List[int]]] = [
+            defaultdict(list) for _ in range(bands)
+        ]
+        # key -> signature, least recently inserted or matched first
+        self._signatures: OrderedDict[int, np.ndarray] = OrderedDict()
+
+    def _shingles(self, text: str) -> np.ndarray:
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        if len(text) <= self.shingle_size:
+            shingles = {text}
+        else:
+            shingles = {
+                text[i : i + self.shingle_size]
+                for i in range(len(text) - self.shingle_size + 1)
+            }
+        return np.fromiter(
+            (xxhash.xxh32_intdigest(s.encode()) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        """Compute the MinHash signature of the text"""
+        shingles = self._shingles(text)
+        # (num_perm, num_shingles) universal hashes, all products fit in uint64
+        hashes = (
+            self._a[:, None] * shingles[None, :] + self._b[:, None]
+        ) % _MERSENNE_PRIME
+        return hashes.min(axis=1)
+
+    def _band_hashes(self, signature: np.ndarray) -> List[int]:
+        return [
+            xxhash.xxh64_intdigest(
+                signature[i * self.rows : (i + 1) * self.rows].tobytes()
+            )
+            for i in range(self.bands)
+        ]
+
+    def insert(self, key: int, signature: np.ndarray):
+        """Index the signature under the key"""
+        if key in self._signatures:
+            self.remove(key)
+        self._signatures[key] = signature
+        for band, band_hash in enumerate(self._band_hashes(signature)):
+            self._buckets[band][band_hash].append(key)
+        while len(self._signatures) > self.max_keys:
+            self.remove(next(iter(self._signatures)))
+
+    def remove(self, key: int):
+        """Remove the signature indexed under the key"""
+        signature = self._signatures.pop(key)
+        for band, band_hash in enumerate(self._band_hashes(signature)):
+            bucket = self._buckets[band][band_hash]
+            bucket.remove(key)
+            if not bucket:
+                del self._buckets[band][band_hash]
+
+    def query(self, signature: np.ndarray) -> Optional[int]:
+        """Return the key of the most similar indexed signature above the threshold, if any"""
+        candidates = set()
+        for band, band_hash in enumerate(self._band_hashes(signature)):
+            candidates.update(self._buckets[band].get(band_hash, ()))
+        if not candidates:
+            return None
+        candidates = list(candidates)
+        similarities = (
+            np.stack([self._signatures[key] for key in candidates]) == signature
+        ).mean(axis=1)
+        best = int(similarities.argmax())
+        if similarities[best] >= self.threshold:
+            self._signatures.move_to_end(candidates[best])
+            return candidates[best]
+        return None
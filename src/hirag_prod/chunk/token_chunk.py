@@ -0,0 +1,58 @@
+from typing import Iterator
+
+import numpy as np
+
+from hirag_prod.schema import Chunk, File, TokenizedText
+
+from .base_chunk import BaseChunk, Span
+
+
+class TokenChunk(BaseChunk):
+    """
+    Chunker whose chunk sizes are true tiktoken token counts.
+
+    The document is encoded once (or not at all, when the loader already tokenized it), the
+    windows of chunk_size tokens overlapping by chunk_overlap tokens are found by index
+    arithmetic, and each window is mapped back to the text through the character offsets
+    of its tokens, without decoding any window.
+    """
+
+    yields_spans = True
+
+    def __init__(
+        self, chunk_size: int, chunk_overlap: int, encoding_name: str = "cl100k_base"
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding_name = encoding_name
+
+    def split_spans(self, tokenized: TokenizedText) -> list[Span]:
+        """The character spans of the token windows of the text"""
+        if not len(tokenized):
+            return []
+        step = self.chunk_size - self.chunk_overlap
+        # the windows start every step tokens, until one reaches the end of the text
+        starts = np.arange(0, max(len(tokenized) - self.chunk_overlap, 1), step)
+        ends = np.minimum(starts + self.chunk_size, len(tokenized))
+        offsets = tokenized.offsets
+        return list(zip(offsets[starts].tolist(), offsets[ends].tolist()))
+
+    def split_tokenized(self, tokenized: TokenizedText) -> list[str]:
+        return [tokenized.text[s:e] for s, e in self.split_spans(tokenized)]
+
+    def split_text(self, text: str) -> list[str]:
+        return self.split_tokenized(TokenizedText.encode(text, self.encoding_name))
+
+    def iter_chunk_spans(self, tokenized: TokenizedText) -> Iterator[list[Span]]:
+        for span in self.split_spans(tokenized):
+            yield [span]
+
+    def chunk(self, document: File) -> list[Chunk]:
+        return list(self._generate_chunks(document))
+
+    def _generate_chunks(self, document: File) -> Iterator[Chunk]:
+        return self._chunks_from_spans(
+            document, self.iter_chunk_spans(document.tokenized(self.encoding_name))
+        )
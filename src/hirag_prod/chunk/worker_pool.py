@@ -0,0 +1,177 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from hirag_prod._utils import get_encoder
+from hirag_prod.schema import File, TokenizedText
+
+from .base_chunk import BaseChunk, Span
+
+# The chunk spans of a document: the (start, end) character spans, and for each chunk
+# the range of its spans, chunk i being made of spans[bounds[i] : bounds[i + 1]]
+ChunkSpans = Tuple[np.ndarray, np.ndarray]
+
+# The chunker of a worker process, set once by its initializer
+_worker_chunker: Optional[BaseChunk] = None
+
+
+def _init_worker(chunker: BaseChunk):
+    global _worker_chunker
+    _worker_chunker = chunker
+    # load the encoding before the first task
+    get_encoder(chunker.encoding_name)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _pack_spans(chunk_spans: Iterator[List[Span]]) -> ChunkSpans:
+    spans, bounds = [], [0]
+    for chunk in chunk_spans:
+        spans.extend(chunk)
+        bounds.append(len(spans))
+    return (
+        np.asarray(spans, dtype=np.int64).reshape(-1, 2),
+        np.asarray(bounds, dtype=np.int64),
+    )
+
+
+def _chunk_spans_task(payloads: List[Union[str, TokenizedText]]) -> List[ChunkSpans]:
+    """Chunk a batch of documents, given as texts or as tokenized texts"""
+    results = []
+    for payload in payloads:
+        if isinstance(payload, str):
+            payload = TokenizedText.encode(payload, _worker_chunker.encoding_name)
+        results.append(_pack_spans(_worker_chunker.iter_chunk_spans(payload)))
+    return results
+
+
+def iter_unpacked_spans(chunk_spans: ChunkSpans) -> Iterator[List[Span]]:
+    """The spans of each chunk, from the arrays returned by ChunkWorkerPool"""
+    spans, bounds = chunk_spans
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        yield [tuple(span) for span in spans[start:end].tolist()]
+
+
+class ChunkWorkerPool:
+    """
+    Pool of worker processes chunking the documents too large to be chunked in process.
+
+    The workers are spawned and warmed up (imports, chunker and encoding loaded) when the
+    pool starts, rather than on the first document. The chunker is sent once to each
+    worker, and the documents awaiting chunking at the same time are sent together, up to
+    max_task_documents documents or max_task_chars characters per task, as text or with
+    the tokens the loader attached. The workers only return the chunk spans as two
+    int64 arrays; the chunks are built from them in process, batch by batch.
+
+    Documents under min_offload_chars characters, and chunkers whose chunks are not spans
+    of the text, are chunked in process, as the IPC would cost more than the chunking.
+    """
+
+    def __init__(
+        self,
+        chunker: BaseChunk,
+        max_workers: Optional[int] = None,
+        min_offload_chars: int = 200_000,
+        max_task_documents: int = 16,
+        max_task_chars: int = 20_000_000,
+    ):
+        self.chunker = chunker
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_offload_chars = min_offload_chars
+        self.max_task_documents = max_task_documents
+        self.max_task_chars = max_task_chars
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # (payload, future) of the documents waiting for the next task
+        self._pending: List[Tuple[Union[str, TokenizedText], asyncio.Future]] = []
+        self._pending_chars = 0
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+    def start(self):
+        """Spawn the workers, and warm them up in the background"""
+        if self._executor is not None or not self.chunker.yields_spans:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.chunker,),
+        )
+        # the workers are spawned on demand, one per task submitted while all are busy
+        for _ in range(self.max_workers):
+            self._executor.submit(_warm_up)
+
+    def offloads(self, document: File) -> bool:
+        """Whether the document is chunked by the workers"""
+        return (
+            self._executor is not None
+            and len(document.page_content) >= self.min_offload_chars
+        )
+
+    async def chunk_spans(self, document: File) -> ChunkSpans:
+        """Chunk a document in a worker, returns its chunk spans"""
+        loop = asyncio.get_running_loop()
+        tokens = document.tokens
+        if tokens is not None and tokens.encoding_name == self.chunker.encoding_name:
+            payload = tokens
+        else:
+            payload = document.page_content
+        future = loop.create_future()
+        self._pending.append((payload, future))
+        self._pending_chars += len(document.page_content)
+        if (
+            len(self._pending) >= self.max_task_documents
+            or self._pending_chars >= self.max_task_chars
+        ):
+            self._submit()
+        elif self._flush_handle is None:
+            # the documents arriving in the same iteration of the loop share a task
+            self._flush_handle = loop.call_soon(self._submit)
+        return await future
+
+    def _submit(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending, self._pending_chars = self._pending, [], 0
+        if not pending:
+            return
+        try:
+            if self._executor is None:
+                raise RuntimeError("The chunk worker pool is shut down")
+            task = asyncio.wrap_future(
+                self._executor.submit(
+                    _chunk_spans_task, [payload for payload, _ in pending]
+                )
+            )
+        except RuntimeError as e:
+            # the pool was shut down, e.g. between chunk_spans and this flush
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        def _done(task: asyncio.Future):
+            for i, (_, future) in enumerate(pending):
+                if future.done():
+                    continue
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result()[i])
+
+        task.add_done_callback(_done)
+
+    def shutdown(self):
+        """Stop the workers, cancelling the tasks not started yet"""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
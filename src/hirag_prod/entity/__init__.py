@@ -1,4 +1,13 @@
 from hirag_prod.entity.base import BaseEntity
+from hirag_prod.entity.journal import ExtractionJournal
+from hirag_prod.entity.resolution import EntityResolver
+from hirag_prod.entity.triage import ChunkTriage
 from hirag_prod.entity.vanilla import VanillaEntity
 
-__all__ = ["BaseEntity", "VanillaEntity"]
+__all__ = [
+    "BaseEntity",
+    "ChunkTriage",
+    "EntityResolver",
+    "ExtractionJournal",
+    "VanillaEntity",
+]
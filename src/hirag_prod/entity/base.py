@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Callable, List
+from typing import Callable, List, Optional, Tuple
 
 
 @dataclass
@@ -11,3 +11,11 @@ class BaseEntity(ABC):
     @abstractmethod
     def entity(self, text: str) -> List[str]:
         pass
+
+    async def entity_and_relation(
+        self, chunks: List, document_key: Optional[int] = None
+    ) -> Tuple[List, List]:
+        """Extract the entities of the chunks, then their relations"""
+        entities = await self.entity(chunks)
+        relations = await self.relation(chunks, entities)
+        return entities, relations
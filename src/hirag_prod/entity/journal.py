@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger("HiRAG")
+
+
+class ExtractionJournal:
+    """Append-only journal of the raw LLM extraction outputs, to resume an interrupted ingestion.
+
+    Each extraction is journaled as soon as it completes, as one JSON line keyed by the hash of
+    its prompt, with the ids of the chunks it covers. A rerun finds the output of every
+    extraction already done and skips its LLM calls. The entries of a document are forgotten
+    once the document is stored in the knowledge base.
+
+    The file is written in a thread, off the event loop, and the extractions completing while
+    a write is in progress are written together by the next one, with a single fsync.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # prompt hash -> journal entry
+        self._entries: Dict[int, dict] = {}
+        # lines waiting for the next write, and the lock of the file
+        self._pending: List[str] = []
+        self._lock = asyncio.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of a crashed run may be truncated
+                        continue
+                    self._entries[entry["key"]] = entry
+            logger.info(f"Loaded {len(self._entries)} extractions from {path}")
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: int) -> Optional[str]:
+        """The raw output of a journaled extraction, None if it is not journaled"""
+        entry = self._entries.get(key)
+        return None if entry is None else entry["raw"]
+
+    async def append(self, key: int, kind: str, chunk_ids: List[int], raw: str):
+        """Journal an extraction, flushed to disk before returning"""
+        entry = {"key": key, "kind": kind, "chunk_ids": chunk_ids, "raw": raw}
+        self._entries[key] = entry
+        self._pending.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        async with self._lock:
+            # the line may have been written by the previous holder of the lock
+            if self._pending:
+                lines, self._pending = self._pending, []
+                await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: List[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def forget(self, chunk_ids: Iterable[int]):
+        """Drop the extractions of chunks which are stored in the knowledge base"""
+        chunk_ids = set(chunk_ids)
+        async with self._lock:
+            kept = {
+                key: entry
+                for key, entry in self._entries.items()
+                if not chunk_ids.issuperset(entry["chunk_ids"])
+            }
+            if len(kept) == len(self._entries):
+                return
+            self._entries = kept
+            # the rewrite holds the pending extractions which are kept
+            self._pending = []
+            await asyncio.to_thread(self._rewrite, list(kept.values()))
+
+    def _rewrite(self, entries: List[dict]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from hirag_prod.prompt import PROMPTS
+from hirag_prod.schema import Entity
+
+logger = logging.getLogger("HiRAG")
+
+
+@dataclass
+class EntityResolver:
+    """Resolves the entities which are the same real-world entity under different names.
+
+    Entities are embedded by name and by description, and blocked with a random-hyperplane
+    LSH index, so that only the entities sharing a bucket are compared. The candidate pairs
+    are confirmed with a vectorized cosine similarity threshold; the pairs in the ambiguous
+    band just below it are confirmed by the LLM, if one is given. The index keeps the
+    canonical entities seen so far, so that entities also resolve across documents.
+    """
+
+    # Embeds a batch of texts
+    embedding_func: Callable[[List[str]], Awaitable[np.ndarray]]
+    # Confirms the ambiguous pairs, None to never merge them
+    llm_func: Optional[Callable] = None
+    llm_model_name: str = "gpt-4o-mini"
+    # Mean of the name and description cosine similarities from which entities are merged
+    merge_threshold: float = 0.92
+    # Similarity from which the LLM is asked whether the entities are the same
+    llm_threshold: float = 0.85
+    # LSH blocking: more bits per table make smaller buckets, more tables find more pairs
+    num_tables: int = 8
+    bits_per_table: int = 12
+    seed: int = 1
+
+    # Resolved entity name -> canonical entity name, a name always resolves the same way
+    aliases: Dict[str, str] = field(default_factory=dict)
+    # Index of the canonical entities: vectors, names, types and descriptions
+    _vectors: List[np.ndarray] = field(default_factory=list)
+    _names: List[str] = field(default_factory=list)
+    _types: List[str] = field(default_factory=list)
+    _descriptions: List[str] = field(default_factory=list)
+    _indexed_names: Dict[str, int] = field(default_factory=dict)
+    _buckets: List[Dict[int, List[int]]] = field(default_factory=list)
+    _planes: Optional[np.ndarray] = None
+    # The index is updated by one resolution at a time
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def _bucket_keys(self, vectors: np.ndarray) -> np.ndarray:
+        """LSH bucket key of each vector in each table, of shape (n, num_tables)"""
+        if self._planes is None:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal(
+                (self.num_tables, self.bits_per_table, vectors.shape[1])
+            )
+            self._buckets = [defaultdict(list) for _ in range(self.num_tables)]
+        bits = np.einsum("tbd,nd->ntb", self._planes, vectors) > 0
+        return bits.astype(np.int64) @ (1 << np.arange(self.bits_per_table))
+
+    async def _embed(self, entities: List[Entity]) -> np.ndarray:
+        """Unit vectors whose dot product is the mean of the name and description similarities"""
+        texts = [e.page_content for e in entities] + [
+            e.metadata.description for e in entities
+        ]
+        embeddings = np.asarray(await self.embedding_func(texts), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        names, descriptions = embeddings[: len(entities)], embeddings[len(entities) :]
+        return np.hstack([names, descriptions]) / np.sqrt(2)
+
+    async def _confirm(self, a: Tuple[str, str, str], b: Tuple[str, str, str]) -> bool:
+        """Ask the LLM whether two (name, type, description) entities are the same"""
+        answer = await self.llm_func(
+            model=self.llm_model_name,
+            prompt=PROMPTS["entity_resolution"].format(
+                name_a=a[0],
+                type_a=a[1],
+                description_a=a[2],
+                name_b=b[0],
+                type_b=b[1],
+                description_b=b[2],
+            ),
+        )
+        return answer.strip().strip('"').strip("'").lower().startswith("yes")
+
+    async def resolve(self, entities: List[Entity]) -> Dict[str, str]:
+        """
+        Resolve the entities against each other and against the index.
+
+        Args:
+            entities (List[Entity]): Entities with distinct names
+
+        Returns:
+            Dict[str, str]: The canonical name of each entity resolved to another one
+        """
+        async with self._lock:
+            return await self._resolve(entities)
+
+    async def _resolve(self, entities: List[Entity]) -> Dict[str, str]:
+        resolved = {
+            e.page_content: self.aliases[e.page_content]
+            for e in entities
+            if e.page_content in self.aliases
+        }
+        new_entities = [
+            e
+            for e in entities
+            if e.page_content not in self._indexed_names
+            and e.page_content not in self.aliases
+        ]
+        if not new_entities:
+            return resolved
+        vectors = await self._embed(new_entities)
+        keys = self._bucket_keys(vectors)
+
+        # nodes 0..n-1 are the index, n.. the new entities
+        offset = len(self._names)
+        all_vectors = self._vectors + list(vectors)
+        names = self._names + [e.page_content for e in new_entities]
+        types = self._types + [e.metadata.entity_type for e in new_entities]
+        descriptions = self._descriptions + [
+            e.metadata.description for e in new_entities
+        ]
+
+        # blocking: the candidates of each new entity share a bucket in some table
+        pairs = set()
+        for i in range(len(new_entities)):
+            node = offset + i
+            for table, key in zip(self._buckets, keys[i]):
+                bucket = table[int(key)]
+                pairs.update((other, node) for other in bucket)
+                bucket.append(node)
+        pairs = [(a, b) for a, b in pairs if types[a] == types[b]]
+
+        merges = []
+        if pairs:
+            left, right = np.array(pairs).T
+            matrix = np.stack(all_vectors)
+            similarities = np.einsum("nd,nd->n", matrix[left], matrix[right])
+            merges = [
+                pair
+                for pair, similarity in zip(pairs, similarities)
+                if similarity >= self.merge_threshold
+            ]
+            ambiguous = [
+                pair
+                for pair, similarity in zip(pairs, similarities)
+                if self.llm_threshold <= similarity < self.merge_threshold
+            ]
+            if ambiguous and self.llm_func is not None:
+
+                def _describe(node: int) -> Tuple[str, str, str]:
+                    return names[node], types[node], descriptions[node]
+
+                confirmed = await asyncio.gather(
+                    *[self._confirm(_describe(a), _describe(b)) for a, b in ambiguous]
+                )
+                merges += [pair for pair, ok in zip(ambiguous, confirmed) if ok]
+
+        # union-find, the index entities and then the earliest entities are canonical
+        parent = {}
+
+        def _find(node: int) -> int:
+            while parent.get(node, node) != node:
+                node = parent[node]
+            return node
+
+        for a, b in merges:
+            root_a, root_b = _find(a), _find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        # the new canonical entities are indexed for the next documents, the resolved
+        # ones are left out of it
+        positions = {}
+        for i in range(len(new_entities)):
+            node = offset + i
+            root = _find(node)
+            if root != node:
+                resolved[names[node]] = self.aliases[names[node]] = names[root]
+                continue
+            positions[node] = len(self._names)
+            self._indexed_names[names[node]] = len(self._names)
+            self._vectors.append(all_vectors[node])
+            self._names.append(names[node])
+            self._types.append(types[node])
+            self._descriptions.append(descriptions[node])
+        touched = {(t, int(key)) for row in keys for t, key in enumerate(row)}
+        for t, key in touched:
+            self._buckets[t][key] = [
+                positions.get(node, node)
+                for node in self._buckets[t][key]
+                if node < offset or node in positions
+            ]
+        if merges:
+            logger.info(f"Resolved {len(merges)} entity pairs as the same entities")
+        return resolved
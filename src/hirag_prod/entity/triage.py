@@ -0,0 +1,94 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+# CJK characters are words of their own, as these scripts do not separate words by spaces
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_WORD_PATTERN = re.compile(rf"[{_CJK}]|[^\W{_CJK}]+")
+# A table of contents line: a title, then a page number after dot leaders
+_TOC_LINE_PATTERN = re.compile(r"(\.{2,}|…+)\s*\d+\s*$")
+# Digits, and the separators of tables and of table of contents leaders
+_NUMERIC_CHARACTERS = set("0123456789|.,:;%+-=_/\\()[]")
+
+
+def numeric_ratio(text: str) -> float:
+    """Share of digits and table separators among the non-space characters of a text"""
+    characters = [c for c in text if not c.isspace()]
+    if not characters:
+        return 0.0
+    return sum(c in _NUMERIC_CHARACTERS for c in characters) / len(characters)
+
+
+def token_entropy(words: list[str]) -> float:
+    """Shannon entropy, in bits, of the distribution of the words of a text"""
+    if not words:
+        return 0.0
+    counts = Counter(word.lower() for word in words)
+    total = len(words)
+    return -sum(n / total * math.log2(n / total) for n in counts.values())
+
+
+def proper_noun_density(words: list[str]) -> Optional[float]:
+    """Share of capitalized words which do not start a sentence, None for uncased scripts"""
+    alphabetic = [word for word in words if word.isalpha()]
+    cased = [word for word in alphabetic if word.lower() != word.upper()]
+    # scripts without case (e.g. CJK) have no capitalization signal
+    if not alphabetic or len(cased) < len(alphabetic) / 2:
+        return None
+    return sum(word[0].isupper() for word in cased[1:]) / len(cased)
+
+
+@dataclass
+class ChunkTriage:
+    """Cheap local classifier of the chunks which cannot plausibly contain entities.
+
+    Tables of contents, page numbers, and long numeric tables from the spreadsheet
+    loaders bypass LLM extraction. The rules are conservative: a chunk is only dropped
+    when it is very short, mostly numeric, a table of contents, repetitive, or
+    numeric-heavy without any proper noun.
+    """
+
+    # Chunks with fewer words carry no entity (page numbers, headers)
+    min_words: int = 3
+    # Chunks with more digits and table separators are numeric tables
+    max_numeric_ratio: float = 0.6
+    # Chunks whose word entropy is lower are repetitive (leaders, filler)
+    min_token_entropy: float = 2.0
+    # Number of words from which the entropy is meaningful
+    min_entropy_words: int = 16
+    # Chunks with at least this share of table of contents lines, over 3 lines
+    max_toc_line_ratio: float = 0.6
+    # Chunks with fewer proper nouns are numeric-heavy tables without names, when their
+    # numeric ratio is above half of max_numeric_ratio
+    min_proper_noun_density: float = 0.01
+
+    def low_information_reason(self, text: str) -> Optional[str]:
+        """Why the text cannot plausibly contain entities, None if it may"""
+        words = _WORD_PATTERN.findall(text)
+        alphabetic_words = [word for word in words if not word.isdigit()]
+        if len(alphabetic_words) < self.min_words:
+            return "too_short"
+        ratio = numeric_ratio(text)
+        if ratio > self.max_numeric_ratio:
+            return "numeric"
+        lines = [line for line in text.splitlines() if line.strip()]
+        if len(lines) >= 3:
+            toc_lines = sum(bool(_TOC_LINE_PATTERN.search(line)) for line in lines)
+            if toc_lines >= self.max_toc_line_ratio * len(lines):
+                return "table_of_contents"
+        # short texts have a low entropy anyway
+        if (
+            len(words) >= self.min_entropy_words
+            and token_entropy(words) < self.min_token_entropy
+        ):
+            return "repetitive"
+        density = proper_noun_density(alphabetic_words)
+        if (
+            density is not None
+            and density < self.min_proper_noun_density
+            and ratio > self.max_numeric_ratio / 2
+        ):
+            return "no_entities"
+        return None
@@ -1,22 +1,48 @@
+import asyncio
+import json
+import logging
 import re
 import warnings
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict, deque
 from dataclasses import dataclass, field
-from typing import Callable, Dict, List
+from typing import Callable, Deque, Dict, List, Literal, Optional, Tuple
 
 from hirag_prod._utils import (
     _handle_single_entity_extraction,
     _handle_single_relationship_extraction,
     _limited_gather,
-    compute_mdhash_id,
+    compute_xxhash_id,
+    encode_string_by_tiktoken,
     pack_user_ass_to_openai_messages,
     split_string_by_multi_markers,
 )
+from hirag_prod.chunk import MinHashLSH
 from hirag_prod.prompt import PROMPTS
 from hirag_prod.schema import Chunk, Entity, Relation
-from hirag_prod.summarization import BaseSummarizer, TrancatedAggregateSummarizer
+from hirag_prod.summarization import BaseSummarizer, MapReduceSummarizer
 
 from .base import BaseEntity
+from .journal import ExtractionJournal
+from .resolution import EntityResolver
+from .triage import ChunkTriage, numeric_ratio
+
+logger = logging.getLogger("HiRAG")
+
+
+@dataclass
+class GleaningStats:
+    """Gleaning statistics of one extraction, to tune the adaptive gleaning policy"""
+
+    # The chunks extracted together
+    chunk_ids: List[int]
+    # "entity", "relation" or "joint" extraction
+    kind: str
+    # Length of the extracted text
+    chars: int
+    # Number of records of the first pass, then of each gleaning round
+    records: List[int] = field(default_factory=list)
+    # Why gleaning was skipped: "low_yield", "numeric", "packed", or None if it ran
+    skipped: Optional[str] = None
 
 
 @dataclass
@@ -73,150 +99,587 @@ class VanillaEntity(BaseEntity):
         }
     )
 
+    # === Gleaning Policy ===
+    # "fixed": glean *_extract_max_gleaning rounds, asking the LLM whether to continue
+    # "adaptive": skip gleaning on low-yield or numeric chunks, otherwise glean up to
+    # adaptive_max_gleaning rounds until the marginal yield drops
+    gleaning_policy: Literal["fixed", "adaptive"] = "fixed"
+    adaptive_max_gleaning: int = 3
+    # Skip gleaning when the first pass finds fewer records per 1000 characters
+    gleaning_min_records_per_1k_chars: float = 1.0
+    # Skip gleaning when digits and table separators are more than this share of the text
+    gleaning_max_numeric_ratio: float = 0.5
+    # Stop gleaning when a round finds fewer new records than this share of the first pass
+    gleaning_min_marginal_yield: float = 0.2
+    # Statistics of the latest adaptive extractions, the oldest being dropped first
+    max_gleaning_stats: int = 10_000
+    gleaning_stats: Deque[GleaningStats] = field(default=None)
+
+    # Marker of the per-chunk section of the extraction prompts, everything before it is
+    # static and sent as the system prompt, so that it is served by the prompt cache
+    prompt_input_marker: str = "-Real Data-"
+
+    # === Extraction Mode ===
+    # "separate": one extraction for the entities and another for the relations of each chunk
+    # "joint": a single extraction parses both the entity and the relationship tuples, with
+    # the entity extraction prompt, which already asks for both
+    extraction_mode: Literal["separate", "joint"] = "separate"
+    # Token budget of the chunk texts packed into one extraction request, each chunk tagged
+    # with its index in the pack so that the records are routed back to it. 0 extracts each
+    # chunk on its own. Packs of several chunks are not gleaned, as the records of the
+    # gleaning rounds could not be routed back reliably.
+    extraction_pack_token_budget: int = 0
+
+    # === Resumable Extraction ===
+    # Journal of the extraction outputs, which a rerun after a failure resumes from.
+    # None to disable.
+    journal: Optional[ExtractionJournal] = None
+
+    # === Entity Resolution ===
+    # Merges the entities which are the same real-world entity under different names
+    # (abbreviations, spelling variants), on top of the exact name match. None to disable.
+    entity_resolver: Optional[EntityResolver] = None
+
+    # === Low-information Chunk Triage ===
+    # Local classifier of the chunks which bypass extraction because they cannot plausibly
+    # contain entities (tables of contents, page numbers, numeric tables). None to disable.
+    chunk_triage: Optional[ChunkTriage] = field(default_factory=ChunkTriage)
+    # Number of LLM calls skipped by the triage, by the key of the document the chunks come
+    # from (None when not given), reported and reset by the ingestion of the document
+    triage_skipped_calls: Counter = field(default_factory=Counter)
+
+    # === Near-duplicate Chunk Parameters ===
+    # Detector of near-duplicate chunks (OCR variants, versioned copies), whose extraction
+    # is reused from the first chunk seen instead of a fresh LLM call. None to disable.
+    chunk_deduplicator: Optional[MinHashLSH] = field(default_factory=MinHashLSH)
+    # Number of chunks kept in each cache below, the least recently used being evicted first
+    max_cached_chunks: int = 10_000
+    # Parsed extraction records of the representative chunks, by chunk id
+    _entity_record_cache: OrderedDict[int, List[dict]] = field(
+        default_factory=OrderedDict
+    )
+    _relation_record_cache: OrderedDict[int, List[dict]] = field(
+        default_factory=OrderedDict
+    )
+    # Near-duplicate chunk id -> representative chunk id
+    _near_duplicate_of: OrderedDict[int, int] = field(default_factory=OrderedDict)
+
     @classmethod
     def create(cls, **kwargs):
         return cls(**kwargs)
 
     def __post_init__(self):
+        if self.gleaning_stats is None:
+            self.gleaning_stats = deque(maxlen=self.max_gleaning_stats)
         if self.entity_description_summarizer is None:
-            self.entity_description_summarizer = TrancatedAggregateSummarizer(
+            self.entity_description_summarizer = MapReduceSummarizer(
                 llm_model_name=self.llm_model_name,
                 extract_func=self.extract_func,
             )
 
-    async def entity(self, chunks: List[Chunk]) -> List[Entity]:
-        async def _process_single_content_entity(
-            chunk: Chunk,
-        ) -> List[Entity]:
-            """
-            This function is used to extract entities from a single chunk.
-            """
-            chunk_key = chunk.id
-            content = chunk.page_content
-            # 1. initial extraction
-            entity_extraction_prompt = self.entity_extract_prompt.format(
-                **self.entity_extract_context, input_text=content
-            )  # fill in the parameter
-            entity_string_result = await self.extract_func(
-                model=self.llm_model_name,
-                prompt=entity_extraction_prompt,
-            )  # feed into LLM with the prompt
-
-            content_history = pack_user_ass_to_openai_messages(
-                entity_extraction_prompt, entity_string_result
-            )  # concat the prompt and result as history for the next iteration
-
-            # 2. continue to extract entities for higher quality entities entraction, normally we only need 1 iteration
-            for glean_idx in range(self.entity_extract_max_gleaning):
-                glean_result = await self.extract_func(
-                    model=self.llm_model_name,
-                    prompt=self.continue_prompt,
-                    history_messages=content_history,
+    def _cache(self, cache: OrderedDict, key: int, value):
+        """Put a value in one of the chunk caches, evicting the least recently used"""
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_cached_chunks:
+            cache.popitem(last=False)
+
+    def _triage_chunks(
+        self, chunks: List[Chunk], document_key: Optional[int] = None
+    ) -> List[Chunk]:
+        """Drop the low-information chunks, counting the LLM calls they would have cost"""
+        if self.chunk_triage is None:
+            return chunks
+        # the first pass of each extraction, without gleaning
+        calls_per_chunk = 1 if self.extraction_mode == "joint" else 2
+        kept, reasons = [], Counter()
+        for chunk in chunks:
+            reason = self.chunk_triage.low_information_reason(chunk.page_content)
+            if reason is None:
+                kept.append(chunk)
+                continue
+            reasons[reason] += 1
+            self.triage_skipped_calls[document_key] += calls_per_chunk
+        if reasons:
+            logger.info(
+                f"Skipped extraction of {len(chunks) - len(kept)} low-information chunks "
+                f"({dict(reasons)}), saving at least {sum(reasons.values()) * calls_per_chunk} LLM calls"
+            )
+        return kept
+
+    def _route_near_duplicates(
+        self, chunks: List[Chunk]
+    ) -> Tuple[List[Chunk], List[Chunk]]:
+        """
+        Split the chunks into representatives, which go through LLM extraction, and
+        near-duplicates of an already known representative, which reuse its extraction.
+        """
+        if self.chunk_deduplicator is None:
+            return chunks, []
+        representatives, duplicates = [], []
+        representative_ids = set()
+        for chunk in chunks:
+            signature = self.chunk_deduplicator.signature(chunk.page_content)
+            representative_id = self.chunk_deduplicator.query(signature)
+            if representative_id is not None and (
+                representative_id in self._entity_record_cache
+                or representative_id in representative_ids
+            ):
+                if representative_id in self._entity_record_cache:
+                    self._entity_record_cache.move_to_end(representative_id)
+                self._cache(self._near_duplicate_of, chunk.id, representative_id)
+                duplicates.append(chunk)
+                continue
+            if representative_id is None:
+                self.chunk_deduplicator.insert(chunk.id, signature)
+            representatives.append(chunk)
+            representative_ids.add(chunk.id)
+        return representatives, duplicates
+
+    @staticmethod
+    def _entity_records_to_entities(
+        entity_records: List[dict], chunk_key: int
+    ) -> List[Entity]:
+        return [
+            Entity(
+                id=compute_xxhash_id(entity["entity_name"]),
+                page_content=entity["entity_name"],
+                metadata={
+                    "entity_type": entity["entity_type"],
+                    "description": entity["description"],
+                    "chunk_ids": [chunk_key],
+                },
+            )
+            for entity in entity_records
+        ]
+
+    @staticmethod
+    def _relation_records_to_relations(
+        relation_records: List[dict], entities_dict: Dict[str, Entity], chunk_key: int
+    ) -> List[Relation]:
+        relations = []
+        for relation in relation_records:
+            try:
+                source = entities_dict[relation["src_id"]]
+            except KeyError:
+                warnings.warn(
+                    f"Source entity {relation['src_id']} not found in entities_dict, skipping relation {relation}"
+                )
+                continue
+            try:
+                target = entities_dict[relation["tgt_id"]]
+            except KeyError:
+                warnings.warn(
+                    f"Target entity {relation['tgt_id']} not found in entities_dict, skipping relation {relation}"
                 )
+                continue
+            relations.append(
+                Relation(
+                    source=source,
+                    target=target,
+                    properties={
+                        "description": relation["description"],
+                        "weight": relation["weight"],
+                        "chunk_id": chunk_key,
+                    },
+                )
+            )
+        return relations
 
-                content_history += pack_user_ass_to_openai_messages(
-                    self.continue_prompt, glean_result
-                )  # add to history
-                entity_string_result += glean_result
-                if glean_idx == self.entity_extract_max_gleaning - 1:
+    def _split_prompt(self, template: str, **context) -> Tuple[Optional[str], str]:
+        """
+        Split an extraction prompt into its static instructions and few-shot examples, sent as
+        the system prompt, and the part filled in per chunk, sent as the user prompt.
+
+        The system prompt comes first and is byte-identical across chunks and across the
+        gleaning calls of a chunk, so the provider's prompt cache serves it. Prompts without
+        the per-chunk section marker are sent whole as the user prompt.
+        """
+        index = template.find(self.prompt_input_marker)
+        if index == -1:
+            return None, template.format(**context)
+        return template[:index].format(**context), template[index:].format(**context)
+
+    @staticmethod
+    def _count_records(string_result: str) -> int:
+        """Number of entity and relationship tuples in an LLM output"""
+        return len(re.findall(r'\("(?:entity|relationship)"', string_result))
+
+    def _gleaning_skip_reason(self, text: str, records: int) -> Optional[str]:
+        """Why the adaptive policy skips gleaning on a text, None to glean"""
+        if numeric_ratio(text) > self.gleaning_max_numeric_ratio:
+            return "numeric"
+        if records * 1000 < self.gleaning_min_records_per_1k_chars * len(text):
+            return "low_yield"
+        return None
+
+    async def _journaled_extraction(
+        self,
+        prompt: str,
+        max_gleaning: int,
+        termination_prompt: str,
+        system_prompt: Optional[str],
+        input_text: str,
+        chunk_ids: List[int],
+        kind: str,
+    ) -> Tuple[str, Optional[int]]:
+        """
+        Run _extract_with_gleaning, or take its output from the journal when the same
+        extraction was done by an interrupted run.
+
+        Returns:
+            Tuple[str, Optional[int]]: The raw output, and the journal key to journal it
+            under, None when there is no journal or the output comes from it
+        """
+        if self.journal is None:
+            key = None
+        else:
+            # the output depends on the whole prompt and on the gleaning
+            key = compute_xxhash_id(
+                json.dumps(
+                    [
+                        self.llm_model_name,
+                        self.gleaning_policy,
+                        max_gleaning,
+                        system_prompt,
+                        prompt,
+                    ]
+                )
+            )
+            string_result = self.journal.get(key)
+            if string_result is not None:
+                return string_result, None
+        string_result = await self._extract_with_gleaning(
+            prompt,
+            max_gleaning,
+            termination_prompt,
+            system_prompt=system_prompt,
+            input_text=input_text,
+            chunk_ids=chunk_ids,
+            kind=kind,
+        )
+        return string_result, key
+
+    async def _extract_with_gleaning(
+        self,
+        prompt: str,
+        max_gleaning: int,
+        termination_prompt: str,
+        system_prompt: Optional[str] = None,
+        input_text: str = "",
+        chunk_ids: Optional[List[int]] = None,
+        kind: str = "entity",
+    ) -> str:
+        """
+        Run an extraction prompt, then continue the extraction for up to max_gleaning rounds.
+
+        With the adaptive gleaning policy, max_gleaning and the termination prompt are not used:
+        gleaning depends on the yield of the first pass on input_text, and on each round's
+        marginal yield. The statistics are recorded in gleaning_stats.
+
+        Extractions of several chunks (a pack) are not gleaned.
+
+        Returns the concatenated outputs of the LLM.
+        """
+        # the static system prompt is shared by all the calls, the history only holds the chunk
+        llm_kwargs = {"model": self.llm_model_name}
+        if system_prompt is not None:
+            llm_kwargs["system_prompt"] = system_prompt
+
+        # 1. initial extraction
+        string_result = await self.extract_func(
+            prompt=prompt, **llm_kwargs
+        )  # feed into LLM with the prompt
+
+        content_history = pack_user_ass_to_openai_messages(
+            prompt, string_result
+        )  # concat the prompt and result as history for the next iteration
+
+        # the gleaned records of a pack could not be routed back to its chunks
+        packed = chunk_ids is not None and len(chunk_ids) > 1
+        if packed:
+            max_gleaning = 0
+        adaptive = self.gleaning_policy == "adaptive"
+        if adaptive:
+            first_records = self._count_records(string_result)
+            stats = GleaningStats(
+                chunk_ids=chunk_ids or [],
+                kind=kind,
+                chars=len(input_text),
+                records=[first_records],
+                skipped=(
+                    "packed"
+                    if packed
+                    else self._gleaning_skip_reason(input_text, first_records)
+                ),
+            )
+            self.gleaning_stats.append(stats)
+            max_gleaning = 0 if stats.skipped else self.adaptive_max_gleaning
+
+        # 2. continue to extract for higher quality extraction, normally we only need 1 iteration
+        for glean_idx in range(max_gleaning):
+            glean_result = await self.extract_func(
+                prompt=self.continue_prompt,
+                history_messages=content_history,
+                **llm_kwargs,
+            )
+
+            content_history += pack_user_ass_to_openai_messages(
+                self.continue_prompt, glean_result
+            )  # add to history
+            string_result += glean_result
+            if adaptive:
+                new_records = self._count_records(glean_result)
+                stats.records.append(new_records)
+            if glean_idx == max_gleaning - 1:
+                break
+
+            if adaptive:
+                # stop when the round found few records compared to the first pass
+                if new_records < self.gleaning_min_marginal_yield * max(
+                    first_records, 1
+                ):
                     break
+                continue
 
-                entity_extraction_termination_str: str = (
-                    await self.extract_func(  # judge if we still need the next iteration
-                        model=self.llm_model_name,
-                        prompt=self.entity_extract_termination_prompt,
-                        history_messages=content_history,
-                    )
-                )
-                entity_extraction_termination_str = (
-                    entity_extraction_termination_str.strip()
-                    .strip('"')
-                    .strip("'")
-                    .lower()
+            termination_str: str = (
+                await self.extract_func(  # judge if we still need the next iteration
+                    prompt=termination_prompt,
+                    history_messages=content_history,
+                    **llm_kwargs,
                 )
-                if entity_extraction_termination_str != "yes":
-                    break
+            )
+            termination_str = termination_str.strip().strip('"').strip("'").lower()
+            if termination_str != "yes":
+                break
+        return string_result
+
+    async def _parse_entity_records(
+        self, string_result: str, chunk_key: int
+    ) -> List[dict]:
+        """Parse the entity tuples of an LLM output"""
+        # split entities from string_result, which is the output of llm --> list of records
+        records: List[str] = split_string_by_multi_markers(
+            string_result,
+            [
+                self.entity_extract_context["record_delimiter"],
+                self.entity_extract_context["completion_delimiter"],
+            ],
+        )
 
-            # 3. split entities from entity_string_result, which is the output of llm --> list of entities
-            records: List[str] = split_string_by_multi_markers(
-                entity_string_result,
-                [
-                    self.entity_extract_context["record_delimiter"],
-                    self.entity_extract_context["completion_delimiter"],
-                ],
+        # Use regrex to extract the entity,
+        # entity_records is a list of dict with the name, type, desc, source_id of entity
+        entity_records = []
+        for record in records:
+            record = re.search(r"\((.*?)\)", record)
+            if record is None:
+                continue
+            record = record.group(1)
+            record_attributes = split_string_by_multi_markers(  # split entity
+                record, [self.entity_extract_context["tuple_delimiter"]]
             )
+            entity = await _handle_single_entity_extraction(  # get the name, type, desc, source_id of entity--> dict
+                record_attributes, chunk_key
+            )
+            if entity is not None:
+                entity_records.append(entity)
+        return entity_records
+
+    async def _parse_relation_records(
+        self, string_result: str, chunk_key: int
+    ) -> List[dict]:
+        """Parse the relationship tuples of an LLM output"""
+        # split relations from string_result, which is the output of llm --> list of records
+        records = split_string_by_multi_markers(
+            string_result,
+            [
+                self.relation_extract_context["record_delimiter"],
+                self.relation_extract_context["completion_delimiter"],
+            ],
+        )
 
-            # 4. Use regrex to extract the entity,
-            # entities is a list of entity, where entity is a Entity object
-            entities = []
-            for record in records:
-                record = re.search(r"\((.*?)\)", record)
-                if record is None:
-                    continue
-                record = record.group(1)
-                record_attributes = split_string_by_multi_markers(  # split entity
-                    record, [self.entity_extract_context["tuple_delimiter"]]
-                )
-                entity = await _handle_single_entity_extraction(  # get the name, type, desc, source_id of entity--> dict
-                    record_attributes, chunk_key
-                )
-                if entity is not None:
-                    # entities_dict[entity["entity_name"]].append(entity)
-
-                    entities.append(
-                        Entity(
-                            id=compute_mdhash_id(entity["entity_name"], prefix="ent-"),
-                            page_content=entity["entity_name"],
-                            metadata={
-                                "entity_type": entity["entity_type"],
-                                "description": entity["description"],
-                                "chunk_ids": [chunk_key],
-                            },
-                        )
-                    )
-            return entities
+        # Use regrex to extract the relation,
+        # relation_records is a list of dict with the source, target, desc, weight of relation
+        relation_records = []
+        for record in records:
+            record = re.search(r"\((.*)\)", record)
+            if record is None:
+                continue
+            record = record.group(1)
+            record_attributes = split_string_by_multi_markers(  # split relation
+                record, [self.relation_extract_context["tuple_delimiter"]]
+            )
+            relation = await _handle_single_relationship_extraction(
+                record_attributes, chunk_key
+            )
+            if relation is not None:
+                relation_records.append(relation)
+        return relation_records
+
+    async def _parse_chunk_records(
+        self, string_result: str, chunk_key: int, with_relations: bool
+    ) -> Tuple[List[dict], List[dict]]:
+        """Parse the entity records, and the relation records if with_relations, of a chunk"""
+        entity_records = await self._parse_entity_records(string_result, chunk_key)
+        relation_records = (
+            await self._parse_relation_records(string_result, chunk_key)
+            if with_relations
+            else []
+        )
+        return entity_records, relation_records
+
+    def _records_to_chunk_results(
+        self,
+        entity_records: List[dict],
+        relation_records: List[dict],
+        chunk_key: int,
+        with_relations: bool,
+    ) -> Tuple[List[Entity], List[Relation]]:
+        """The entities, and the relations if with_relations, of the records of a chunk"""
+        if self.chunk_deduplicator is not None:
+            self._cache(self._entity_record_cache, chunk_key, entity_records)
+            if with_relations:
+                self._cache(self._relation_record_cache, chunk_key, relation_records)
+        entities = self._entity_records_to_entities(entity_records, chunk_key)
+        relations = self._relation_records_to_relations(
+            relation_records, {e.page_content: e for e in entities}, chunk_key
+        )
+        return entities, relations
+
+    def _pack_chunks(self, chunks: List[Chunk]) -> List[List[Chunk]]:
+        """
+        Group the chunks into packs whose texts fit in extraction_pack_token_budget tokens.
+        Without a budget, or for a chunk over the budget, each chunk is a pack of its own.
+        """
+        if self.extraction_pack_token_budget <= 0:
+            return [[chunk] for chunk in chunks]
+        packs, pack, pack_tokens = [], [], 0
+        for chunk in chunks:
+            tokens = len(encode_string_by_tiktoken(chunk.page_content))
+            if pack and pack_tokens + tokens > self.extraction_pack_token_budget:
+                packs.append(pack)
+                pack, pack_tokens = [], 0
+            pack.append(chunk)
+            pack_tokens += tokens
+        if pack:
+            packs.append(pack)
+        return packs
+
+    async def _extract_pack(
+        self, chunks: List[Chunk], with_relations: bool
+    ) -> List[Tuple[List[Entity], List[Relation]]]:
+        """
+        Extract the entities, and the relations if with_relations, of a pack of chunks
+        from one extraction request with the entity extraction prompt.
+
+        Several chunks are placed in the request, each tagged with its index in the pack
+        (1 to n), which is shorter for the LLM to copy back than the chunk id, and the
+        extracted records are routed back to their chunk by tag. Records before the first
+        tag, or under an unknown tag, are dropped.
+
+        Returns:
+            List[Tuple[List[Entity], List[Relation]]]: The entities and relations of each chunk
+        """
+        if len(chunks) == 1:
+            input_text = chunks[0].page_content
+        else:
+            input_text = PROMPTS["packed_chunks_instruction"] + "\n".join(
+                f'<chunk id="{index}">\n{chunk.page_content}\n</chunk>'
+                for index, chunk in enumerate(chunks, start=1)
+            )
+        system_prompt, extraction_prompt = self._split_prompt(
+            self.entity_extract_prompt,
+            **self.entity_extract_context,
+            input_text=input_text,
+        )  # fill in the parameter
+        chunk_ids = [chunk.id for chunk in chunks]
+        kind = "joint" if with_relations else "entity"
+        string_result, journal_key = await self._journaled_extraction(
+            extraction_prompt,
+            self.entity_extract_max_gleaning,
+            self.entity_extract_termination_prompt,
+            system_prompt,
+            input_text,
+            chunk_ids,
+            kind,
+        )
 
-        async def _merge_entities(entity_name: str, entities: List[Entity]) -> Entity:
-            description_list = [e.metadata.description for e in entities]
-            chunk_ids = [e.metadata.chunk_ids for e in entities]
-            chunk_ids = [item for sublist in chunk_ids for item in sublist]
-            entity_types = [e.metadata.entity_type for e in entities]
+        if len(chunks) == 1:
+            sections = {chunks[0].id: string_result}
+        else:
+            # route the records to the chunk of the last tag before them
+            sections = defaultdict(str)
+            parts = re.split(r'<chunk id="(\d+)">', string_result)
+            unrouted = [parts[0]]
+            for index, section in zip(parts[1::2], parts[2::2]):
+                index = int(index)
+                if 1 <= index <= len(chunks):
+                    sections[chunks[index - 1].id] += section
+                else:
+                    unrouted.append(section)
+            unrouted_records = sum(self._count_records(part) for part in unrouted)
+            if unrouted_records:
+                logger.warning(
+                    f"Dropped {unrouted_records} records of a pack of {len(chunks)} chunks, "
+                    f"which are not under the tag of one of its chunks"
+                )
+        chunk_records = [
+            await self._parse_chunk_records(
+                sections.get(chunk.id, ""), chunk.id, with_relations
+            )
+            for chunk in chunks
+        ]
+        if journal_key is not None:
+            await self.journal.append(journal_key, kind, chunk_ids, string_result)
+        return [
+            self._records_to_chunk_results(
+                entity_records, relation_records, chunk_id, with_relations
+            )
+            for chunk_id, (entity_records, relation_records) in zip(
+                chunk_ids, chunk_records
+            )
+        ]
 
-            # description aggregation
+    async def _merge_entities(self, entity_name: str, entities: List[Entity]) -> Entity:
+        description_list = [e.metadata.description for e in entities]
+        chunk_ids = [e.metadata.chunk_ids for e in entities]
+        chunk_ids = [item for sublist in chunk_ids for item in sublist]
+        entity_types = [e.metadata.entity_type for e in entities]
+
+        # description aggregation, no need to summarize a single distinct description
+        description_list = list(set(description_list))
+        if len(description_list) == 1:
+            description = description_list[0]
+        else:
             description = await self.entity_description_summarizer.summarize_entity(
-                entity_name, list(set(description_list))
+                entity_name, description_list
             )
-            # merge chunk_ids
-            chunk_ids = list(set(chunk_ids))
-            # merge entity_types
-            entity_types = sorted(
-                Counter(entity_types).items(),
-                key=lambda x: x[1],
-                reverse=True,
-            )[0][0]
-
-            entity = Entity(
-                id=compute_mdhash_id(entity_name, prefix="ent-"),
-                page_content=entity_name,
-                metadata={
-                    "entity_type": entity_types,
-                    "description": description,
-                    "chunk_ids": chunk_ids,
-                },
-            )
-            return entity
+        # merge chunk_ids
+        chunk_ids = list(set(chunk_ids))
+        # merge entity_types
+        entity_types = sorted(
+            Counter(entity_types).items(),
+            key=lambda x: x[1],
+            reverse=True,
+        )[0][0]
+
+        entity = Entity(
+            id=compute_xxhash_id(entity_name),
+            page_content=entity_name,
+            metadata={
+                "entity_type": entity_types,
+                "description": description,
+                "chunk_ids": chunk_ids,
+            },
+        )
+        return entity
 
-        entity_extraction_concurrency: int = 4
+    async def _merge_chunk_entities(
+        self, entities_list: List[List[Entity]]
+    ) -> List[Entity]:
+        """Merge the entities extracted from each chunk, by entity name"""
         entity_merge_concurrency: int = 2
 
-        extraction_coros = [_process_single_content_entity(chunk) for chunk in chunks]
-
-        # entities_list is a list of list of entities
-        # because _process_single_content_entity returns a list of entities
-        # TODO: handle the concurrent entity extraction
-        entities_list = await _limited_gather(
-            extraction_coros, entity_extraction_concurrency
-        )
         # Flatten the list of entity lists into a single list of entities
         entities = [entity for entity_list in entities_list for entity in entity_list]
         # merge entities with the same id
@@ -234,137 +697,261 @@ class VanillaEntity(BaseEntity):
         for entity in entities_to_merge:
             entities_to_merge_by_name[entity.page_content].append(entity)
         merge_coros = [
-            _merge_entities(name, ents)
+            self._merge_entities(name, ents)
             for name, ents in entities_to_merge_by_name.items()
         ]
         merged_entities = await _limited_gather(merge_coros, entity_merge_concurrency)
-        return entities_unique + merged_entities
+        entities = entities_unique + merged_entities
+        if self.entity_resolver is None:
+            return entities
 
-    async def relation(
-        self, chunks: List[Chunk], entities: List[Entity]
-    ) -> List[Relation]:
-        async def _process_single_content_relation(
-            chunk: Chunk, entities_dict: Dict[str, Entity]
-        ) -> List[Relation]:  # for each chunk, run the func
-            chunk_key = chunk.id
-            content = chunk.page_content
-            # 1. initial extraction
-            relation_extract_prompt = self.relation_extract_prompt.format(
-                **self.relation_extract_context,
-                entities=[e.page_content for e in entities_dict.values()],
-                input_text=content,
-            )  # fill in the parameter
-            relation_string_result = await self.extract_func(
-                model=self.llm_model_name,
-                prompt=relation_extract_prompt,
-            )  # feed into LLM with the prompt
-
-            content_history = pack_user_ass_to_openai_messages(
-                relation_extract_prompt, relation_string_result
-            )  # set as history
-
-            # 2. continue to extract relations for higher quality relations extraction, normally we only need 1 iteration
-            for glean_idx in range(self.relation_extract_max_gleaning):
-                glean_result = await self.extract_func(
-                    model=self.llm_model_name,
-                    prompt=self.continue_prompt,
-                    history_messages=content_history,
-                )
+        resolved = await self.entity_resolver.resolve(entities)
+        if not resolved:
+            return entities
+        entities_by_name = defaultdict(list)
+        for entity in entities:
+            name = resolved.get(entity.page_content, entity.page_content)
+            entities_by_name[name].append(entity)
+        # the canonical entities left alone, and the resolved ones merged into them
+        kept_entities = [
+            ents[0]
+            for name, ents in entities_by_name.items()
+            if len(ents) == 1 and ents[0].page_content == name
+        ]
+        merge_coros = [
+            self._merge_entities(name, ents)
+            for name, ents in entities_by_name.items()
+            if len(ents) > 1 or ents[0].page_content != name
+        ]
+        return kept_entities + await _limited_gather(
+            merge_coros, entity_merge_concurrency
+        )
 
-                content_history += pack_user_ass_to_openai_messages(
-                    self.continue_prompt, glean_result
-                )  # add to history
-                relation_string_result += glean_result
-                if glean_idx == self.relation_extract_max_gleaning - 1:
-                    break
+    def _resolved_id(self, entity: Entity) -> int:
+        """Id of the canonical entity an entity is resolved to"""
+        if self.entity_resolver is None:
+            return entity.id
+        name = self.entity_resolver.aliases.get(entity.page_content)
+        return entity.id if name is None else compute_xxhash_id(name)
+
+    def _reused_chunk_entities(self, chunk: Chunk) -> List[Entity]:
+        """Entities of a near-duplicate chunk, from the extraction of its representative"""
+        return self._entity_records_to_entities(
+            self._entity_record_cache[self._near_duplicate_of[chunk.id]], chunk.id
+        )
 
-                relation_extraction_termination_str: str = (
-                    await self.extract_func(  # judge if we still need the next iteration
-                        model=self.llm_model_name,
-                        prompt=self.relation_extraction_termination_prompt,
-                        history_messages=content_history,
-                    )
-                )
-                relation_extraction_termination_str = (
-                    relation_extraction_termination_str.strip()
-                    .strip('"')
-                    .strip("'")
-                    .lower()
-                )
-                if relation_extraction_termination_str != "yes":
-                    break
+    async def entity(self, chunks: List[Chunk]) -> List[Entity]:
+        entity_extraction_concurrency: int = 4
+
+        chunks = self._triage_chunks(chunks)
+        representative_chunks, duplicate_chunks = self._route_near_duplicates(chunks)
+        extraction_coros = [
+            self._extract_pack(pack, with_relations=False)
+            for pack in self._pack_chunks(representative_chunks)
+        ]
 
-            # 3. split relations from relation_string_result, which is the output of llm --> list of relations
-            records = split_string_by_multi_markers(  # split entities from result --> list of entities
-                relation_string_result,
-                [
-                    self.relation_extract_context["record_delimiter"],
-                    self.relation_extract_context["completion_delimiter"],
-                ],
+        # each pack gives the entities and relations of each of its chunks
+        results_list = await _limited_gather(
+            extraction_coros, entity_extraction_concurrency
+        )
+        entities_list = [
+            chunk_entities for results in results_list for chunk_entities, _ in results
+        ]
+        # near-duplicate chunks reuse the extraction of their representative
+        entities_list += [
+            self._reused_chunk_entities(chunk) for chunk in duplicate_chunks
+        ]
+        return await self._merge_chunk_entities(entities_list)
+
+    async def _extract_chunk_relations(
+        self, chunk: Chunk, entities_dict: Dict[str, Entity]
+    ) -> List[Relation]:
+        chunk_key = chunk.id
+        system_prompt, relation_extract_prompt = self._split_prompt(
+            self.relation_extract_prompt,
+            **self.relation_extract_context,
+            entities=list(
+                dict.fromkeys(e.page_content for e in entities_dict.values())
+            ),
+            input_text=chunk.page_content,
+        )  # fill in the parameter
+        relation_string_result, journal_key = await self._journaled_extraction(
+            relation_extract_prompt,
+            self.relation_extract_max_gleaning,
+            self.relation_extract_termination_prompt,
+            system_prompt,
+            chunk.page_content,
+            [chunk_key],
+            "relation",
+        )
+        relation_records = await self._parse_relation_records(
+            relation_string_result, chunk_key
+        )
+        if journal_key is not None:
+            await self.journal.append(
+                journal_key, "relation", [chunk_key], relation_string_result
             )
+        if self.chunk_deduplicator is not None:
+            self._cache(self._relation_record_cache, chunk_key, relation_records)
+        return self._relation_records_to_relations(
+            relation_records, entities_dict, chunk_key
+        )
 
-            # 4. Use regrex to extract the relation,
-            # relations is a list of relations, where relation is a Relation object
-            relations = []
-            for record in records:
-                record = re.search(r"\((.*)\)", record)
-                if record is None:
-                    continue
-                record = record.group(1)
-                record_attributes = split_string_by_multi_markers(  # split entity
-                    record, [self.relation_extract_context["tuple_delimiter"]]
-                )
-                relation = await _handle_single_relationship_extraction(
-                    record_attributes, chunk_key
-                )
-                if relation is not None:
-                    try:
-                        source = entities_dict[relation["src_id"]]
-                    except KeyError:
-                        warnings.warn(
-                            f"Source entity {relation['src_id']} not found in entities_dict, skipping relation {relation}"
-                        )
-                        continue
-                    try:
-                        target = entities_dict[relation["tgt_id"]]
-                    except KeyError:
-                        warnings.warn(
-                            f"Target entity {relation['tgt_id']} not found in entities_dict, skipping relation {relation}"
-                        )
-                        continue
-                    relation = Relation(
-                        source=source,
-                        target=target,
-                        properties={
-                            "description": relation["description"],
-                            "weight": relation["weight"],
-                            "chunk_id": chunk.id,
-                        },
-                    )
-                    relations.append(relation)
-            return relations
+    async def relation(
+        self, chunks: List[Chunk], entities: List[Entity]
+    ) -> List[Relation]:
+        def _chunk_entities_dict(chunk: Chunk) -> Dict[str, Entity]:
+            entities_dict = {
+                e.page_content: e for e in entities if chunk.id in e.metadata.chunk_ids
+            }
+            # the chunk may still name the entities resolved to another one
+            if self.entity_resolver is not None:
+                for alias, name in self.entity_resolver.aliases.items():
+                    if name in entities_dict:
+                        entities_dict.setdefault(alias, entities_dict[name])
+            return entities_dict
 
         relation_extraction_concurrency: int = 5
 
+        # chunks without entities, e.g. skipped by the triage, have no relation to extract
+        chunk_ids = {
+            chunk_id for entity in entities for chunk_id in entity.metadata.chunk_ids
+        }
+        chunks = [chunk for chunk in chunks if chunk.id in chunk_ids]
+
+        # near-duplicate chunks reuse the relations of their representative, once it is extracted
+        duplicate_chunks = [
+            chunk for chunk in chunks if chunk.id in self._near_duplicate_of
+        ]
+        duplicate_ids = {chunk.id for chunk in duplicate_chunks}
         relation_coros = [
-            _process_single_content_relation(
-                chunk,
-                {
-                    e.page_content: e
-                    for e in entities
-                    if chunk.id in e.metadata.chunk_ids
-                },
-            )
+            self._extract_chunk_relations(chunk, _chunk_entities_dict(chunk))
             for chunk in chunks
+            if chunk.id not in duplicate_ids
         ]
 
         relations_list = await _limited_gather(
             relation_coros, relation_extraction_concurrency
         )
+        for chunk in duplicate_chunks:
+            relation_records = self._relation_record_cache.get(
+                self._near_duplicate_of[chunk.id]
+            )
+            if relation_records is None:
+                # the representative never went through relation extraction
+                relations_list.append(
+                    await self._extract_chunk_relations(
+                        chunk, _chunk_entities_dict(chunk)
+                    )
+                )
+            else:
+                relations_list.append(
+                    self._relation_records_to_relations(
+                        relation_records, _chunk_entities_dict(chunk), chunk.id
+                    )
+                )
 
+        # a relation between two names of the same resolved entity is dropped
         relations = [
-            relation for relation_list in relations_list for relation in relation_list
+            relation
+            for relation_list in relations_list
+            for relation in relation_list
+            if relation.source.id != relation.target.id
         ]
         # We do not merge relations here, because relations represents facts/relationships between entities
         # and it is supposed to have multiple relations between the same entities
         return relations
+
+    async def entity_and_relation(
+        self, chunks: List[Chunk], document_key: Optional[int] = None
+    ) -> Tuple[List[Entity], List[Relation]]:
+        """
+        Extract the entities and the relations of the chunks, pipelined per chunk.
+
+        The relation extraction of a chunk only needs the names of its own entities, so it
+        starts as soon as the entities of that chunk are parsed, instead of waiting for the
+        entities of all chunks to be extracted and merged. In the "joint" extraction mode,
+        both come from the same extraction. The relations are then pointed at the merged
+        entities.
+
+        The LLM calls saved on low-information chunks are counted in triage_skipped_calls
+        under document_key.
+        """
+        entity_extraction_concurrency: int = 4
+        relation_extraction_concurrency: int = 5
+        entity_semaphore = asyncio.Semaphore(entity_extraction_concurrency)
+        relation_semaphore = asyncio.Semaphore(relation_extraction_concurrency)
+
+        async def _chunk_relations(
+            chunk: Chunk, chunk_entities: List[Entity]
+        ) -> Tuple[List[Entity], List[Relation]]:
+            entities_dict = {e.page_content: e for e in chunk_entities}
+            if not entities_dict:
+                # no entity to relate, e.g. a chunk skipped by the triage
+                return chunk_entities, []
+            relation_records = None
+            if chunk.id in self._near_duplicate_of:
+                relation_records = self._relation_record_cache.get(
+                    self._near_duplicate_of[chunk.id]
+                )
+            if relation_records is not None:
+                chunk_relations = self._relation_records_to_relations(
+                    relation_records, entities_dict, chunk.id
+                )
+            else:
+                async with relation_semaphore:
+                    chunk_relations = await self._extract_chunk_relations(
+                        chunk, entities_dict
+                    )
+            return chunk_entities, chunk_relations
+
+        async def _process_pack(
+            pack: List[Chunk],
+        ) -> List[Tuple[List[Entity], List[Relation]]]:
+            joint = self.extraction_mode == "joint"
+            async with entity_semaphore:
+                results = await self._extract_pack(pack, with_relations=joint)
+            if joint:
+                return results
+            return await asyncio.gather(
+                *[
+                    _chunk_relations(chunk, chunk_entities)
+                    for chunk, (chunk_entities, _) in zip(pack, results)
+                ]
+            )
+
+        chunks = self._triage_chunks(chunks, document_key)
+        representative_chunks, duplicate_chunks = self._route_near_duplicates(chunks)
+        results = [
+            result
+            for pack_results in await asyncio.gather(
+                *[
+                    _process_pack(pack)
+                    for pack in self._pack_chunks(representative_chunks)
+                ]
+            )
+            for result in pack_results
+        ]
+        # near-duplicate chunks reuse the extraction of their representative, once it is done
+        results += await asyncio.gather(
+            *[
+                _chunk_relations(chunk, self._reused_chunk_entities(chunk))
+                for chunk in duplicate_chunks
+            ]
+        )
+
+        entities = await self._merge_chunk_entities(
+            [chunk_entities for chunk_entities, _ in results]
+        )
+        # reconcile the relations with the merged descriptions and the resolved entities
+        merged = {entity.id: entity for entity in entities}
+        relations = []
+        for _, chunk_relations in results:
+            for relation in chunk_relations:
+                relation.source = merged[self._resolved_id(relation.source)]
+                relation.target = merged[self._resolved_id(relation.target)]
+                # a relation between two names of the same entity
+                if relation.source.id == relation.target.id:
+                    continue
+                relations.append(relation)
+        return entities, relations
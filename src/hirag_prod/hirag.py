@@ -1,19 +1,35 @@
 import asyncio
+import json
 import logging
-import multiprocessing
-import os
 import time
-from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Iterable, Optional
 
 import pyarrow as pa
 
 from hirag_prod._llm import ChatCompletion, EmbeddingService
 from hirag_prod._utils import _limited_gather  # Concurrency Rate Limiting Tool
-from hirag_prod.chunk import BaseChunk, FixTokenChunk
-from hirag_prod.entity import BaseEntity, VanillaEntity
-from hirag_prod.loader import load_document
+from hirag_prod._utils import (
+    _STAGE_DONE,
+    _pipeline_stage,
+    compute_file_xxhash_id,
+    compute_xxhash_id,
+)
+from hirag_prod.chunk import (
+    BaseChunk,
+    ChunkWorkerPool,
+    MarkdownChunk,
+    iter_unpacked_spans,
+)
+from hirag_prod.entity import (
+    BaseEntity,
+    EntityResolver,
+    ExtractionJournal,
+    VanillaEntity,
+)
+from hirag_prod.loader import aload_document
+from hirag_prod.schema import Chunk, Entity, File, Relation
 from hirag_prod.storage import (
     BaseGDB,
     BaseVDB,
@@ -21,6 +37,7 @@ from hirag_prod.storage import (
     NetworkXGDB,
     RetrievalStrategyProvider,
 )
+from hirag_prod.summarization import BaseSummarizer, IncrementalFoldSummarizer
 
 # Log Configuration
 logging.basicConfig(
@@ -40,22 +57,46 @@ class HiRAG:
     embedding_service: EmbeddingService = field(default_factory=EmbeddingService)
 
     # Chunk documents
-    chunker: BaseChunk = field(
-        default_factory=lambda: FixTokenChunk(chunk_size=1200, chunk_overlap=200)
-    )
+    chunker: BaseChunk = field(default_factory=lambda: MarkdownChunk(chunk_size=1200))
+    # Worker processes chunking the large documents, started by create()
+    chunk_pool: Optional[ChunkWorkerPool] = None
 
     # Entity extraction
     entity_extractor: BaseEntity = field(default=None)
 
+    # Folds the description of an entity in a new document into its description in the
+    # knowledge base
+    entity_summarizer: Optional[BaseSummarizer] = None
+    kb_merge_concurrency: int = 4
+
     # Storage
     vdb: BaseVDB = field(default=None)
     gdb: BaseGDB = field(default=None)
+    # Ids of the chunks known to be in the chunks table (or being written to it)
+    _known_chunk_ids: set[int] = field(default_factory=set)
+
+    # Concurrency Rate Limiting Parameters
+    # Chunks handed from the chunking stage to the next ones at once
+    chunk_batch_size: int = 256
+    chunk_lookup_batch_size: int = 1000
 
-    # Parallel Pool & Concurrency Rate Limiting Parameters
-    _chunk_pool: ProcessPoolExecutor | None = None
-    chunk_upsert_concurrency: int = 4
-    entity_upsert_concurrency: int = 4
-    relation_upsert_concurrency: int = 2
+    # Ingestion pipeline: chunk batches in flight between two stages, and workers of each
+    # stage
+    pipeline_queue_size: int = 8
+    chunk_stage_concurrency: int = 2
+    embed_stage_concurrency: int = 2
+    extract_stage_concurrency: int = 4
+    # Number of buffered relations written to the graph at once
+    graph_flush_size: int = 2000
+
+    def __post_init__(self):
+        if self.chunk_pool is None:
+            self.chunk_pool = ChunkWorkerPool(self.chunker)
+        if self.entity_summarizer is None:
+            self.entity_summarizer = IncrementalFoldSummarizer(
+                extract_func=self.chat_service.complete,
+                llm_model_name="gpt-4o-mini",
+            )
 
     async def initialize_tables(self):
         # Initialize the chunks table
@@ -68,7 +109,7 @@ class HiRAG:
                     schema=pa.schema(
                         [
                             pa.field("text", pa.string()),
-                            pa.field("document_key", pa.string()),
+                            pa.field("document_key", pa.int64()),
                             pa.field("type", pa.string()),
                             pa.field("filename", pa.string()),
                             pa.field("page_number", pa.int8()),
@@ -78,7 +119,7 @@ class HiRAG:
                                 "chunk_idx", pa.int32()
                             ),  # The index of the chunk in the document
                             pa.field(
-                                "document_id", pa.string()
+                                "document_id", pa.int64()
                             ),  # The id of the document that the chunk is from
                             pa.field("vector", pa.list_(pa.float32(), 1536)),
                         ]
@@ -95,11 +136,61 @@ class HiRAG:
                     schema=pa.schema(
                         [
                             pa.field("text", pa.string()),
-                            pa.field("document_key", pa.string()),
+                            pa.field("document_key", pa.int64()),
                             pa.field("vector", pa.list_(pa.float32(), 1536)),
                             pa.field("entity_type", pa.string()),
                             pa.field("description", pa.string()),
-                            pa.field("chunk_ids", pa.list_(pa.string())),
+                            pa.field("chunk_ids", pa.list_(pa.int64())),
+                        ]
+                    ),
+                )
+            else:
+                raise e
+        # Initialize the document registry table
+        try:
+            self.documents_table = await self.vdb.db.open_table("documents")
+        except Exception as e:
+            if str(e) == "Table 'documents' was not found":
+                self.documents_table = await self.vdb.db.create_table(
+                    "documents",
+                    schema=pa.schema(
+                        [
+                            pa.field(
+                                "document_key", pa.int64()
+                            ),  # xxhash of the document uri
+                            pa.field(
+                                "file_hash", pa.int64()
+                            ),  # xxhash of the file content
+                            pa.field("uri", pa.string()),
+                            pa.field("filename", pa.string()),
+                            pa.field("document_meta", pa.string()),  # json encoded
+                            pa.field("with_graph", pa.bool_()),
+                            pa.field(
+                                "segment_ids", pa.list_(pa.int64())
+                            ),  # The ids of the files produced by the loader
+                            pa.field("chunk_ids", pa.list_(pa.int64())),
+                            pa.field(
+                                "chunk_segment_ids", pa.list_(pa.int64())
+                            ),  # The segment each chunk in chunk_ids came from
+                            pa.field("entity_ids", pa.list_(pa.int64())),
+                            pa.field(
+                                "entity_descriptions", pa.list_(pa.string())
+                            ),  # The description each entity in entity_ids got from this document
+                            pa.field(
+                                "entity_chunk_ids", pa.list_(pa.int64())
+                            ),  # The chunk each description in entity_descriptions was extracted from
+                            pa.field(
+                                "edges",
+                                pa.list_(
+                                    pa.struct(
+                                        [
+                                            pa.field("source", pa.int64()),
+                                            pa.field("target", pa.int64()),
+                                            pa.field("chunk_id", pa.int64()),
+                                        ]
+                                    )
+                                ),
+                            ),
                         ]
                     ),
                 )
@@ -111,6 +202,12 @@ class HiRAG:
         # LLM
         chat_service = ChatCompletion()
         embedding_service = EmbeddingService()
+        # entity merges against the knowledge base and the graph fold into the same summaries
+        if kwargs.get("entity_summarizer") is None:
+            kwargs["entity_summarizer"] = IncrementalFoldSummarizer(
+                extract_func=chat_service.complete,
+                llm_model_name="gpt-4o-mini",
+            )
 
         if kwargs.get("vdb") is None:
             lancedb = await LanceDB.create(
@@ -123,6 +220,7 @@ class HiRAG:
             gdb = NetworkXGDB.create(
                 path="kb/hirag.gpickle",
                 llm_func=chat_service.complete,
+                summarizer=kwargs["entity_summarizer"],
             )
             kwargs["gdb"] = gdb
 
@@ -130,68 +228,611 @@ class HiRAG:
             entity_extractor = VanillaEntity.create(
                 extract_func=chat_service.complete,
                 llm_model_name="gpt-4o-mini",
+                journal=ExtractionJournal("kb/extraction_journal.jsonl"),
+                entity_resolver=EntityResolver(
+                    embedding_func=embedding_service.create_embeddings,
+                    llm_func=chat_service.complete,
+                ),
             )
             kwargs["entity_extractor"] = entity_extractor
 
+        kwargs.setdefault("chat_service", chat_service)
         instance = cls(**kwargs)
+        # the chunking workers start up while the tables are opened
+        instance.chunk_pool.start()
         await instance.initialize_tables()
         return instance
 
-    @classmethod
-    def _get_pool(cls) -> ProcessPoolExecutor:
-        if cls._chunk_pool is None:
-            ctx = multiprocessing.get_context("spawn")
-            cpu = os.cpu_count() or 1
-            cls._chunk_pool = ProcessPoolExecutor(max_workers=cpu, mp_context=ctx)
-        return cls._chunk_pool
-
-    async def _process_document(self, document, with_graph: bool = True):
+    async def _chunk_document(
+        self, document, document_key: Optional[int] = None
+    ) -> AsyncIterator[tuple[dict[str, list], list[Chunk]]]:
         """
-        Single-document processing: chunk  upsert chunks  extract entities & upsert  extract relations & upsert
+        Chunking stage: chunk a document and yield its chunks which are not in the knowledge
+        base yet, in batches of chunk_batch_size, as they are produced.
+
+        Each batch comes with the record of what the document produced, shared by all its
+        batches, which is completed by the next stages and stored in the document registry.
         """
-        loop = asyncio.get_running_loop()
-        pool = self._get_pool()
-        # Chunking executed in process pool
-        chunks = await loop.run_in_executor(pool, self.chunker.chunk, document)
-
-        # Concurrently upsert chunks
-        chunk_coros = [
-            self.vdb.upsert_text(
-                text_to_embed=chunk.page_content,
-                properties={
+        produced = {
+            "document_key": document_key,
+            "segment_id": document.id,
+            "chunk_ids": [],
+            "entity_ids": [],
+            "entity_descriptions": [],
+            "entity_chunk_ids": [],
+            "edges": [],
+        }
+        chunk_spans = None
+        if self.chunk_pool.offloads(document):
+            # only the spans of the chunks come back from the worker
+            chunk_spans = iter_unpacked_spans(
+                await self.chunk_pool.chunk_spans(document)
+            )
+        batches = self.chunker.iter_chunks(document, self.chunk_batch_size, chunk_spans)
+        # The chunks are built in a thread one batch at a time, so the next stages get the
+        # first chunks of a large document before it is fully chunked, and only the batches
+        # in flight are in memory
+        has_batches = False
+        while (chunks := await asyncio.to_thread(next, batches, None)) is not None:
+            has_batches = True
+            produced["chunk_ids"].extend(chunk.id for chunk in chunks)
+            # Chunk ids are content hashes, skip the chunks already in the knowledge base
+            yield produced, await self._filter_new_chunks(chunks)
+        if not has_batches:
+            yield produced, []
+
+    async def _upsert_chunks(
+        self, item: tuple[dict[str, list], list[Chunk]]
+    ) -> tuple[dict[str, list], list[Chunk]]:
+        """Embedding stage: embed and upsert a batch of new chunks of a document"""
+        _, chunks = item
+        # a single embedding request and table write per batch, through the table the
+        # existing chunks are looked up in
+        await self.vdb.upsert_texts(
+            texts_to_embed=[chunk.page_content for chunk in chunks],
+            properties_list=[
+                {
                     "document_key": chunk.id,
                     "text": chunk.page_content,
                     **chunk.metadata.__dict__,
-                },
-                table_name="chunks",
-                mode="overwrite",
+                }
+                for chunk in chunks
+            ],
+            table=self.chunks_table,
+        )
+        return item
+
+    async def _extract_graph(
+        self, item: tuple[dict[str, list], list[Chunk]]
+    ) -> tuple[dict[str, list], list[Entity], list[Relation]]:
+        """Extraction stage: extract the entities of a batch of new chunks, then their relations"""
+        produced, chunks = item
+        if not chunks:
+            return produced, [], []
+
+        # Entity & relation extraction, pipelined per chunk
+        entities, relations = await self.entity_extractor.entity_and_relation(
+            chunks, document_key=produced["document_key"]
+        )
+
+        # one entry per entity and chunk of the batch it was extracted from
+        chunk_ids = {chunk.id for chunk in chunks}
+        for ent in entities:
+            for chunk_id in ent.metadata.chunk_ids:
+                if chunk_id in chunk_ids:
+                    produced["entity_ids"].append(ent.id)
+                    produced["entity_descriptions"].append(ent.metadata.description)
+                    produced["entity_chunk_ids"].append(chunk_id)
+        produced["edges"].extend(
+            {
+                "source": rel.source.id,
+                "target": rel.target.id,
+                "chunk_id": rel.properties["chunk_id"],
+            }
+            for rel in relations
+        )
+        return produced, entities, relations
+
+    async def _process_documents(
+        self,
+        documents: list[File],
+        with_graph: bool = True,
+        document_key: Optional[int] = None,
+    ) -> list[dict[str, list]]:
+        """
+        Process documents through a staged pipeline: chunk -> embed & upsert chunks -> extract entities
+        & relations -> graph write.
+
+        The stages are connected by bounded queues, so that all stages work at the same time while
+        the number of chunk batches in flight, and thus the memory, stays bounded, however large
+        the documents are.
+
+        When the pipeline fails, the chunks claimed by the documents are released, so that a
+        retry processes them again. document_key is the registry key of the document the
+        segments come from, under which the extraction statistics are counted.
+
+        Returns the records of what each document produced, which are stored in the document registry.
+        """
+        size = self.pipeline_queue_size
+        document_queue = asyncio.Queue(maxsize=size)
+        chunked_queue = asyncio.Queue(maxsize=size)
+        embedded_queue = asyncio.Queue(maxsize=size)
+        extracted_queue = asyncio.Queue(maxsize=size)
+        results = []
+        # ids of the records in results, a document reaching the last stage once per batch
+        recorded = set()
+        pending_relations = 0
+        # ids of the new chunks claimed by the documents
+        claimed = set()
+
+        async def _load():
+            for document in list(documents):
+                await document_queue.put(document)
+            await document_queue.put(_STAGE_DONE)
+
+        async def _chunk(document):
+            async for produced, chunks in self._chunk_document(document, document_key):
+                claimed.update(chunk.id for chunk in chunks)
+                yield produced, chunks
+
+        async def _write_graph(item):
+            nonlocal pending_relations
+            if with_graph:
+                produced, entities, relations = item
+                # Entities are written by this single stage, so their upserts do not conflict
+                await self._merge_with_kb(entities)
+                # Relations are buffered and written to the graph in bulk
+                self.gdb.buffer_relations(relations)
+                pending_relations += len(relations)
+                if pending_relations >= self.graph_flush_size:
+                    await self.gdb.flush()
+                    pending_relations = 0
+            else:
+                produced, _ = item
+            if id(produced) not in recorded:
+                recorded.add(id(produced))
+                results.append(produced)
+
+        stages = [
+            _load(),
+            _pipeline_stage(
+                _chunk,
+                document_queue,
+                chunked_queue,
+                self.chunk_stage_concurrency,
+            ),
+            _pipeline_stage(
+                self._upsert_chunks,
+                chunked_queue,
+                embedded_queue,
+                self.embed_stage_concurrency,
+            ),
+        ]
+        if with_graph:
+            stages.append(
+                _pipeline_stage(
+                    self._extract_graph,
+                    embedded_queue,
+                    extracted_queue,
+                    self.extract_stage_concurrency,
+                )
+            )
+            stages.append(_pipeline_stage(_write_graph, extracted_queue))
+        else:
+            stages.append(_pipeline_stage(_write_graph, embedded_queue))
+
+        try:
+            try:
+                # a failing stage cancels the others, which may be blocked on its queues
+                async with asyncio.TaskGroup() as tg:
+                    for stage in stages:
+                        tg.create_task(stage)
+            except ExceptionGroup as eg:
+                raise eg.exceptions[0] from eg
+            # write the remaining buffered relations
+            await self.gdb.flush()
+        except BaseException:
+            # the chunks are neither extracted nor registered, a retry takes them again
+            self._known_chunk_ids.difference_update(claimed)
+            raise
+        return results
+
+    async def _merge_with_kb(self, entities: list[Entity]):
+        """Merge the entities of a document with the same entities already in the knowledge base.
+
+        The existing rows are fetched in bulk by id, and the entities are merged in place: the
+        chunk ids are unioned, and the new description is folded into the existing one with a
+        single summarization of the two, so the cost of a merge does not grow with the number
+        of documents the entity appears in. The merged entities are written back in one upsert,
+        the unchanged descriptions keeping their vectors. As the relations point at the same
+        entities, the graph receives the merged versions too.
+        """
+        if not entities:
+            return
+        existing = {
+            row["document_key"]: row
+            for row in await self.vdb.query_by_document_keys(
+                self.entities_table,
+                [ent.id for ent in entities],
+                ["document_key", "description", "chunk_ids", "vector"],
+                self.chunk_lookup_batch_size,
+            )
+        }
+
+        async def _merge(ent: Entity) -> Optional[list]:
+            """Merge an entity in place, returns the vector it keeps if any"""
+            row = existing.get(ent.id)
+            if row is None:
+                return None
+            ent.metadata.chunk_ids = list(
+                dict.fromkeys([*row["chunk_ids"], *ent.metadata.chunk_ids])
+            )
+            if ent.metadata.description == row["description"]:
+                return row["vector"]
+            ent.metadata.description = await self.entity_summarizer.summarize_entity(
+                ent.page_content, [row["description"], ent.metadata.description]
             )
-            for chunk in chunks
+            return None
+
+        vectors = await _limited_gather(
+            [_merge(ent) for ent in entities], self.kb_merge_concurrency
+        )
+        properties_list = []
+        for ent, vector in zip(entities, vectors):
+            properties = {
+                "document_key": ent.id,
+                "text": ent.page_content,
+                **ent.metadata.__dict__,
+            }
+            if vector is not None:
+                properties["vector"] = vector
+            properties_list.append(properties)
+        await self.vdb.upsert_texts(
+            texts_to_embed=[ent.metadata.description for ent in entities],
+            properties_list=properties_list,
+            table=self.entities_table,
+        )
+
+    async def _filter_new_chunks(self, chunks: list[Chunk]) -> list[Chunk]:
+        """Drop the chunks which are already in the chunks table, or claimed by another document.
+
+        The lookup is batched by chunk id, and the remaining chunks are claimed before returning,
+        so that concurrently processed documents sharing a chunk only embed and extract it once.
+        """
+        unique_chunks = {chunk.id: chunk for chunk in chunks}
+        candidate_ids = [
+            cid for cid in unique_chunks if cid not in self._known_chunk_ids
+        ]
+        existing_ids = await self.vdb.query_existing_keys(
+            self.chunks_table, candidate_ids, batch_size=self.chunk_lookup_batch_size
+        )
+        # chunks stored by an interrupted ingestion are not registered by any document,
+        # they are processed again, their extraction is resumed from the journal
+        orphan_ids = existing_ids - await self._registered_chunk_ids(existing_ids)
+        # no await between the filter and the claim, so the claim is atomic
+        new_chunks = [
+            unique_chunks[cid]
+            for cid in candidate_ids
+            if (cid not in existing_ids or cid in orphan_ids)
+            and cid not in self._known_chunk_ids
         ]
-        await _limited_gather(chunk_coros, self.chunk_upsert_concurrency)
+        self._known_chunk_ids.update(unique_chunks)
+        if len(new_chunks) < len(chunks):
+            logger.info(
+                f"Skipped {len(chunks) - len(new_chunks)} of {len(chunks)} chunks already in the knowledge base"
+            )
+        orphan_ids = [chunk.id for chunk in new_chunks if chunk.id in orphan_ids]
+        if orphan_ids:
+            logger.info(
+                f"Resuming {len(orphan_ids)} chunks of an interrupted ingestion"
+            )
+            await self.vdb.delete_by_document_keys(self.chunks_table, orphan_ids)
+        return new_chunks
 
-        if with_graph:
-            # Entity extraction & upsert
-            entities = await self.entity_extractor.entity(chunks)
-            entity_coros = [
-                self.vdb.upsert_text(
-                    text_to_embed=ent.metadata.description,
-                    properties={
-                        "document_key": ent.id,
-                        "text": ent.page_content,
-                        **ent.metadata.__dict__,
-                    },
-                    table_name="entities",
-                    mode="overwrite",
+    async def _query_documents_having(
+        self,
+        column: str,
+        ids: Iterable[int],
+        columns: list[str],
+        where: Optional[str] = None,
+    ) -> list[dict]:
+        """The registry records whose list column has any of the ids.
+
+        The ids are looked up in batches of chunk_lookup_batch_size, so that the filter stays
+        small however large the document is. A record matching several batches is returned
+        once.
+        """
+        ids = list(ids)
+        records = {}
+        for i in range(0, len(ids), self.chunk_lookup_batch_size):
+            batch = ",".join(
+                str(id_) for id_ in ids[i : i + self.chunk_lookup_batch_size]
+            )
+            condition = f"array_has_any({column}, [{batch}])"
+            if where is not None:
+                condition = f"{where} AND {condition}"
+            for record in (
+                await self.documents_table.query()
+                .where(condition)
+                .select(["document_key", *columns])
+                .to_list()
+            ):
+                records[record["document_key"]] = record
+        return list(records.values())
+
+    async def _registered_chunk_ids(self, chunk_ids: set[int]) -> set[int]:
+        """The chunk ids which are registered by a document"""
+        registered = set()
+        for record in await self._query_documents_having(
+            "chunk_ids", chunk_ids, ["chunk_ids"]
+        ):
+            registered.update(chunk_ids.intersection(record["chunk_ids"]))
+        return registered
+
+    async def _get_registered_document(self, document_key: int) -> Optional[dict]:
+        records = (
+            await self.documents_table.query()
+            .where(f"document_key = {document_key}")
+            .limit(1)
+            .to_list()
+        )
+        return records[0] if records else None
+
+    async def _register_document(
+        self,
+        document_key: int,
+        file_hash: int,
+        document_meta: dict,
+        with_graph: bool,
+        segment_ids: list[int],
+        produced: list[dict[str, list]],
+        registered: Optional[dict] = None,
+    ):
+        """Record the chunks, entities and edges produced by a document in the registry.
+
+        When only some segments of the document were re-processed, the records of the
+        unchanged segments are carried over from the previous registration.
+        """
+        # chunk id -> id of the segment it came from
+        chunk_segments = {
+            cid: p["segment_id"] for p in produced for cid in p["chunk_ids"]
+        }
+        # (entity id, chunk id) -> description
+        entity_descriptions = {}
+        for p in produced:
+            entity_descriptions.update(
+                zip(
+                    zip(p["entity_ids"], p["entity_chunk_ids"]),
+                    p["entity_descriptions"],
                 )
-                for ent in entities
-            ]
-            await _limited_gather(entity_coros, self.entity_upsert_concurrency)
+            )
+        edges = [edge for p in produced for edge in p["edges"]]
+        if registered is not None:
+            kept_segments = set(registered["segment_ids"]) & set(segment_ids)
+            if kept_segments:
+                kept_chunk_ids = set()
+                for cid, sid in zip(
+                    registered["chunk_ids"], registered["chunk_segment_ids"]
+                ):
+                    if sid in kept_segments:
+                        kept_chunk_ids.add(cid)
+                        chunk_segments.setdefault(cid, sid)
+                edges += [
+                    edge
+                    for edge in registered["edges"]
+                    if edge["chunk_id"] in kept_chunk_ids
+                ]
+                for eid, description, cid in zip(
+                    registered["entity_ids"],
+                    registered["entity_descriptions"],
+                    registered["entity_chunk_ids"],
+                ):
+                    if cid in kept_chunk_ids:
+                        entity_descriptions.setdefault((eid, cid), description)
+
+        record = {
+            "document_key": document_key,
+            "file_hash": file_hash,
+            "uri": document_meta.get("uri", ""),
+            "filename": document_meta.get("filename", ""),
+            "document_meta": json.dumps(document_meta, sort_keys=True),
+            "with_graph": with_graph,
+            "segment_ids": segment_ids,
+            "chunk_ids": list(chunk_segments.keys()),
+            "chunk_segment_ids": list(chunk_segments.values()),
+            "entity_ids": [eid for eid, _ in entity_descriptions],
+            "entity_descriptions": list(entity_descriptions.values()),
+            "entity_chunk_ids": [cid for _, cid in entity_descriptions],
+            "edges": edges,
+        }
+        await (
+            self.documents_table.merge_insert("document_key")
+            .when_matched_update_all()
+            .when_not_matched_insert_all()
+            .execute([record])
+        )
+
+    async def _retract_chunks(
+        self, document_key: int, chunk_ids: set[int], registered: dict
+    ) -> set[int]:
+        """Retract the chunks of a registered document from the knowledge base.
+
+        Chunks still referenced by another document are kept. The removed chunks are retracted
+        from the entities extracted from them and from the graph edges, the entities left without
+        any chunk are deleted, and the others are re-summarized from the descriptions they still
+        have, the descriptions extracted from the removed chunks being dropped.
+
+        Returns the ids of the deleted entities.
+        """
+        other_documents = f"document_key != {document_key}"
+        shared = set()
+        for record in await self._query_documents_having(
+            "chunk_ids", chunk_ids, ["chunk_ids"], other_documents
+        ):
+            shared.update(chunk_ids.intersection(record["chunk_ids"]))
+        removed = chunk_ids - shared
+        if not removed:
+            return set()
 
-            # Relation extraction & upsert
-            relations = await self.entity_extractor.relation(chunks, entities)
-            relation_coros = [self.gdb.upsert_relation(rel) for rel in relations]
-            await _limited_gather(relation_coros, self.relation_upsert_concurrency)
+        await self.vdb.delete_by_document_keys(self.chunks_table, list(removed))
+        self._known_chunk_ids.difference_update(removed)
+
+        entity_ids = list(dict.fromkeys(registered["entity_ids"]))
+        if not entity_ids:
+            return set()
+        # The descriptions the entities still get from the other documents
+        descriptions = defaultdict(list)
+        records = await self._query_documents_having(
+            "entity_ids",
+            entity_ids,
+            ["entity_ids", "entity_descriptions"],
+            other_documents,
+        )
+        for record in records:
+            for eid, description in zip(
+                record["entity_ids"], record["entity_descriptions"]
+            ):
+                descriptions[eid].append(description)
+        # and from the chunks kept of this document, a description extracted together
+        # with a removed chunk being stale
+        entries = list(
+            zip(
+                registered["entity_ids"],
+                registered["entity_descriptions"],
+                registered["entity_chunk_ids"],
+            )
+        )
+        stale = {
+            (eid, description) for eid, description, cid in entries if cid in removed
+        }
+        for eid, description, _ in entries:
+            if (eid, description) not in stale:
+                descriptions[eid].append(description)
+
+        # The entities are retracted from their rows, as those without relation are not
+        # in the graph
+        rows = await self.vdb.query_by_document_keys(
+            self.entities_table,
+            entity_ids,
+            [
+                "document_key",
+                "text",
+                "entity_type",
+                "description",
+                "chunk_ids",
+                "vector",
+            ],
+            self.chunk_lookup_batch_size,
+        )
+        dropped, affected = [], []
+        for row in rows:
+            remaining = [cid for cid in row["chunk_ids"] if cid not in removed]
+            if not remaining:
+                dropped.append(row["document_key"])
+            elif len(remaining) < len(row["chunk_ids"]):
+                affected.append((row, remaining))
+
+        async def _resummarize(row: dict, remaining: list[int]) -> dict:
+            """The row of an entity re-summarized from the descriptions it still has"""
+            properties = {**row, "chunk_ids": remaining}
+            description_list = list(dict.fromkeys(descriptions[row["document_key"]]))
+            if len(description_list) == 1:
+                description = description_list[0]
+            elif len(description_list) > 1:
+                description = await self.entity_summarizer.summarize_entity(
+                    row["text"], description_list
+                )
+            else:
+                description = row["description"]
+            if description != row["description"]:
+                properties["description"] = description
+                del properties["vector"]
+            return properties
+
+        properties_list = await _limited_gather(
+            [_resummarize(row, remaining) for row, remaining in affected],
+            self.kb_merge_concurrency,
+        )
+        await self.vdb.delete_by_document_keys(self.entities_table, dropped)
+        await self.vdb.upsert_texts(
+            texts_to_embed=[
+                properties["description"] for properties in properties_list
+            ],
+            properties_list=properties_list,
+            table=self.entities_table,
+        )
+        await self.gdb.retract_chunks(
+            entity_ids,
+            removed,
+            {
+                properties["document_key"]: properties["description"]
+                for properties in properties_list
+            },
+        )
+        return set(dropped)
+
+    def _drop_registered_entities(self, registered: dict, entity_ids: set[int]):
+        """Forget the deleted entities in a registry record"""
+        kept = [
+            entry
+            for entry in zip(
+                registered["entity_ids"],
+                registered["entity_descriptions"],
+                registered["entity_chunk_ids"],
+            )
+            if entry[0] not in entity_ids
+        ]
+        registered["entity_ids"] = [eid for eid, _, _ in kept]
+        registered["entity_descriptions"] = [description for _, description, _ in kept]
+        registered["entity_chunk_ids"] = [cid for _, _, cid in kept]
+
+    async def delete_document(self, document_uri: str) -> bool:
+        """Delete a document from the knowledge base.
+
+        The chunks only this document referenced are deleted, together with the entities and edges
+        extracted from them. Entities shared with other documents are re-summarized.
+
+        Args:
+            document_uri (str): The uri of the document, or its path if it was ingested without uri
+
+        Returns:
+            bool: Whether the document was in the knowledge base
+        """
+        document_key = compute_xxhash_id(document_uri)
+        registered = await self._get_registered_document(document_key)
+        if registered is None:
+            logger.warning(f"Document {document_uri} is not in the knowledge base")
+            return False
+
+        await self._retract_chunks(
+            document_key, set(registered["chunk_ids"]), registered
+        )
+        await self.documents_table.delete(f"document_key = {document_key}")
+        await self.gdb.dump()
+        logger.info(f"Deleted document {document_uri}")
+        return True
+
+    async def update_document(
+        self,
+        document_path: str,
+        content_type: str,
+        with_graph: bool = True,
+        document_meta: Optional[dict] = None,
+        loader_configs: Optional[dict] = None,
+    ):
+        """Update a document in the knowledge base.
+
+        The segments of the document which changed since the last ingestion are re-processed,
+        and the chunks, entities and edges of the removed segments are retracted. Equivalent to
+        insert_to_kb, which handles both new and already ingested documents.
+        """
+        await self.insert_to_kb(
+            document_path,
+            content_type,
+            with_graph=with_graph,
+            document_meta=document_meta,
+            loader_configs=loader_configs,
+        )
 
     async def insert_to_kb(
         self,
@@ -205,25 +846,102 @@ class HiRAG:
         logger.info(f"Loading the document from the document path: {document_path}")
 
         start_total = time.perf_counter()
-        documents = await asyncio.to_thread(
-            load_document,
-            document_path,
-            content_type,
-            document_meta,
-            loader_configs,
-            loader_type="mineru",
+        if document_meta is None:
+            document_meta = {}
+
+        # Skip the whole pipeline if the file and its metadata are unchanged since the last ingestion
+        document_key = compute_xxhash_id(document_meta.get("uri") or document_path)
+        file_hash = await asyncio.to_thread(compute_file_xxhash_id, document_path)
+        registered = await self._get_registered_document(document_key)
+        if (
+            registered is not None
+            and registered["file_hash"] == file_hash
+            and registered["document_meta"] == json.dumps(document_meta, sort_keys=True)
+            and (registered["with_graph"] or not with_graph)
+        ):
+            logger.info(f"Document {document_path} is unchanged, skip ingestion")
+            return
+        if registered is not None and (
+            registered["document_meta"] != json.dumps(document_meta, sort_keys=True)
+            or (with_graph and not registered["with_graph"])
+        ):
+            # the metadata is stored in every chunk, or the graph of the unchanged segments
+            # was never built, retract and re-process everything
+            await self._retract_chunks(
+                document_key, set(registered["chunk_ids"]), registered
+            )
+            registered = None
+
+        # the conversion runs on the event loop, so that many documents can be
+        # converted concurrently under the limit of the Markify client
+        documents = await aload_document(
+            document_path, content_type, document_meta, loader_configs
         )
         logger.info(f"Loaded {len(documents)} documents")
 
-        # Concurrently process all documents
-        tasks = [self._process_document(doc, with_graph) for doc in documents]
-        await asyncio.gather(*tasks)
+        # Only process the segments whose content changed since the last ingestion
+        if registered is not None:
+            # Retract the chunks of the segments which are no longer in the document
+            current_segments = {doc.id for doc in documents}
+            removed_chunk_ids = {
+                cid
+                for cid, sid in zip(
+                    registered["chunk_ids"], registered["chunk_segment_ids"]
+                )
+                if sid not in current_segments
+            }
+            dropped = await self._retract_chunks(
+                document_key, removed_chunk_ids, registered
+            )
+            self._drop_registered_entities(registered, dropped)
+
+            registered_segments = set(registered["segment_ids"])
+            changed_documents = [
+                doc for doc in documents if doc.id not in registered_segments
+            ]
+            logger.info(
+                f"{len(changed_documents)} of {len(documents)} documents changed since the last ingestion"
+            )
+        else:
+            changed_documents = documents
+
+        segment_ids = [doc.id for doc in documents]
+        produced = await self._process_documents(
+            changed_documents, with_graph, document_key
+        )
 
         # dump the graph
         await self.gdb.dump()
 
+        await self._register_document(
+            document_key,
+            file_hash,
+            document_meta,
+            with_graph,
+            segment_ids,
+            produced,
+            registered,
+        )
+        # the document is stored, its extractions do not need to be resumed anymore
+        journal = getattr(self.entity_extractor, "journal", None)
+        if journal is not None:
+            await journal.forget(cid for p in produced for cid in p["chunk_ids"])
+        triage_skipped_calls = getattr(
+            self.entity_extractor, "triage_skipped_calls", None
+        )
+        if triage_skipped_calls is not None:
+            skipped_calls = triage_skipped_calls.pop(document_key, 0)
+            logger.info(
+                f"Skipped {skipped_calls} LLM calls on low-information chunks of {document_path}"
+            )
+
         total = time.perf_counter() - start_total
         logger.info(f"Total pipeline time: {total:.3f}s")
+        token_usage = self.chat_service.token_usage
+        logger.info(
+            f"Prompt cache hit rate: {token_usage.prompt_cache_hit_rate:.1%} "
+            f"of {token_usage.prompt_tokens} prompt tokens"
+        )
 
     async def query_chunks(self, query: str, topk: int = 10) -> list[dict[str, Any]]:
         chunks = await self.vdb.query(
@@ -293,3 +1011,4 @@ class HiRAG:
     async def clean_up(self):
         await self.gdb.clean_up()
         await self.vdb.clean_up()
+        await asyncio.to_thread(self.chunk_pool.shutdown)
@@ -53,6 +53,17 @@ PPTAGENT_LOADER_CONFIGS = {
 }
 
 
+def _create_loader(content_type: str, loader_configs: dict):
+    if content_type not in loader_configs:
+        raise ValueError(f"Unsupported document type: {content_type}")
+    loader_conf = loader_configs[content_type]
+    if "init_args" in loader_conf:
+        loader = loader_conf["loader"](**loader_conf["init_args"])
+    else:
+        loader = loader_conf["loader"]()
+    return loader, loader_conf
+
+
 def load_document(
     document_path: str,
     content_type: str,
@@ -79,13 +90,7 @@ def load_document(
     elif loader_configs is None and loader_type == "pptagent":
         loader_configs = PPTAGENT_LOADER_CONFIGS
 
-    if content_type not in loader_configs:
-        raise ValueError(f"Unsupported document type: {content_type}")
-    loader_conf = loader_configs[content_type]
-    if "init_args" in loader_conf:
-        loader = loader_conf["loader"](**loader_conf["init_args"])
-    else:
-        loader = loader_conf["loader"]()
+    loader, loader_conf = _create_loader(content_type, loader_configs)
 
     if loader_type == "langchain":
         if "args" in loader_conf:
@@ -110,12 +115,42 @@ def load_document(
     return raw_docs
 
 
+async def aload_document(
+    document_path: str,
+    content_type: str,
+    document_meta: Optional[dict] = None,
+    loader_configs: Optional[dict] = None,
+) -> List[File]:
+    """Load a document with the asynchronous markify(MinerU) client
+
+    Many documents can be loaded concurrently, the conversions being limited by the
+    concurrency of the client shared by the loaders.
+
+    Args:
+        document_path (str): The path to the document.
+        content_type (str): The content type of the document.
+        document_meta (Optional[dict]): The metadata of the document.
+        loader_configs (Optional[dict]): If unspecified, use DEFAULT_LOADER_CONFIGS.
+
+    Raises:
+        ValueError: If the content type is not supported.
+
+    Returns:
+        List[File]: The loaded documents.
+    """
+    if loader_configs is None:
+        loader_configs = DEFAULT_LOADER_CONFIGS
+    loader, _ = _create_loader(content_type, loader_configs)
+    return await loader.aload_markify(document_path, document_meta, "advanced")
+
+
 __all__ = [
     "PowerPointLoader",
     "PDFLoader",
     "WordLoader",
     "ExcelLoader",
     "load_document",
+    "aload_document",
     "HTMLLoader",
     "CSVLoader",
     "PPTParser",
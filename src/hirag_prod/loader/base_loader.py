@@ -1,4 +1,5 @@
 #! /usr/bin/env python3
+import asyncio
 import os
 from abc import ABC
 from typing import List, Optional, Type
@@ -7,10 +8,11 @@ from langchain_core.document_loaders import BaseLoader as LangchainBaseLoader
 from pptagent.document import Document
 from pptagent.llms import LLM
 
-from hirag_prod._utils import compute_mdhash_id
-from hirag_prod.schema import File, FileMetadata
+from hirag_prod._utils import compute_xxhash_id
+from hirag_prod.chunk import MarkdownChunk
+from hirag_prod.schema import File, FileMetadata, TokenizedText
 
-from .markify_loader import MarkifyClient
+from .markify_loader import AsyncMarkifyClient, MarkifyClient, async_markify_client
 
 
 class BaseLoader(ABC):
@@ -18,6 +20,8 @@ class BaseLoader(ABC):
 
     loader_type: Type[LangchainBaseLoader]
     loader_markify: Type[MarkifyClient]
+    # shared by all the loaders, so that its concurrency limit applies to all the files
+    async_loader_markify: AsyncMarkifyClient = async_markify_client
     # additional metadata to add to the loaded raw documents
     page_number_key: str = "page_number"
 
@@ -27,7 +31,7 @@ class BaseLoader(ABC):
         for i, doc in enumerate(raw_docs, start=1):
             # Only set page number and doc hash here
             doc = File(
-                id=compute_mdhash_id(doc.page_content, prefix="doc-"),
+                id=compute_xxhash_id(doc.page_content),
                 page_content=doc.page_content,
                 metadata=FileMetadata(page_number=i),
             )
@@ -36,21 +40,33 @@ class BaseLoader(ABC):
 
     def _load_markify(self, document_path: str, mode="advanced") -> List[File]:
         raw_text = self.loader_markify.convert_pdf(file_path=document_path, mode=mode)
+        return self._split_markify(raw_text)
 
-        # Split text into chunks based on token limit
-        text_chunks = self.loader_markify.split_text_by_tokens(
-            raw_text, max_tokens=6000
+    async def _aload_markify(self, document_path: str, mode="advanced") -> List[File]:
+        raw_text = await self.async_loader_markify.convert_pdf(
+            file_path=document_path, mode=mode
         )
+        # tokenizing and splitting is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(self._split_markify, raw_text)
+
+    def _split_markify(self, raw_text: str) -> List[File]:
+        # Split the markdown into pages on block boundaries, so tables and sections stay
+        # whole. The markdown is encoded once, and each page keeps its part of the tokens
+        # for the chunker
+        tokenized = TokenizedText.encode(raw_text)
+        text_chunks = MarkdownChunk(chunk_size=6000).split_tokenized(tokenized)
 
         # Create Document objects for each chunk
         docs = []
-        for i, chunk in enumerate(text_chunks, start=1):
+        for i, (chunk, span) in enumerate(text_chunks, start=1):
             # Only set page number and doc hash here
             doc = File(
-                id=compute_mdhash_id(chunk.strip(), prefix="doc-"),
+                id=compute_xxhash_id(chunk.strip()),
                 page_content=chunk,
                 metadata=FileMetadata(page_number=i),
             )
+            if span is not None:
+                doc.set_tokens(tokenized.span(*span))
             docs.append(doc)
 
         return docs
@@ -93,6 +109,25 @@ class BaseLoader(ABC):
         self._set_doc_metadata(raw_docs, document_meta)
         return raw_docs
 
+    async def aload_markify(
+        self, document_path: str, document_meta: Optional[dict] = None, mode="advanced"
+    ) -> List[File]:
+        """Load document with the asynchronous markify(MinerU) client and set the metadata
+
+        Args:
+            document_path (str): The document path for markify loader to use.
+            document_meta (Optional[dict]): The document metadata to set to the output.
+            mode (str): The mode for the markify loader.
+
+        Returns:
+            list[File]: Raw documents.
+        """
+        if document_meta is None:
+            document_meta = {}
+        raw_docs = await self._aload_markify(document_path, mode)
+        self._set_doc_metadata(raw_docs, document_meta)
+        return raw_docs
+
     def _set_doc_metadata(self, docs: List[File], document_meta: dict) -> List[File]:
         for doc in docs:
             # Keep the original page number
@@ -1,10 +1,15 @@
+import asyncio
+import os
+import random
 import time
-from typing import List, Optional, Union
+from typing import Awaitable, Callable, List, Optional, Sequence, Union
 
+import httpx
 import requests
-import tiktoken
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
+from hirag_prod.schema import TokenizedText
+
 
 class MarkifyClient:
     def __init__(
@@ -38,22 +43,23 @@ class MarkifyClient:
         # content type detection
         if not content_type:
             content_type = self._detect_mime_type(file_path)
-        # request body
-        multipart_data = MultipartEncoder(
-            fields={
-                "file": (file_path, open(file_path, "rb"), content_type),
-                "mode": mode or self.default_mode,
-            }
-        )
-        response = self.session.post(
-            url=endpoint,
-            data=multipart_data,
-            headers={
-                "Accept": "application/json",
-                "Content-Type": multipart_data.content_type,
-            },
-            timeout=self.timeout,
-        )
+        with open(file_path, "rb") as file:
+            # request body
+            multipart_data = MultipartEncoder(
+                fields={
+                    "file": (file_path, file, content_type),
+                    "mode": mode or self.default_mode,
+                }
+            )
+            response = self.session.post(
+                url=endpoint,
+                data=multipart_data,
+                headers={
+                    "Accept": "application/json",
+                    "Content-Type": multipart_data.content_type,
+                },
+                timeout=self.timeout,
+            )
         response.raise_for_status()
         return response.json()["job_id"]
 
@@ -131,30 +137,228 @@ class MarkifyClient:
 
     def split_text_by_tokens(self, text: str, max_tokens: int = 8192) -> List[str]:
         """Split text into chunks based on token limit."""
-        encoding = tiktoken.get_encoding("cl100k_base")
-        tokens = encoding.encode(text)
-        chunks = []
-
-        current_chunk = []
-        current_length = 0
-
-        for token in tokens:
-            if current_length + 1 > max_tokens:
-                # Decode current chunk and add to chunks
-                chunk_text = encoding.decode(current_chunk)
-                chunks.append(chunk_text)
-                current_chunk = [token]
-                current_length = 1
+        # encoded once, then cut at every max_tokens tokens through the token offsets
+        return [piece.text for piece in TokenizedText.encode(text).split(max_tokens)]
+
+
+class AsyncMarkifyClient:
+    """
+    Asynchronous Markify client, for converting many files at once.
+
+    At most max_concurrency files are converted at the same time, the others wait for
+    their turn before being uploaded. The uploads are streamed from disk, the job status
+    is polled with an exponential backoff with jitter, from poll_min_interval up to
+    poll_max_interval seconds, and the results can be streamed to disk. The requests
+    failing with a connection error or a retryable status are retried up to max_retries
+    times, with the same backoff.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        base_url: str = "http://markify:20926",
+        timeout: int = 30,
+        default_mode: str = "simple",
+        max_concurrency: int = 8,
+        poll_min_interval: float = 0.5,
+        poll_max_interval: float = 30.0,
+        max_retries: int = 3,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.default_mode = default_mode
+        self.max_concurrency = max_concurrency
+        self.poll_min_interval = poll_min_interval
+        self.poll_max_interval = poll_max_interval
+        self.max_retries = max_retries
+        self.transport = transport
+        # the client and the semaphore belong to the event loop they were created in
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, timeout=self.timeout, transport=self.transport
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "AsyncMarkifyClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter, in seconds"""
+        delay = min(self.poll_max_interval, self.poll_min_interval * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _send(
+        self, send: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await send()
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
             else:
-                current_chunk.append(token)
-                current_length += 1
+                if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def create_job(
+        self,
+        file_path: str,
+        mode: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> str:
+        client = self._get_client()
+        if not content_type:
+            content_type = MarkifyClient._detect_mime_type(file_path)
+
+        async def _upload() -> httpx.Response:
+            # the file is read in chunks while it is sent, and reopened on a retry
+            with open(file_path, "rb") as file:
+                return await client.post(
+                    "/api/jobs",
+                    files={"file": (file_path, file, content_type)},
+                    data={"mode": mode or self.default_mode},
+                    headers={"Accept": "application/json"},
+                )
 
-        # Add the last chunk if it's not empty
-        if current_chunk:
-            chunk_text = encoding.decode(current_chunk)
-            chunks.append(chunk_text)
+        response = await self._send(_upload)
+        response.raise_for_status()
+        return response.json()["job_id"]
+
+    async def get_job_status(self, job_id: str) -> dict:
+        client = self._get_client()
+        response = await self._send(
+            lambda: client.get(
+                f"/api/jobs/{job_id}", headers={"Accept": "application/json"}
+            )
+        )
+        if response.status_code == 404:
+            raise ValueError("Job ID not found")
+        response.raise_for_status()
+        return response.json()
 
-        return chunks
+    async def get_result(
+        self, job_id: str, output_file: Optional[str] = None
+    ) -> Union[str, None]:
+        client = self._get_client()
+        request = client.build_request(
+            "GET", f"/api/jobs/{job_id}/result", headers={"Accept": "text/markdown"}
+        )
+        response = await self._send(lambda: client.send(request, stream=True))
+        try:
+            if response.status_code == 202:
+                raise RuntimeError("Job still processing")
+            response.raise_for_status()
+            if output_file:
+                with open(output_file, "wb") as f:
+                    async for data in response.aiter_bytes():
+                        f.write(data)
+                return None
+            await response.aread()
+            return response.text
+        finally:
+            await response.aclose()
+
+    async def convert(
+        self,
+        file_path: str,
+        mode: Optional[str] = None,
+        output_file: Optional[str] = None,
+        max_wait: int = 3600,
+    ) -> Union[str, None]:
+        """
+        Convert a file to markdown.
+        Args:
+            file_path: The path of the file.
+            mode: The conversion mode, default_mode if None.
+            output_file: The file the markdown is streamed to, if any.
+            max_wait: The time allowed for the conversion, in seconds.
+        Returns:
+            The markdown, or None when it is written to output_file.
+        """
+        self._get_client()
+        async with self._semaphore:
+            start_time = time.monotonic()
+            job_id = await self.create_job(file_path, mode)
+            attempt = 0
+            while True:
+                status = await self.get_job_status(job_id)
+                if status["status"] == "completed":
+                    return await self.get_result(job_id, output_file)
+                elif status["status"] == "failed":
+                    raise RuntimeError(f"Job failed: {status.get('error')}")
+                delay = self._backoff(attempt)
+                if time.monotonic() - start_time + delay > max_wait:
+                    raise TimeoutError("Max wait time exceeded")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def convert_pdf(
+        self,
+        file_path: str,
+        mode: Optional[str] = None,
+        max_wait: int = 3600,
+    ) -> str:
+        return await self.convert(file_path, mode, max_wait=max_wait)
+
+    async def convert_many(
+        self,
+        file_paths: Sequence[str],
+        mode: Optional[str] = None,
+        output_dir: Optional[str] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[str, None, BaseException]]:
+        """
+        Convert many files concurrently, max_concurrency at a time.
+        Args:
+            file_paths: The paths of the files.
+            mode: The conversion mode, default_mode if None.
+            output_dir: The directory the markdown of each file is streamed to, as
+                <file name>.md, if any.
+            return_exceptions: Whether a failed conversion returns its exception
+                instead of raising it.
+        Returns:
+            The markdown of each file, or None when it is written to output_dir.
+        """
+        return await asyncio.gather(
+            *[
+                self.convert(
+                    file_path,
+                    mode,
+                    output_file=(
+                        os.path.join(
+                            output_dir,
+                            os.path.splitext(os.path.basename(file_path))[0] + ".md",
+                        )
+                        if output_dir
+                        else None
+                    ),
+                )
+                for file_path in file_paths
+            ],
+            return_exceptions=return_exceptions,
+        )
 
 
 markify_client = MarkifyClient(base_url="http://markify:20926")
+async_markify_client = AsyncMarkifyClient(base_url="http://markify:20926")
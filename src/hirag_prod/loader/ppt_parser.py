@@ -1,4 +1,3 @@
-import hashlib
 import json
 import os
 import pickle
@@ -13,6 +12,7 @@ from pptagent.multimodal import ImageLabler
 from pptagent.presentation import Presentation
 from pptagent.utils import Config, get_logger, pjoin, ppt_to_images
 
+from hirag_prod._utils import compute_xxhash_id
 from hirag_prod.schema import File, FileMetadata
 
 # Configure logger
@@ -81,7 +81,7 @@ class PPTParser:
                 continue
             # Generate a unique id using template_id and work_dir
             unique_str = f"{self.work_dir}-{template_id}"
-            unique_id = hashlib.md5(unique_str.encode("utf-8")).hexdigest()
+            unique_id = compute_xxhash_id(unique_str)
             template_obj = File(
                 id=unique_id,
                 page_content=json.dumps(template, ensure_ascii=False, indent=2),
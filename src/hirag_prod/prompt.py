@@ -493,6 +493,40 @@ Output:
 """
 
 
+PROMPTS[
+    "fold_entity_description"
+] = """You are a helpful assistant responsible for keeping the description of an entity up to date.
+Given the current description of the entity and a list of new descriptions of it, please write a single, comprehensive description. Make sure to keep the information of the current description and to add the information collected from the new descriptions.
+If the descriptions are contradictory, please resolve the contradictions and provide a single, coherent summary.
+Make sure it is written in third person, and include the entity name so we the have full context.
+
+#######
+-Data-
+Entity: {entity_name}
+Current Description: {current_description}
+New Descriptions: {new_descriptions}
+#######
+Output:
+"""
+
+
+PROMPTS[
+    "packed_chunks_instruction"
+] = """The text below is made of several chunks, each enclosed in <chunk id="..."></chunk> tags, the ids being numbered from 1. Extract from each chunk separately.
+Before the records extracted from a chunk, output the opening tag of the chunk, <chunk id="...">, on its own line with the same id.
+"""
+
+PROMPTS[
+    "entity_resolution"
+] = """Do the two entities below refer to the same real-world entity, under different names? Answer YES | NO.
+
+Entity A: {name_a} ({type_a})
+Description: {description_a}
+
+Entity B: {name_b} ({type_b})
+Description: {description_b}
+"""
+
 PROMPTS[
     "entity_continue_extraction"
 ] = """MANY entities were missed in the last extraction.  Add them below using the same format:
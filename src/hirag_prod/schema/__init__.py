@@ -2,5 +2,6 @@ from .chunk import Chunk
 from .entity import Entity
 from .file import File, FileMetadata
 from .relation import Relation
+from .tokenized_text import TokenizedText
 
-__all__ = ["File", "FileMetadata", "Chunk", "Entity", "Relation"]
+__all__ = ["File", "FileMetadata", "Chunk", "Entity", "Relation", "TokenizedText"]
@@ -8,12 +8,12 @@ class ChunkMetadata(FileMetadata):
     # The index of the chunk in the document
     chunk_idx: int
     # The id of the document that the chunk is from
-    document_id: str
+    document_id: int
 
 
 class Chunk(Document, BaseModel):
-    # "chunk-mdhash(chunk_content)"
-    id: str
+    # xxhash64(chunk content)
+    id: int
     # The content of the chunk
     page_content: str
     # The metadata of the chunk
@@ -6,11 +6,12 @@ from pydantic import BaseModel, field_validator
 class EntityMetadata(BaseModel):
     entity_type: str
     description: str
-    chunk_ids: List[str]
+    chunk_ids: List[int]
 
 
 class Entity(BaseModel):
-    id: str
+    # xxhash64(entity name)
+    id: int
     page_content: str
     metadata: EntityMetadata
 
@@ -1,7 +1,9 @@
 from typing import Literal, Optional
 
 from langchain_core.documents import Document
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+
+from .tokenized_text import TokenizedText
 
 
 class FileMetadata(BaseModel):
@@ -32,9 +34,26 @@ class FileMetadata(BaseModel):
 
 
 class File(Document, BaseModel):
-    # "file-mdhash(filename)"
-    id: str
+    # xxhash64(file content)
+    id: int
     # The content of the file
     page_content: str
     # The metadata of the file
     metadata: FileMetadata
+    # The tokens of the content, when the loader already tokenized it
+    _tokens: Optional[TokenizedText] = PrivateAttr(default=None)
+
+    @property
+    def tokens(self) -> Optional[TokenizedText]:
+        """The tokens attached to the content, if any"""
+        return self._tokens
+
+    def set_tokens(self, tokens: TokenizedText):
+        """Attach the tokens of the content, for the chunkers to reuse"""
+        self._tokens = tokens
+
+    def tokenized(self, encoding_name: str = "cl100k_base") -> TokenizedText:
+        """The tokens of the content, encoded only if the loader did not attach them"""
+        if self._tokens is None or self._tokens.encoding_name != encoding_name:
+            self._tokens = TokenizedText.encode(self.page_content, encoding_name)
+        return self._tokens
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from hirag_prod._utils import get_encoder
+
+
+@dataclass
+class TokenizedText:
+    """
+    A text with its tiktoken tokens, encoded once and shared by the loader and the chunkers.
+
+    offsets[i] is the index in the text where token i starts, and offsets[-1] is the length
+    of the text, so that any token range maps back to the text, and any text span to its
+    token count, without encoding again. A text cut out of a larger one keeps the tokens
+    overlapping it, whose first and last may straddle its edges.
+    """
+
+    text: str
+    # int32 token ids
+    tokens: np.ndarray
+    # int64 character offsets, one more than the tokens
+    offsets: np.ndarray
+    encoding_name: str = "cl100k_base"
+
+    @classmethod
+    def encode(cls, text: str, encoding_name: str = "cl100k_base") -> "TokenizedText":
+        encoder = get_encoder(encoding_name)
+        tokens = encoder.encode(text, disallowed_special=())
+        _, offsets = encoder.decode_with_offsets(tokens) if tokens else ("", [])
+        return cls(
+            text=text,
+            tokens=np.asarray(tokens, dtype=np.int32),
+            offsets=np.asarray(offsets + [len(text)], dtype=np.int64),
+            encoding_name=encoding_name,
+        )
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def token_range(self, start: int, end: int) -> tuple[int, int]:
+        """The range of the tokens overlapping the text span [start, end)"""
+        first = max(np.searchsorted(self.offsets, start, side="right") - 1, 0)
+        last = np.searchsorted(self.offsets[:-1], end, side="left")
+        return int(first), int(max(last, first))
+
+    def count_tokens(self, start: int, end: int) -> int:
+        """Number of tokens of the text span [start, end)"""
+        first, last = self.token_range(start, end)
+        return last - first
+
+    def slice(self, first: int, last: int) -> "TokenizedText":
+        """The tokens [first, last) and their text, sharing the arrays of this text"""
+        start, end = self.offsets[first], self.offsets[last]
+        return TokenizedText(
+            text=self.text[start:end],
+            tokens=self.tokens[first:last],
+            offsets=self.offsets[first : last + 1] - start,
+            encoding_name=self.encoding_name,
+        )
+
+    def span(self, start: int, end: int) -> "TokenizedText":
+        """The text span [start, end) and the tokens overlapping it"""
+        first, last = self.token_range(start, end)
+        offsets = np.clip(self.offsets[first : last + 1] - start, 0, end - start)
+        offsets[-1] = end - start
+        return TokenizedText(
+            text=self.text[start:end],
+            tokens=self.tokens[first:last],
+            offsets=offsets,
+            encoding_name=self.encoding_name,
+        )
+
+    def split(self, max_tokens: int) -> List["TokenizedText"]:
+        """Consecutive pieces of up to max_tokens tokens, by vectorized slicing"""
+        bounds = np.append(np.arange(0, len(self), max_tokens), len(self))
+        return [self.slice(first, last) for first, last in zip(bounds[:-1], bounds[1:])]
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Dict, List, Set
 
 from hirag_prod.schema import Entity, Relation
 
@@ -9,6 +9,27 @@ class BaseGDB(ABC):
     async def upsert_relation(self, relation: Relation):
         raise NotImplementedError
 
+    async def upsert_relations(self, relations: List[Relation]):
+        for relation in relations:
+            await self.upsert_relation(relation)
+
+    @abstractmethod
+    def buffer_relations(self, relations: List[Relation]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def flush(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def retract_chunks(
+        self,
+        node_ids: List[int],
+        chunk_ids: Set[int],
+        descriptions: Dict[int, str],
+    ) -> List[int]:
+        raise NotImplementedError
+
     @abstractmethod
     async def query_one_hop(self, query: str) -> (List[Entity], List[Relation]):
         raise NotImplementedError
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Callable, List, Literal
+from typing import Any, Callable, List, Literal, Optional, Union
 
 
 class BaseVDB(ABC):
@@ -14,6 +14,44 @@ class BaseVDB(ABC):
     ):
         raise NotImplementedError
 
+    @abstractmethod
+    async def upsert_texts(
+        self,
+        texts_to_embed: List[str],
+        properties_list: List[dict],
+        table: Any,
+        key_column: str = "document_key",
+    ):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_by_document_keys(
+        self,
+        table: Any,
+        document_keys: List[Union[int, str]],
+        batch_size: int = 1000,
+    ):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_by_document_keys(
+        self,
+        table: Any,
+        document_keys: List[Union[int, str]],
+        columns: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def query_existing_keys(
+        self,
+        table: Any,
+        document_keys: List[Union[int, str]],
+        batch_size: int = 1000,
+    ) -> set:
+        raise NotImplementedError
+
     @abstractmethod
     async def query(self, query: str) -> List[dict]:
         raise NotImplementedError
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List, Literal, Optional
+from typing import List, Literal, Optional, Union
 
 import lancedb
 
@@ -61,10 +61,70 @@ class LanceDB(BaseVDB):
             await table.add([properties], mode=mode)
             return table
 
-    def add_filter_by_document_keys(self, document_list: Optional[List[str]], query):
+    async def upsert_texts(
+        self,
+        texts_to_embed: List[str],
+        properties_list: List[dict],
+        table: lancedb.AsyncTable,
+        key_column: str = "document_key",
+    ) -> lancedb.AsyncTable:
+        """Embed the texts in one batch and upsert the rows by key
+
+        Rows whose key already exists in the table are replaced, the others are inserted.
+        Rows whose properties already hold a "vector" keep it, and their text is not embedded.
+
+        Args:
+            texts_to_embed (List[str]): the texts to embed, one per row
+            properties_list (List[dict]): the other columns of each row
+            table (lancedb.AsyncTable): the table to upsert into
+            key_column (str): the column identifying a row
+        """
+        if not texts_to_embed:
+            return table
+        to_embed = [
+            i
+            for i, properties in enumerate(properties_list)
+            if "vector" not in properties
+        ]
+        rows = [dict(properties) for properties in properties_list]
+        if to_embed:
+            embeddings = await self.embedding_func(
+                [texts_to_embed[i] for i in to_embed]
+            )
+            for i, embedding in zip(to_embed, embeddings):
+                rows[i]["vector"] = embedding.tolist()
+        await (
+            table.merge_insert(key_column)
+            .when_matched_update_all()
+            .when_not_matched_insert_all()
+            .execute(rows)
+        )
+        return table
+
+    async def delete_by_document_keys(
+        self,
+        table: lancedb.AsyncTable,
+        document_keys: List[Union[int, str]],
+        batch_size: int = 1000,
+    ):
+        """Delete the rows of the given document keys from the table"""
+        for i in range(0, len(document_keys), batch_size):
+            batch = [
+                str(doc) if isinstance(doc, int) else f"'{doc}'"
+                for doc in document_keys[i : i + batch_size]
+            ]
+            await table.delete(f"document_key in ({','.join(batch)})")
+
+    def add_filter_by_document_keys(
+        self, document_list: Optional[List[Union[int, str]]], query
+    ):
         filter_expr = None
         if document_list is not None and len(document_list) > 0:
-            document_list = [f"'{doc}'" for doc in document_list]
+            # integer ids are compared as numbers, string keys as quoted literals
+            document_list = [
+                str(doc) if isinstance(doc, int) else f"'{doc}'"
+                for doc in document_list
+            ]
             filter_expr = f"document_key in ({','.join(document_list)})"
             # prefilter before searching the nearest neighbors
             query = query.where(filter_expr)
@@ -77,12 +137,60 @@ class LanceDB(BaseVDB):
             query = query.where(f"private = {require_access == 'private'}")
         return query
 
+    async def query_by_document_keys(
+        self,
+        table: lancedb.AsyncTable,
+        document_keys: List[Union[int, str]],
+        columns: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> List[dict]:
+        """Return the rows of the given document keys, fetched in batches
+
+        Args:
+            table (lancedb.AsyncTable): The lancedb table to look up.
+            document_keys (List[Union[int, str]]): The document keys to look up.
+            columns (Optional[List[str]]): The columns to fetch, None for all of them.
+            batch_size (int): The number of keys fetched by a single filter query.
+
+        Returns:
+            List[dict]: The rows found in the table.
+        """
+        rows = []
+        for i in range(0, len(document_keys), batch_size):
+            batch = document_keys[i : i + batch_size]
+            query = self.add_filter_by_document_keys(batch, table.query())
+            if columns is not None:
+                query = query.select(columns)
+            rows.extend(await query.to_list())
+        return rows
+
+    async def query_existing_keys(
+        self,
+        table: lancedb.AsyncTable,
+        document_keys: List[Union[int, str]],
+        batch_size: int = 1000,
+    ) -> set:
+        """Return the subset of the document keys which already exist in the table
+
+        Args:
+            table (lancedb.AsyncTable): The lancedb table to look up.
+            document_keys (List[Union[int, str]]): The document keys to look up.
+            batch_size (int): The number of keys checked by a single filter query.
+
+        Returns:
+            set: The document keys found in the table.
+        """
+        rows = await self.query_by_document_keys(
+            table, document_keys, ["document_key"], batch_size
+        )
+        return {row["document_key"] for row in rows}
+
     async def query(
         self,
         query: str,
         table: lancedb.AsyncTable,
         topk: Optional[int] = TOPK,
-        document_list: Optional[List[str]] = None,
+        document_list: Optional[List[Union[int, str]]] = None,
         require_access: Optional[Literal["private", "public"]] = None,
         columns_to_select: Optional[List[str]] = ["filename", "text"],
         distance_threshold: Optional[float] = THRESHOLD_DISTANCE,
@@ -93,7 +201,7 @@ class LanceDB(BaseVDB):
             table (Union[lancedb.AsyncTable, lancedb.table.Table]): The lancedb table to search.
             text (str): The query string.
             topk (Optional[int]): The number of results to return. Defaults to 10.
-            document_list (Optional[List[str]]): The list of documents (by document_key url) to search in.
+            document_list (Optional[List[Union[int, str]]]): The list of documents (by document_key) to search in.
             columns_to_select (Optional[List[str]]): The columns to select from the table.
             distance_threshold (Optional[float]): The distance threshold to use.
 
@@ -1,14 +1,17 @@
 import asyncio
 import os
 import pickle
-from dataclasses import dataclass
-from typing import Callable, List, Optional
+import sys
+from collections import Counter, defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 import networkx as nx
 
 from hirag_prod.schema import Entity, Relation
 from hirag_prod.storage.base_gdb import BaseGDB
-from hirag_prod.summarization import BaseSummarizer, TrancatedAggregateSummarizer
+from hirag_prod.summarization import BaseSummarizer, MapReduceSummarizer
 
 
 @dataclass
@@ -18,6 +21,10 @@ class NetworkXGDB(BaseGDB):
     llm_func: Callable
     llm_model_name: str
     summarizer: Optional[BaseSummarizer]
+    # Per-node locks to serialize the merges of the same node
+    node_locks: Dict[int, asyncio.Lock] = field(default_factory=dict)
+    # Relations waiting to be written to the graph in bulk
+    write_buffer: List[Relation] = field(default_factory=list)
 
     @classmethod
     def create(
@@ -32,7 +39,7 @@ class NetworkXGDB(BaseGDB):
         else:
             graph = cls.load(path)
         if summarizer is None:
-            summarizer = TrancatedAggregateSummarizer(
+            summarizer = MapReduceSummarizer(
                 extract_func=llm_func, llm_model_name=llm_model_name
             )
         return cls(
@@ -43,101 +50,208 @@ class NetworkXGDB(BaseGDB):
             summarizer=summarizer,
         )
 
-    async def _upsert_node(
-        self, node: Entity, record_description: Optional[str] = None
-    ) -> Optional[str]:
+    def _get_node_lock(self, node_id: int) -> asyncio.Lock:
+        lock = self.node_locks.get(node_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.node_locks[node_id] = lock
+        return lock
+
+    @asynccontextmanager
+    async def _lock_nodes(self, node_ids: Iterable[int]):
+        """
+        Hold the locks of all the given nodes.
+
+        The locks are acquired in sorted order, so that two batches touching overlapping
+        nodes can never deadlock each other.
         """
-        Upsert a node into the graph.
+        async with AsyncExitStack() as stack:
+            for node_id in sorted(set(node_ids)):
+                await stack.enter_async_context(self._get_node_lock(node_id))
+            yield
 
-        Thiy method adds a new node to the graph if it doesn't exist, or updates an existing node.
-        For concurrent upsertion, we use the following strategy:
-        If the node not in the graph, add it. Use the database's transaction atomic to
-        ensure the consistency of the graph.
-        If the node in the graph, we record the description which we use to update the current node.
-        If the record_description is the same as the description in the graph, we update the node, otherwise
-        return the description in the graph, to generate the new description.
+    async def _merge_node(
+        self, node_id: int, nodes: List[Entity]
+    ) -> Tuple[int, Dict[str, Any]]:
+        """
+        Resolve all pending versions of a node with a single summarization.
+
+        The caller must hold the lock of the node. The descriptions of the pending nodes are
+        combined with the description already in the graph (if any), and the summarizer is
+        only called when more than one distinct description remains. A pending version with
+        strictly more chunks than all the others together already merges them, and is taken
+        as is.
 
         Args:
-            node (Entity): The entity node to be inserted or updated
-            record_description (Optional[str]): Description to compare with existing node's description
+            node_id (int): The id of the node to be merged
+            nodes (List[Entity]): The pending versions of the node, all with the same id
 
         Returns:
-            Optional[str]: If the node exists and has a different description, returns the existing description.
-                            Otherwise returns None.
-
+            Tuple[int, Dict[str, Any]]: The node id and the merged attributes, ready for add_nodes_from
         """
-        if node.id not in self.graph.nodes:
-            try:
-                self.graph.add_nodes_from(
-                    [
-                        (
-                            node.id,
-                            {
-                                **node.metadata.__dict__,
-                                "entity_name": node.page_content,
-                            },
-                        )
-                    ]
-                )
-                return
-            except Exception as e:
-                # TODO: handle the exception
-                raise e
+        node_in_db = self.graph.nodes[node_id] if node_id in self.graph.nodes else None
+
+        description_list = []
+        chunk_ids = []
+        entity_types = []
+        if node_in_db is not None:
+            description_list.append(node_in_db["description"])
+            chunk_ids.extend(node_in_db.get("chunk_ids", []))
+            entity_types.append(node_in_db["entity_type"])
+        for node in nodes:
+            description_list.append(node.metadata.description)
+            chunk_ids.extend(node.metadata.chunk_ids)
+            entity_types.append(node.metadata.entity_type)
+        # keep the order of the descriptions while removing duplicates
+        description_list = list(dict.fromkeys(description_list))
+        # a version already merged with all the others, e.g. against the knowledge base,
+        # supersedes them: it has strictly more chunks than all of them together
+        versions = list(
+            {
+                (node.metadata.description, frozenset(node.metadata.chunk_ids)): node
+                for node in nodes
+            }.values()
+        )
+        for i, node in enumerate(versions):
+            other_chunk_ids = set(node_in_db.get("chunk_ids", []) if node_in_db else [])
+            for other in versions[:i] + versions[i + 1 :]:
+                other_chunk_ids.update(other.metadata.chunk_ids)
+            if other_chunk_ids < set(node.metadata.chunk_ids):
+                description_list = [node.metadata.description]
+                break
+
+        if len(description_list) == 1:
+            description = description_list[0]
         else:
-            node_in_db = self.graph.nodes[node.id]
-            latest_description = node_in_db["description"]
-            assert latest_description is not None
-            if record_description == latest_description:
-                self.graph.nodes[node.id].update(
-                    {**node.metadata.__dict__, "entity_name": node.page_content}
-                )
-                return
-            elif record_description is None:
-                record_description = node.metadata.description
-                if record_description == latest_description:
-                    # update an existing node
-                    # skip the merge process
-                    return
-                else:
-                    # require to merge with the latest description
-                    return latest_description
-            else:
-                # require to merge with the latest description
-                return latest_description
-
-    async def _merge_node(self, node: Entity, latest_description: str) -> Entity:
-        description_list = [node.metadata.description]
-        description = await self.summarizer.summarize_entity(
-            node.page_content, description_list
+            description = await self.summarizer.summarize_entity(
+                nodes[0].page_content, description_list
+            )
+
+        # entity types repeat across the whole graph, interning them lets the
+        # pickle store each distinct type once instead of once per node
+        return (
+            node_id,
+            {
+                "entity_type": sys.intern(Counter(entity_types).most_common(1)[0][0]),
+                "description": description,
+                "chunk_ids": list(dict.fromkeys(chunk_ids)),
+                "entity_name": nodes[0].page_content,
+            },
+        )
+
+    async def _merge_nodes(
+        self, nodes: List[Entity]
+    ) -> List[Tuple[int, Dict[str, Any]]]:
+        """Resolve the merges of all touched nodes in one pass. The caller must hold their locks."""
+        nodes_by_id = defaultdict(list)
+        for node in nodes:
+            nodes_by_id[node.id].append(node)
+        return await asyncio.gather(
+            *[
+                self._merge_node(node_id, pending)
+                for node_id, pending in nodes_by_id.items()
+            ]
         )
-        node.metadata.description = description
-        return node
 
     async def upsert_node(self, node: Entity):
-        record_description = None
-        while True:
-            latest_description = await self._upsert_node(node, record_description)
-            if latest_description is None:
-                break
-            else:
-                node = await self._merge_node(node, latest_description)
-                record_description = latest_description
+        await self.upsert_nodes([node])
 
     async def upsert_nodes(self, nodes: List[Entity]):
-        await asyncio.gather(*[self.upsert_node(node) for node in nodes])
+        """
+        Upsert nodes into the graph.
+
+        Nodes are grouped by id so that each touched node is merged exactly once, and the merge
+        of each node is guarded by a per-node lock, so concurrent upsertions of the same node
+        (e.g. a hub entity shared by many documents) never summarize the same description twice.
+        """
+        async with self._lock_nodes(node.id for node in nodes):
+            self.graph.add_nodes_from(await self._merge_nodes(nodes))
 
     async def upsert_relation(self, relation: Relation):
+        await self.upsert_relations([relation])
+
+    async def upsert_relations(self, relations: List[Relation]):
+        """
+        Upsert relations into the graph in bulk.
+
+        The endpoint merges are resolved in one pass, then the graph is written with a single
+        add_nodes_from and a single add_edges_from call.
+        """
+        nodes = [relation.source for relation in relations] + [
+            relation.target for relation in relations
+        ]
         try:
-            await self.upsert_node(relation.source)
-            await self.upsert_node(relation.target)
-            self.graph.add_edge(
-                relation.source.id, relation.target.id, **relation.properties
-            )
+            async with self._lock_nodes(node.id for node in nodes):
+                self.graph.add_nodes_from(await self._merge_nodes(nodes))
+                self.graph.add_edges_from(
+                    [
+                        (relation.source.id, relation.target.id, relation.properties)
+                        for relation in relations
+                    ]
+                )
         except Exception as e:
             # TODO: handle the exception
             raise e
 
-    async def query_node(self, node_id: str) -> Entity:
+    def buffer_relations(self, relations: List[Relation]):
+        """Add relations to the write buffer. They are written to the graph on the next flush."""
+        self.write_buffer.extend(relations)
+
+    async def flush(self):
+        """Write all buffered relations to the graph in one bulk upsert."""
+        relations, self.write_buffer = self.write_buffer, []
+        if relations:
+            await self.upsert_relations(relations)
+
+    async def retract_chunks(
+        self,
+        node_ids: List[int],
+        chunk_ids: Set[int],
+        descriptions: Dict[int, str],
+    ) -> List[int]:
+        """
+        Retract chunks from the given nodes and their edges.
+
+        The chunk ids are removed from each node. Nodes left without any chunk are dropped
+        together with their edges, and edges extracted from a retracted chunk are dropped.
+        The surviving nodes take their new description from descriptions. Nodes which are
+        not in the graph, as entities only enter it as relation endpoints, are skipped.
+
+        Args:
+            node_ids (List[int]): The nodes which may reference the retracted chunks
+            chunk_ids (Set[int]): The retracted chunk ids
+            descriptions (Dict[int, str]): The new description of each surviving node
+
+        Returns:
+            List[int]: The ids of the dropped nodes
+        """
+        node_ids = [node_id for node_id in set(node_ids) if node_id in self.graph]
+        async with self._lock_nodes(node_ids):
+            self.graph.remove_edges_from(
+                [
+                    (source, target)
+                    for source, target, chunk_id in self.graph.edges(
+                        node_ids, data="chunk_id"
+                    )
+                    if chunk_id in chunk_ids
+                ]
+            )
+
+            dropped = []
+            for node_id in node_ids:
+                node = self.graph.nodes[node_id]
+                node_chunk_ids = node.get("chunk_ids", [])
+                remaining = [cid for cid in node_chunk_ids if cid not in chunk_ids]
+                if not remaining:
+                    dropped.append(node_id)
+                elif len(remaining) < len(node_chunk_ids):
+                    node["chunk_ids"] = remaining
+                    if node_id in descriptions:
+                        node["description"] = descriptions[node_id]
+            self.graph.remove_nodes_from(dropped)
+        return dropped
+
+    async def query_node(self, node_id: int) -> Entity:
         node = self.graph.nodes[node_id]
         return Entity(
             id=node_id,
@@ -145,7 +259,7 @@ class NetworkXGDB(BaseGDB):
             metadata={k: v for k, v in node.items() if k != "entity_name"},
         )
 
-    async def query_edge(self, edge_id: str) -> Relation:
+    async def query_edge(self, edge_id: Tuple[int, int]) -> Relation:
         edge = self.graph.edges[edge_id]
         return Relation(
             source=await self.query_node(edge_id[0]),
@@ -153,7 +267,7 @@ class NetworkXGDB(BaseGDB):
             properties=edge,
         )
 
-    async def query_one_hop(self, node_id: str) -> (List[Entity], List[Relation]):
+    async def query_one_hop(self, node_id: int) -> (List[Entity], List[Relation]):
         neighbors = list(self.graph.neighbors(node_id))
         edges = list(self.graph.edges(node_id))
         return await asyncio.gather(
@@ -161,6 +275,7 @@ class NetworkXGDB(BaseGDB):
         ), await asyncio.gather(*[self.query_edge(edge) for edge in edges])
 
     async def dump(self):
+        await self.flush()
         if os.path.dirname(self.path) != "":
             os.makedirs(os.path.dirname(self.path), exist_ok=True)
         with open(self.path, "wb") as f:
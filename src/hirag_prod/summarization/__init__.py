@@ -1,4 +1,11 @@
 from .base import BaseSummarizer
+from .incremental_fold import IncrementalFoldSummarizer
+from .map_reduce import MapReduceSummarizer
 from .trancated_aggregate import TrancatedAggregateSummarizer
 
-__all__ = ["TrancatedAggregateSummarizer", "BaseSummarizer"]
+__all__ = [
+    "TrancatedAggregateSummarizer",
+    "IncrementalFoldSummarizer",
+    "MapReduceSummarizer",
+    "BaseSummarizer",
+]
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from typing import Callable, List, Set, Tuple
+
+from hirag_prod._utils import (
+    compute_xxhash_id,
+    encode_string_by_tiktoken,
+    encode_strings_by_tiktoken,
+)
+from hirag_prod.prompt import PROMPTS
+
+from .base import BaseSummarizer
+
+
+class IncrementalFoldSummarizer(BaseSummarizer):
+    """
+    Summarizer which folds the new descriptions of an entity into its current summary.
+
+    The first description is the current summary of the entity (the description in the
+    knowledge base or in the graph), the others are the new ones. The summarizer remembers
+    each summary it produced with its token count and the descriptions it covers, so that a
+    merge only pays for the new descriptions: covered descriptions are skipped, descriptions
+    which fit under concat_max_tokens together with the summary are appended to it without
+    any LLM call, and the rest are folded into the summary in batches of input_max_tokens.
+    """
+
+    def __init__(
+        self,
+        extract_func: Callable,
+        llm_model_name: str = "gpt-4o-mini",
+        tiktoken_model_name: str = "gpt-4o-mini",
+        concat_max_tokens: int = 500,
+        input_max_tokens: int = 4000,
+        output_max_tokens: int = 1000,
+        max_tracked_summaries: int = 100_000,
+    ):
+        self.extract_func = extract_func
+        self.llm_model_name = llm_model_name
+        self.tiktoken_model_name = tiktoken_model_name
+        self.concat_max_tokens = concat_max_tokens
+        self.input_max_tokens = input_max_tokens
+        self.output_max_tokens = output_max_tokens
+        self.max_tracked_summaries = max_tracked_summaries
+        # summary hash -> (token count, hashes of the descriptions it covers), least
+        # recently used first
+        self._summaries: OrderedDict[int, Tuple[int, Set[int]]] = OrderedDict()
+
+    def _count_tokens(self, text: str) -> int:
+        return len(encode_string_by_tiktoken(text, model_name=self.tiktoken_model_name))
+
+    def _track(self, summary: str, tokens: int, covered: Set[int]):
+        key = compute_xxhash_id(summary)
+        self._summaries[key] = (tokens, covered)
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_tracked_summaries:
+            self._summaries.popitem(last=False)
+
+    async def _fold(
+        self, entity_name: str, summary: str, descriptions: List[str]
+    ) -> str:
+        prompt = PROMPTS["fold_entity_description"].format(
+            entity_name=entity_name,
+            current_description=summary,
+            new_descriptions=descriptions,
+        )
+        return await self.extract_func(
+            model=self.llm_model_name,
+            prompt=prompt,
+            max_tokens=self.output_max_tokens,
+        )
+
+    async def summarize_entity(
+        self,
+        entity_name: str,
+        descriptions: List[str],
+    ) -> str:
+        """
+        Fold the new descriptions of an entity into its current summary.
+        Args:
+            entity_name: The name of the entity.
+            descriptions: The current summary of the entity, then its new descriptions.
+        Returns:
+            The summary of the entity.
+        """
+        if not descriptions:
+            return ""
+        summary = descriptions[0]
+        summary_key = compute_xxhash_id(summary)
+        if summary_key in self._summaries:
+            summary_tokens, covered = self._summaries[summary_key]
+            covered = set(covered)
+        else:
+            summary_tokens, covered = self._count_tokens(summary), set()
+        covered.add(summary_key)
+
+        # the descriptions already folded in, or contained in the summary, are skipped
+        new_descriptions = []
+        for description in dict.fromkeys(descriptions[1:]):
+            key = compute_xxhash_id(description)
+            if key not in covered and description not in summary:
+                new_descriptions.append((key, description))
+        if not new_descriptions:
+            return summary
+
+        new_tokens = [
+            len(tokens)
+            for tokens in encode_strings_by_tiktoken(
+                [d for _, d in new_descriptions], model_name=self.tiktoken_model_name
+            )
+        ]
+        # a new description containing the summary replaces it, rather than repeat it
+        for i, (key, description) in enumerate(new_descriptions):
+            if summary in description:
+                summary, summary_tokens = description, new_tokens[i]
+                covered.add(key)
+                kept = [
+                    j
+                    for j, (_, d) in enumerate(new_descriptions)
+                    if j != i and d not in summary
+                ]
+                new_descriptions = [new_descriptions[j] for j in kept]
+                new_tokens = [new_tokens[j] for j in kept]
+                break
+        if not new_descriptions:
+            self._track(summary, summary_tokens, covered)
+            return summary
+
+        if summary_tokens + sum(new_tokens) <= self.concat_max_tokens:
+            # short enough to be kept verbatim
+            summary = "\n".join([summary] + [d for _, d in new_descriptions])
+            summary_tokens += sum(new_tokens)
+        else:
+            # fold the new descriptions in batches which fit in the input budget
+            batch, batch_tokens = [], 0
+            for (_, description), tokens in zip(new_descriptions, new_tokens):
+                if (
+                    batch
+                    and summary_tokens + batch_tokens + tokens > self.input_max_tokens
+                ):
+                    summary = await self._fold(entity_name, summary, batch)
+                    summary_tokens = self._count_tokens(summary)
+                    batch, batch_tokens = [], 0
+                batch.append(description)
+                batch_tokens += tokens
+            summary = await self._fold(entity_name, summary, batch)
+            summary_tokens = self._count_tokens(summary)
+
+        covered.update(key for key, _ in new_descriptions)
+        self._track(summary, summary_tokens, covered)
+        return summary
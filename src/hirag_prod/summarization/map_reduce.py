@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+import math
+from typing import Callable, List
+
+from hirag_prod._utils import decode_tokens_by_tiktoken, encode_strings_by_tiktoken
+from hirag_prod.prompt import PROMPTS
+
+from .base import BaseSummarizer
+
+
+class MapReduceSummarizer(BaseSummarizer):
+    """
+    Summarizer which keeps every description of an entity, however many there are.
+
+    The descriptions which fit in input_max_tokens are summarized in a single call. Larger
+    description lists are split into token-balanced groups, one per input_max_tokens of
+    descriptions, which are summarized in parallel (map); the group summaries are then
+    summarized the same way (reduce) until a single summary remains, which requires
+    output_max_tokens to be under half of input_max_tokens. The token counts are computed
+    once, with a batched encode of all the descriptions.
+    """
+
+    def __init__(
+        self,
+        extract_func: Callable,
+        llm_model_name: str = "gpt-4o-mini",
+        tiktoken_model_name: str = "gpt-4o-mini",
+        input_max_tokens: int = 16000,
+        output_max_tokens: int = 1000,
+        max_concurrency: int = 8,
+    ):
+        # two group summaries must fit in one call, or the reduce never ends
+        if output_max_tokens * 2 >= input_max_tokens:
+            raise ValueError(
+                "output_max_tokens must be smaller than half of input_max_tokens"
+            )
+        self.extract_func = extract_func
+        self.llm_model_name = llm_model_name
+        self.tiktoken_model_name = tiktoken_model_name
+        self.input_max_tokens = input_max_tokens
+        self.output_max_tokens = output_max_tokens
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _group(self, token_counts: List[int]) -> List[List[int]]:
+        """Split the descriptions into token-balanced groups, as lists of indices"""
+        num_groups = math.ceil(sum(token_counts) / self.input_max_tokens)
+        # longest descriptions first, each into the lightest group
+        order = sorted(
+            range(len(token_counts)), key=lambda i: token_counts[i], reverse=True
+        )
+        while True:
+            groups = [(0, group_id, []) for group_id in range(num_groups)]
+            for index in order:
+                tokens, group_id, members = heapq.heappop(groups)
+                members.append(index)
+                heapq.heappush(
+                    groups, (tokens + token_counts[index], group_id, members)
+                )
+            if max(tokens for tokens, _, _ in groups) <= self.input_max_tokens:
+                break
+            num_groups += 1
+        # keep the original order of the descriptions within each group
+        return [
+            sorted(members)
+            for _, _, members in sorted(groups, key=lambda g: g[1])
+            if members
+        ]
+
+    async def _summarize(self, entity_name: str, descriptions: List[str]) -> str:
+        use_prompt = PROMPTS["summarize_entity_descriptions"].format(
+            entity_name=entity_name,
+            description_list=descriptions,
+        )
+        async with self._semaphore:
+            return await self.extract_func(
+                model=self.llm_model_name,
+                prompt=use_prompt,
+                max_tokens=self.output_max_tokens,
+            )
+
+    async def summarize_entity(
+        self,
+        entity_name: str,
+        descriptions: List[str],
+    ) -> str:
+        """
+        Summarize the entity descriptions.
+        Args:
+            entity_name: The name of the entity.
+            descriptions: The descriptions of the entity.
+        Returns:
+            The summary of the entity.
+        """
+        descriptions = list(dict.fromkeys(descriptions))
+        if len(descriptions) <= 1:
+            return descriptions[0] if descriptions else ""
+
+        tokens_list = encode_strings_by_tiktoken(
+            descriptions, model_name=self.tiktoken_model_name
+        )
+        # a single description over the budget is cut, as it cannot be split
+        for i, tokens in enumerate(tokens_list):
+            if len(tokens) > self.input_max_tokens:
+                tokens_list[i] = tokens[: self.input_max_tokens]
+                descriptions[i] = decode_tokens_by_tiktoken(
+                    tokens_list[i], model_name=self.tiktoken_model_name
+                )
+        token_counts = [len(tokens) for tokens in tokens_list]
+        if sum(token_counts) <= self.input_max_tokens:
+            return await self._summarize(entity_name, descriptions)
+
+        # map: summarize each group in parallel, then reduce the group summaries
+        groups = self._group(token_counts)
+        summaries = await asyncio.gather(
+            *[
+                self._summarize(entity_name, [descriptions[i] for i in group])
+                for group in groups
+            ]
+        )
+        return await self.summarize_entity(entity_name, summaries)
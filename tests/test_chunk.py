@@ -1,7 +1,20 @@
+import asyncio
 import os
 
-from hirag_prod.chunk import FixTokenChunk
+import pytest
+
+from hirag_prod._utils import get_encoder
+from hirag_prod.chunk import (
+    ChunkWorkerPool,
+    FixTokenChunk,
+    MarkdownChunk,
+    MinHashLSH,
+    TokenChunk,
+    iter_markdown_blocks,
+    iter_unpacked_spans,
+)
 from hirag_prod.loader import load_document
+from hirag_prod.schema import File, TokenizedText
 
 
 def test_chunk_documents():
@@ -35,3 +48,205 @@ def test_chunk_documents():
         assert chunk.page_content is not None
         assert chunk.metadata.type == "pdf"
         assert chunk.metadata.filename == "Guide-to-U.S.-Healthcare-System.pdf"
+
+
+def test_token_chunk():
+    text = "".join(
+        f"Sentence {i}: health care in the United States (医疗保健) has many providers. "
+        for i in range(60)
+    )
+    document = File(
+        id=1,
+        page_content=text,
+        metadata={"type": "txt", "filename": "health.txt", "private": False},
+    )
+    chunker = TokenChunk(chunk_size=100, chunk_overlap=20)
+    chunks = chunker.chunk(document)
+
+    encoder = get_encoder("cl100k_base")
+    assert len(chunks) > 1
+    assert [chunk.metadata.chunk_idx for chunk in chunks] == list(range(len(chunks)))
+    # windows cut inside a character keep the whole character
+    for chunk in chunks:
+        assert len(encoder.encode(chunk.page_content)) <= 100 + 2
+    # the chunks overlap, and cover the whole text
+    assert text.startswith(chunks[0].page_content)
+    assert text.endswith(chunks[-1].page_content)
+    previous_start = 0
+    for previous, current in zip(chunks, chunks[1:]):
+        start = text.index(current.page_content, previous_start + 1)
+        assert start < previous_start + len(previous.page_content)
+        previous_start = start
+
+
+def test_tokenized_text():
+    text = "Health care (医疗保健) in the United States. " * 20
+    tokenized = TokenizedText.encode(text)
+    encoder = get_encoder("cl100k_base")
+    assert tokenized.tokens.tolist() == encoder.encode(text)
+    assert tokenized.offsets[-1] == len(text)
+
+    # the pieces cover the text, and are not encoded again
+    pieces = tokenized.split(50)
+    assert "".join(piece.text for piece in pieces) == text
+    assert sum(len(piece) for piece in pieces) == len(tokenized)
+
+    # a span keeps the tokens overlapping it
+    start, end = text.index("United"), text.index(".")
+    span = tokenized.span(start, end)
+    assert span.text == text[start:end]
+    assert len(span) == tokenized.count_tokens(start, end)
+    assert len(span) >= len(encoder.encode(span.text)) - 1
+
+
+def test_markdown_chunk():
+    table = "\n".join(
+        ["| Plan | Premium |", "| --- | --- |"]
+        + [f"| Plan {i} | {100 + i} dollars |" for i in range(40)]
+    )
+    markdown = "\n\n".join(
+        [
+            "# Health care",
+            "Health care in the United States is provided by many organizations.",
+            "## Insurance plans",
+            table,
+            "- Private insurance\n- Medicare\n  for the elderly\n- Medicaid",
+            "<table><tr><td>HMO</td><td>PPO</td></tr></table>",
+            "## Providers",
+            "Hospitals and clinics provide the medical care.",
+        ]
+    )
+    assert [kind for kind, _ in iter_markdown_blocks(markdown)] == [
+        "heading",
+        "paragraph",
+        "heading",
+        "table",
+        "list",
+        "table",
+        "heading",
+        "paragraph",
+    ]
+
+    encoder = get_encoder("cl100k_base")
+    chunk_size = len(encoder.encode(table)) // 2
+    chunks = MarkdownChunk(chunk_size=chunk_size).split_text(markdown)
+    for chunk in chunks:
+        assert len(encoder.encode(chunk)) <= chunk_size
+        # the table is split by rows, each part with the header
+        if "| Plan 1" in chunk:
+            assert "| Plan | Premium |\n| --- | --- |\n| Plan" in chunk
+        # a heading never ends a chunk
+        assert not chunk.split("\n\n")[-1].startswith("#")
+    assert all(
+        f"| Plan {i} | {100 + i} dollars |" in "".join(chunks) for i in range(40)
+    )
+
+    # small blocks are packed together
+    assert len(MarkdownChunk(chunk_size=10 * chunk_size).split_text(markdown)) == 1
+
+    # a heading which nearly fills a chunk, before a block over the chunk size
+    heading = "## " + " ".join(["Health care providers of the region"] * 3)
+    paragraph = " ".join(["Insurance companies restrict payment."] * 20)
+    chunk_size = len(encoder.encode(heading)) + 1
+    chunks = MarkdownChunk(chunk_size=chunk_size).split_text(
+        f"{heading}\n\n{paragraph}"
+    )
+    assert chunks[0] == heading
+    assert all(len(encoder.encode(chunk)) <= chunk_size for chunk in chunks)
+
+
+def test_iter_chunks():
+    text = "\n\n".join(
+        f"## Section {i}\n\nHealth care providers of region {i} are listed here."
+        for i in range(30)
+    )
+    document = File(
+        id=1,
+        page_content=text,
+        metadata={"type": "txt", "filename": "health.md", "private": False},
+    )
+    for chunker in [
+        MarkdownChunk(chunk_size=40),
+        TokenChunk(chunk_size=40, chunk_overlap=10),
+        FixTokenChunk(chunk_size=100, chunk_overlap=10),
+    ]:
+        chunks = chunker.chunk(document)
+        batches = list(chunker.iter_chunks(document, batch_size=4))
+        assert all(0 < len(batch) <= 4 for batch in batches)
+        assert [chunk for batch in batches for chunk in batch] == chunks
+
+
+@pytest.mark.asyncio
+async def test_chunk_worker_pool():
+    table = "\n".join(
+        ["| Plan | Premium |", "| --- | --- |"]
+        + [f"| Plan {i} | {100 + i} dollars |" for i in range(40)]
+    )
+    texts = [
+        f"## Section {i}\n\nHealth care providers of region {i}.\n\n{table}"
+        for i in range(3)
+    ]
+    documents = [
+        File(
+            id=i,
+            page_content=text,
+            metadata={"type": "txt", "filename": "health.md", "private": False},
+        )
+        for i, text in enumerate(texts)
+    ]
+    # the tokens attached by the loader are sent instead of the text
+    documents[0].set_tokens(TokenizedText.encode(texts[0]))
+
+    chunker = MarkdownChunk(chunk_size=80)
+    pool = ChunkWorkerPool(chunker, max_workers=2, min_offload_chars=0)
+    pool.start()
+    try:
+        assert all(pool.offloads(document) for document in documents)
+        # the documents chunked at the same time share a task
+        results = await asyncio.gather(
+            *[pool.chunk_spans(document) for document in documents]
+        )
+    finally:
+        pool.shutdown()
+
+    for document, chunk_spans in zip(documents, results):
+        batches = chunker.iter_chunks(
+            document, batch_size=4, chunk_spans=iter_unpacked_spans(chunk_spans)
+        )
+        chunks = [chunk for batch in batches for chunk in batch]
+        assert chunks == chunker.chunk(document)
+    assert not pool.offloads(documents[0])
+
+    # a pool shut down before the pending documents are sent fails them
+    pool.start()
+    task = asyncio.create_task(pool.chunk_spans(documents[1]))
+    await asyncio.sleep(0)
+    pool.shutdown()
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(task, timeout=10)
+
+
+def test_minhash_lsh_near_duplicates():
+    text = (
+        "Private insurance companies then use the volume of insured patients that they "
+        "control in these plans to restrict payment to the health care providers who have "
+        "agreed by contract to take a fixed fee for each service. "
+    ) * 3
+    ocr_variant = text.replace("insurance", "insurnace", 1)
+    unrelated = (
+        "The weather in spring is mild, with frequent showers and sunny spells. " * 3
+    )
+
+    lsh = MinHashLSH()
+    lsh.insert(1, lsh.signature(text))
+
+    assert lsh.query(lsh.signature(text)) == 1
+    assert lsh.query(lsh.signature(ocr_variant)) == 1
+    assert lsh.query(lsh.signature(unrelated)) is None
+
+    # the least recently matched signatures are evicted
+    lsh = MinHashLSH(max_keys=1)
+    lsh.insert(1, lsh.signature(text))
+    lsh.insert(2, lsh.signature(unrelated))
+    assert lsh.query(lsh.signature(text)) is None
+    assert lsh.query(lsh.signature(unrelated)) == 2
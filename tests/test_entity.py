@@ -1,9 +1,23 @@
+import asyncio
+
+import numpy as np
 import pytest
 
 from hirag_prod._llm import ChatCompletion
+from hirag_prod._utils import compute_xxhash_id
+from hirag_prod.chunk import MinHashLSH
+from hirag_prod.entity import EntityResolver, ExtractionJournal
 from hirag_prod.entity.vanilla import VanillaEntity
 from hirag_prod.schema import Chunk, Entity, Relation
 
+# Two chunks of a page of the healthcare guide, their ids computed from their text, as
+# in the pipeline
+FIRST_CHUNK_TEXT = "A Very General Overview of How the U.S. Health Care System Works \nThe United States is considered a free market health care system with privatized and some \ngovernment insurance providers. Basically, it is a pay-as-you-can-afford system. The private \ninsurance industry offers individual and group policies.  Health care providers (physicians, \nhospitals, pharmacies, diagnostic facilities, therapeutic facilities, nursing care facilities, and \nso on) sign contracts with insurance providers. Private"
+SECOND_CHUNK_TEXT = ") sign contracts with insurance providers. Private insurance companies then use the \nvolume of insured patients that they control in these plans to restrict payment to the health \ncare providers who have agreed by contract to take a fixed fee for each service.  \n \nAfter a person receives care, the providers send the bill to either the patient's insurance \nprovider, or, if the patient has no insurance, to the patient.  \n \nThe insurance company will pay the provider \nall, some, or none of what is "
+FIRST_CHUNK_ID = compute_xxhash_id(FIRST_CHUNK_TEXT)
+SECOND_CHUNK_ID = compute_xxhash_id(SECOND_CHUNK_TEXT)
+DOCUMENT_ID = compute_xxhash_id(FIRST_CHUNK_TEXT + SECOND_CHUNK_TEXT)
+
 
 @pytest.mark.asyncio
 async def test_vanilla_entity():
@@ -14,30 +28,30 @@ async def test_vanilla_entity():
 
     chunks = [
         Chunk(
-            id="chunk-5b8421d1da0999a82176b7836b795235",
+            id=FIRST_CHUNK_ID,
             metadata={
                 "type": "pdf",
                 "filename": "Guide-to-U.S.-Healthcare-System.pdf",
                 "page_number": 4,
                 "chunk_idx": 0,
-                "document_id": "doc-02492a6d371e70c7acd2196f7d8ce6d6",
+                "document_id": DOCUMENT_ID,
                 "private": False,
                 "uri": "/chatbot/Sagi/src/Sagi/mcp_server/hirag_mcp/tests/Guide-to-U.S.-Healthcare-System.pdf",
             },
-            page_content="A Very General Overview of How the U.S. Health Care System Works \nThe United States is considered a free market health care system with privatized and some \ngovernment insurance providers. Basically, it is a pay-as-you-can-afford system. The private \ninsurance industry offers individual and group policies.  Health care providers (physicians, \nhospitals, pharmacies, diagnostic facilities, therapeutic facilities, nursing care facilities, and \nso on) sign contracts with insurance providers. Private",
+            page_content=FIRST_CHUNK_TEXT,
         ),
         Chunk(
-            id="chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
+            id=SECOND_CHUNK_ID,
             metadata={
                 "type": "pdf",
                 "filename": "Guide-to-U.S.-Healthcare-System.pdf",
                 "page_number": 4,
                 "chunk_idx": 1,
-                "document_id": "doc-02492a6d371e70c7acd2196f7d8ce6d6",
+                "document_id": DOCUMENT_ID,
                 "private": False,
                 "uri": "/chatbot/Sagi/src/Sagi/mcp_server/hirag_mcp/tests/Guide-to-U.S.-Healthcare-System.pdf",
             },
-            page_content=") sign contracts with insurance providers. Private insurance companies then use the \nvolume of insured patients that they control in these plans to restrict payment to the health \ncare providers who have agreed by contract to take a fixed fee for each service.  \n \nAfter a person receives care, the providers send the bill to either the patient's insurance \nprovider, or, if the patient has no insurance, to the patient.  \n \nThe insurance company will pay the provider \nall, some, or none of what is ",
+            page_content=SECOND_CHUNK_TEXT,
         ),
     ]
 
@@ -50,70 +64,70 @@ async def test_vanilla_entity():
 async def test_vanilla_relation():
     chunks = [
         Chunk(
-            id="chunk-5b8421d1da0999a82176b7836b795235",
+            id=FIRST_CHUNK_ID,
             metadata={
                 "type": "pdf",
                 "filename": "Guide-to-U.S.-Healthcare-System.pdf",
                 "page_number": 4,
                 "chunk_idx": 0,
-                "document_id": "doc-02492a6d371e70c7acd2196f7d8ce6d6",
+                "document_id": DOCUMENT_ID,
                 "private": False,
                 "uri": "/chatbot/Sagi/src/Sagi/mcp_server/hirag_mcp/tests/Guide-to-U.S.-Healthcare-System.pdf",
             },
-            page_content="A Very General Overview of How the U.S. Health Care System Works \nThe United States is considered a free market health care system with privatized and some \ngovernment insurance providers. Basically, it is a pay-as-you-can-afford system. The private \ninsurance industry offers individual and group policies.  Health care providers (physicians, \nhospitals, pharmacies, diagnostic facilities, therapeutic facilities, nursing care facilities, and \nso on) sign contracts with insurance providers. Private",
+            page_content=FIRST_CHUNK_TEXT,
         ),
         Chunk(
-            id="chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
+            id=SECOND_CHUNK_ID,
             metadata={
                 "type": "pdf",
                 "filename": "Guide-to-U.S.-Healthcare-System.pdf",
                 "page_number": 4,
                 "chunk_idx": 1,
-                "document_id": "doc-02492a6d371e70c7acd2196f7d8ce6d6",
+                "document_id": DOCUMENT_ID,
                 "private": False,
                 "uri": "/chatbot/Sagi/src/Sagi/mcp_server/hirag_mcp/tests/Guide-to-U.S.-Healthcare-System.pdf",
             },
-            page_content=") sign contracts with insurance providers. Private insurance companies then use the \nvolume of insured patients that they control in these plans to restrict payment to the health \ncare providers who have agreed by contract to take a fixed fee for each service.  \n \nAfter a person receives care, the providers send the bill to either the patient's insurance \nprovider, or, if the patient has no insurance, to the patient.  \n \nThe insurance company will pay the provider \nall, some, or none of what is ",
+            page_content=SECOND_CHUNK_TEXT,
         ),
     ]
 
     entities = [
         Entity(
-            id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+            id=compute_xxhash_id("UNITED STATES"),
             metadata={
                 "entity_type": "GEO",
                 "description": "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage.",
-                "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                "chunk_ids": [FIRST_CHUNK_ID],
             },
             page_content="UNITED STATES",
         ),
         Entity(
-            id="ent-5a28a79d61d9ba7001246e3fdebbe108",
+            id=compute_xxhash_id("HEALTH CARE SYSTEM"),
             metadata={
                 "entity_type": "EVENT",
                 "description": "The Health Care System in the United States refers to the organized provision of medical services, which relies on a combination of privatized and government insurance. This system encompasses a variety of healthcare providers and services aimed at delivering medical care to the population, ensuring access to needed health resources through different forms of insurance coverage.",
-                "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                "chunk_ids": [FIRST_CHUNK_ID],
             },
             page_content="HEALTH CARE SYSTEM",
         ),
         Entity(
-            id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+            id=compute_xxhash_id("INSURANCE COMPANIES"),
             metadata={
                 "entity_type": "ORGANIZATION",
                 "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                 "chunk_ids": [
-                    "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                    "chunk-5b8421d1da0999a82176b7836b795235",
+                    SECOND_CHUNK_ID,
+                    FIRST_CHUNK_ID,
                 ],
             },
             page_content="INSURANCE COMPANIES",
         ),
         Entity(
-            id="ent-8ac4883b1b6f421ea5f0196eb317b2ba",
+            id=compute_xxhash_id("HEALTH CARE PROVIDERS"),
             metadata={
                 "entity_type": "ORGANIZATION",
                 "description": "Health Care Providers are the professionals or facilities that offer medical treatments and services to patients, regardless of their insurance status, whether they are insured or uninsured.",
-                "chunk_ids": ["chunk-d66c81e0b32e3d4e6777f0dfbabe81a8"],
+                "chunk_ids": [SECOND_CHUNK_ID],
             },
             page_content="HEALTH CARE PROVIDERS",
         ),
@@ -124,3 +138,506 @@ async def test_vanilla_relation():
     )
     relations = await entity_handler.relation(chunks, entities)
     assert isinstance(relations[0], Relation)
+
+
+@pytest.mark.asyncio
+async def test_vanilla_entity_and_relation():
+    prompts = []
+
+    async def fake_extract_func(model, prompt, system_prompt=None, **kwargs):
+        prompts.append(prompt)
+        if "identify all relationships among the given" in (system_prompt or ""):
+            return '("relationship"<|>"ALICE"<|>"ACME"<|>"Alice works at Acme"<|>8)<|COMPLETE|>'
+        if (system_prompt or "").startswith("-Goal-"):
+            description = f"Alice, chunk {len(prompts)}"
+            return (
+                f'("entity"<|>"ALICE"<|>"PERSON"<|>"{description}")##'
+                '("entity"<|>"ACME"<|>"ORGANIZATION"<|>"Acme is a company")<|COMPLETE|>'
+            )
+        return "Alice is a person working at Acme"
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+        chunk_deduplicator=None,
+    )
+    chunks = [
+        Chunk(
+            id=i,
+            metadata={"chunk_idx": i, "document_id": 1},
+            page_content=content,
+        )
+        for i, content in enumerate(
+            ["Alice joined Acme in 2020.", "Acme promoted Alice to manager."]
+        )
+    ]
+
+    entities, relations = await entity_handler.entity_and_relation(chunks)
+
+    entities = {entity.page_content: entity for entity in entities}
+    assert set(entities) == {"ALICE", "ACME"}
+    assert set(entities["ALICE"].metadata.chunk_ids) == {0, 1}
+    assert {relation.properties["chunk_id"] for relation in relations} == {0, 1}
+    # the relations point to the merged entities
+    for relation in relations:
+        assert relation.source is entities["ALICE"]
+        assert relation.target is entities["ACME"]
+
+
+@pytest.mark.asyncio
+async def test_vanilla_joint_extraction():
+    prompts = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        prompts.append(prompt)
+        return (
+            '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")##'
+            '("entity"<|>"ACME"<|>"ORGANIZATION"<|>"Acme is a company")##'
+            '("relationship"<|>"ALICE"<|>"ACME"<|>"Alice works at Acme (since 2020)"<|>8)'
+            "<|COMPLETE|>"
+        )
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=0,
+        extraction_mode="joint",
+        chunk_deduplicator=None,
+    )
+    chunks = [
+        Chunk(
+            id=0,
+            metadata={"chunk_idx": 0, "document_id": 1},
+            page_content="Alice joined Acme in 2020.",
+        )
+    ]
+
+    entities, relations = await entity_handler.entity_and_relation(chunks)
+
+    # a single extraction call for both the entities and the relations
+    assert len(prompts) == 1
+    assert {entity.page_content for entity in entities} == {"ALICE", "ACME"}
+    assert len(relations) == 1
+    assert relations[0].properties["description"] == "Alice works at Acme (since 2020)"
+
+
+@pytest.mark.asyncio
+async def test_vanilla_packed_extraction(caplog):
+    prompts = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        prompts.append(prompt)
+        return (
+            '("entity"<|>"CAROL"<|>"PERSON"<|>"Carol is before any tag")##\n'
+            '<chunk id="1">\n'
+            '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")##'
+            '("relationship"<|>"ALICE"<|>"ACME"<|>"Alice works at Acme"<|>8)##'
+            '("entity"<|>"ACME"<|>"ORGANIZATION"<|>"Acme is a company")##\n'
+            '<chunk id="2">\n'
+            '("entity"<|>"BOB"<|>"PERSON"<|>"Bob is an engineer")##\n'
+            '<chunk id="3">\n'
+            '("entity"<|>"DAVE"<|>"PERSON"<|>"Dave is in no chunk")<|COMPLETE|>'
+        )
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        # a pack of several chunks is not gleaned
+        entity_extract_max_gleaning=1,
+        extraction_mode="joint",
+        extraction_pack_token_budget=1000,
+        chunk_deduplicator=None,
+    )
+    chunks = [
+        Chunk(
+            id=compute_xxhash_id(content),
+            metadata={"chunk_idx": i, "document_id": DOCUMENT_ID},
+            page_content=content,
+        )
+        for i, content in enumerate(["Alice manages Acme.", "Bob builds robots."])
+    ]
+
+    entities, relations = await entity_handler.entity_and_relation(chunks)
+
+    # both chunks are extracted from a single request, tagged with their index in the pack
+    assert len(prompts) == 1
+    assert '<chunk id="2">\nBob builds robots.\n</chunk>' in prompts[0]
+    chunk_ids = {entity.page_content: entity.metadata.chunk_ids for entity in entities}
+    assert chunk_ids == {
+        "ALICE": [chunks[0].id],
+        "ACME": [chunks[0].id],
+        "BOB": [chunks[1].id],
+    }
+    assert [relation.properties["chunk_id"] for relation in relations] == [chunks[0].id]
+    # the records out of the chunk tags are dropped and reported
+    assert "Dropped 2 records of a pack of 2 chunks" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_vanilla_packed_extraction_is_not_gleaned():
+    calls = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        calls.append(prompt)
+        return '<chunk id="1">\n("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")<|COMPLETE|>'
+
+    for gleaning_policy in ["fixed", "adaptive"]:
+        calls.clear()
+        entity_handler = VanillaEntity.create(
+            extract_func=fake_extract_func,
+            entity_extract_max_gleaning=2,
+            gleaning_policy=gleaning_policy,
+            gleaning_min_records_per_1k_chars=0,
+            extraction_mode="joint",
+            extraction_pack_token_budget=1000,
+            chunk_deduplicator=None,
+        )
+        chunks = [
+            Chunk(
+                id=compute_xxhash_id(content),
+                metadata={"chunk_idx": i, "document_id": DOCUMENT_ID},
+                page_content=content,
+            )
+            for i, content in enumerate(["Alice manages Acme.", "Bob builds robots."])
+        ]
+
+        entities, _ = await entity_handler.entity_and_relation(chunks)
+
+        assert calls == [calls[0]]
+        assert [entity.metadata.chunk_ids for entity in entities] == [[chunks[0].id]]
+        if gleaning_policy == "adaptive":
+            assert [stats.skipped for stats in entity_handler.gleaning_stats] == [
+                "packed"
+            ]
+
+    # a chunk extracted on its own is still gleaned
+    calls.clear()
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=1,
+        extraction_mode="joint",
+        extraction_pack_token_budget=1000,
+        chunk_deduplicator=None,
+    )
+    await entity_handler.entity_and_relation(chunks[:1])
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_vanilla_extraction_shares_the_prompt_prefix():
+    calls = []
+
+    async def fake_extract_func(model, prompt, system_prompt=None, **kwargs):
+        calls.append((system_prompt, prompt, kwargs.get("history_messages")))
+        return '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")<|COMPLETE|>'
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=1,
+        chunk_deduplicator=None,
+    )
+    chunks = [
+        Chunk(
+            id=i,
+            metadata={"chunk_idx": i, "document_id": 1},
+            page_content=content,
+        )
+        for i, content in enumerate(["Alice manages Acme.", "Alice hired Bob."])
+    ]
+
+    await entity_handler.entity(chunks)
+
+    # the instructions and examples are the same system prompt for every call
+    assert len(calls) == 4
+    assert len({system_prompt for system_prompt, _, _ in calls}) == 1
+    assert calls[0][0].startswith("-Goal-")
+    # the user prompts and the history only hold the chunk
+    for _, prompt, history in calls:
+        assert "-Goal-" not in prompt
+        assert all("-Goal-" not in message["content"] for message in history or [])
+
+
+@pytest.mark.asyncio
+async def test_vanilla_adaptive_gleaning():
+    glean_results = {
+        0: ['("entity"<|>"BOB"<|>"PERSON"<|>"Bob is an engineer")', ""],
+    }
+    calls = []
+
+    async def fake_extract_func(model, prompt, history_messages=None, **kwargs):
+        calls.append(prompt)
+        if history_messages:
+            return glean_results[0].pop(0)
+        return '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")<|COMPLETE|>'
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        gleaning_policy="adaptive",
+        chunk_deduplicator=None,
+        chunk_triage=None,
+    )
+    chunks = [
+        Chunk(
+            id=0,
+            metadata={"chunk_idx": 0, "document_id": 1},
+            page_content="Alice manages Acme, Bob builds robots.",
+        ),
+        Chunk(
+            id=1,
+            metadata={"chunk_idx": 1, "document_id": 1},
+            page_content="| 2021 | 1,024.5 | 12% |\n| 2022 | 2,048.0 | 15% |",
+        ),
+    ]
+
+    entities = await entity_handler.entity(chunks)
+
+    assert {entity.page_content for entity in entities} == {"ALICE", "BOB"}
+    stats = {s.chunk_ids[0]: s for s in entity_handler.gleaning_stats}
+    # the text chunk is gleaned until a round finds nothing new, without termination calls
+    assert stats[0].records == [1, 1, 0]
+    assert stats[0].skipped is None
+    # the numeric chunk is not gleaned
+    assert stats[1].records == [1]
+    assert stats[1].skipped == "numeric"
+    assert len(calls) == 4
+
+    # only the statistics of the latest extractions are kept
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        gleaning_policy="adaptive",
+        max_gleaning_stats=1,
+        chunk_deduplicator=None,
+        chunk_triage=None,
+    )
+    await entity_handler.entity(chunks[1:])
+    await entity_handler.entity(chunks[1:])
+    assert len(entity_handler.gleaning_stats) == 1
+
+
+@pytest.mark.asyncio
+async def test_vanilla_triage_skips_low_information_chunks():
+    prompts = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        prompts.append(prompt)
+        return '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")<|COMPLETE|>'
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+        chunk_deduplicator=None,
+    )
+    contents = [
+        "Alice Smith joined Acme Corporation in Berlin as a manager in 2020.",
+        "12",
+        "Contents\nIntroduction .......... 1\nMethods .......... 12\nResults .......... 27",
+        "2021 | 1,024.5 | 12% | 3,000\n2022 | 2,048.0 | 15% | 4,100\n2023 | 512.25 | 9% | 990",
+    ]
+    chunks = [
+        Chunk(
+            id=i,
+            metadata={"chunk_idx": i, "document_id": 7},
+            page_content=content,
+        )
+        for i, content in enumerate(contents)
+    ]
+
+    entities, relations = await entity_handler.entity_and_relation(
+        chunks, document_key=11
+    )
+
+    # only the first chunk goes through entity and relation extraction
+    assert len(prompts) == 2
+    assert entities[0].metadata.chunk_ids == [0]
+    assert entity_handler.triage_skipped_calls == {11: 6}
+
+
+@pytest.mark.asyncio
+async def test_vanilla_near_duplicate_caches_are_bounded():
+    calls = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        calls.append(prompt)
+        if "relevant to a list of entities" in kwargs.get("system_prompt", ""):
+            return '("relationship"<|>"ALICE"<|>"ACME"<|>"Alice works at Acme"<|>8)<|COMPLETE|>'
+        return (
+            '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")##'
+            '("entity"<|>"ACME"<|>"ORGANIZATION"<|>"Acme is a company")<|COMPLETE|>'
+        )
+
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+        chunk_deduplicator=MinHashLSH(max_keys=1),
+        max_cached_chunks=1,
+    )
+    chunks = [
+        Chunk(
+            id=compute_xxhash_id(content),
+            metadata={"chunk_idx": i, "document_id": DOCUMENT_ID},
+            page_content=content,
+        )
+        for i, content in enumerate(
+            [FIRST_CHUNK_TEXT, SECOND_CHUNK_TEXT, FIRST_CHUNK_TEXT + " "]
+        )
+    ]
+
+    for chunk in chunks[:2]:
+        await entity_handler.entity_and_relation([chunk])
+
+    assert list(entity_handler._entity_record_cache) == [chunks[1].id]
+    assert list(entity_handler._relation_record_cache) == [chunks[1].id]
+    # the extraction of the evicted chunk is not reused by its near-duplicate
+    calls.clear()
+    await entity_handler.entity_and_relation(chunks[2:])
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_vanilla_extraction_resumes_from_journal(tmp_path):
+    prompts = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        prompts.append(prompt)
+        return '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")<|COMPLETE|>'
+
+    chunks = [
+        Chunk(
+            id=0,
+            metadata={"chunk_idx": 0, "document_id": 1},
+            page_content="Alice manages Acme, Bob builds robots.",
+        )
+    ]
+    journal_path = str(tmp_path / "journal.jsonl")
+
+    def _entity_handler():
+        return VanillaEntity.create(
+            extract_func=fake_extract_func,
+            entity_extract_max_gleaning=0,
+            chunk_deduplicator=None,
+            journal=ExtractionJournal(journal_path),
+        )
+
+    entities = await _entity_handler().entity(chunks)
+    assert len(prompts) == 1
+
+    # a new run finds the extraction in the journal
+    resumed = await _entity_handler().entity(chunks)
+    assert len(prompts) == 1
+    assert resumed[0].metadata.description == entities[0].metadata.description
+
+    journal = ExtractionJournal(journal_path)
+    await journal.forget([0])
+    assert len(ExtractionJournal(journal_path)) == 0
+
+    # the extractions completing during a write are written together by the next one
+    writes = []
+    write = journal._write
+    journal._write = lambda lines: writes.append(len(lines)) or write(lines)
+    await asyncio.gather(
+        *[journal.append(i, "entity", [i], f"output {i}") for i in range(1, 6)]
+    )
+    assert writes == [1, 4]
+    journal = ExtractionJournal(journal_path)
+    assert len(journal) == 5
+    assert journal.get(3) == "output 3"
+
+
+def _fake_embedding_func(concepts):
+    """Embeds a text as the one-hot vector of the first concept it names"""
+
+    async def embedding_func(texts):
+        vectors = np.zeros((len(texts), len(concepts) + 1))
+        for i, text in enumerate(texts):
+            index = next(
+                (j for j, c in enumerate(concepts) if c in text.upper()), len(concepts)
+            )
+            vectors[i, index] = 1.0
+        return vectors
+
+    return embedding_func
+
+
+@pytest.mark.asyncio
+async def test_vanilla_entity_resolution():
+    async def fake_extract_func(model, prompt, **kwargs):
+        if "relevant to a list of entities" in (kwargs.get("system_prompt") or ""):
+            if "Alice" in prompt:
+                return '("relationship"<|>"ALICE"<|>"US DEPARTMENT OF HEALTH"<|>"Alice works there"<|>8)<|COMPLETE|>'
+            return '("relationship"<|>"BOB"<|>"U.S. DEPARTMENT OF HEALTH"<|>"Bob works there"<|>8)<|COMPLETE|>'
+        if "Alice" in prompt:
+            return '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")##("entity"<|>"US DEPARTMENT OF HEALTH"<|>"ORGANIZATION"<|>"A government agency")<|COMPLETE|>'
+        return '("entity"<|>"BOB"<|>"PERSON"<|>"Bob is an engineer")##("entity"<|>"U.S. DEPARTMENT OF HEALTH"<|>"ORGANIZATION"<|>"A government agency")<|COMPLETE|>'
+
+    chunks = [
+        Chunk(
+            id=0,
+            metadata={"chunk_idx": 0, "document_id": 1},
+            page_content="Alice works at the US Department of Health.",
+        ),
+        Chunk(
+            id=1,
+            metadata={"chunk_idx": 1, "document_id": 1},
+            page_content="Bob works at the U.S. Department of Health.",
+        ),
+    ]
+    entity_handler = VanillaEntity.create(
+        extract_func=fake_extract_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+        chunk_deduplicator=None,
+        entity_resolver=EntityResolver(
+            embedding_func=_fake_embedding_func(["HEALTH", "ALICE", "BOB"])
+        ),
+    )
+    entities, relations = await entity_handler.entity_and_relation(chunks)
+
+    # the two names of the agency are one entity, which both relations point at
+    entities = {e.page_content: e for e in entities}
+    assert sorted(entities) == ["ALICE", "BOB", "US DEPARTMENT OF HEALTH"]
+    assert sorted(entities["US DEPARTMENT OF HEALTH"].metadata.chunk_ids) == [0, 1]
+    assert {r.target.page_content for r in relations} == {"US DEPARTMENT OF HEALTH"}
+    assert entity_handler.entity_resolver.aliases == {
+        "U.S. DEPARTMENT OF HEALTH": "US DEPARTMENT OF HEALTH"
+    }
+
+
+@pytest.mark.asyncio
+async def test_entity_resolver_asks_the_llm_in_the_ambiguous_band():
+    questions = []
+
+    async def fake_llm_func(model, prompt, **kwargs):
+        questions.append(prompt)
+        return "YES"
+
+    async def embedding_func(texts):
+        # the names are similar, the descriptions identical: a mean similarity of 0.9
+        return np.array(
+            [[1.0, 0.0], [0.8, 0.6], [0.0, 1.0], [1.0, 0.0], [1.0, 0.0], [1.0, 0.0]]
+        )
+
+    def _entity(name, entity_type):
+        return Entity(
+            id=compute_xxhash_id(name),
+            page_content=name,
+            metadata={
+                "entity_type": entity_type,
+                "description": "An agency",
+                "chunk_ids": [0],
+            },
+        )
+
+    resolver = EntityResolver(
+        embedding_func=embedding_func, llm_func=fake_llm_func, bits_per_table=2
+    )
+    resolved = await resolver.resolve(
+        [
+            _entity("HHS", "ORGANIZATION"),
+            _entity("HEALTH DEPARTMENT", "ORGANIZATION"),
+            _entity("HEALTH", "CONCEPT"),
+        ]
+    )
+    # only the entities of the same type are compared
+    assert resolved == {"HEALTH DEPARTMENT": "HHS"}
+    assert len(questions) == 1
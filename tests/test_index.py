@@ -1,8 +1,70 @@
+import asyncio
 import os
 
+import numpy as np
 import pytest
 
 from hirag_prod import HiRAG
+from hirag_prod._utils import compute_xxhash_id
+from hirag_prod.chunk import FixTokenChunk
+from hirag_prod.entity import VanillaEntity
+from hirag_prod.schema import Entity, File, Relation
+from hirag_prod.storage import LanceDB, NetworkXGDB, RetrievalStrategyProvider
+from hirag_prod.summarization import IncrementalFoldSummarizer
+
+
+async def fake_embedding_func(texts):
+    return np.ones((len(texts), 1536), dtype=np.float32)
+
+
+async def fake_extract_func(model, prompt, **kwargs):
+    return "Summary"
+
+
+async def fake_aload_document(path, content_type, document_meta, loader_configs):
+    """Loads the pages of a text file, separated by form feeds"""
+    with open(path, encoding="utf-8") as f:
+        pages = f.read().split("\f")
+    return [
+        File(
+            id=compute_xxhash_id(content),
+            page_content=content,
+            metadata={
+                "type": "pdf",
+                "filename": os.path.basename(path),
+                "page_number": i,
+                "uri": (document_meta or {}).get("uri", ""),
+                "private": False,
+            },
+        )
+        for i, content in enumerate(pages)
+    ]
+
+
+async def fake_llm_func(model, prompt, **kwargs):
+    if "relevant to a list of entities" in kwargs.get("system_prompt", ""):
+        return "<|COMPLETE|>"
+    return '("entity"<|>"ALICE"<|>"PERSON"<|>"Alice is a manager")<|COMPLETE|>'
+
+
+async def make_index(tmp_path, **kwargs) -> HiRAG:
+    """A HiRAG on local storage, with fake embedding and LLM services"""
+    vdb = await LanceDB.create(
+        embedding_func=fake_embedding_func,
+        db_url=str(tmp_path / "hirag.db"),
+        strategy_provider=RetrievalStrategyProvider(),
+    )
+    gdb = NetworkXGDB.create(
+        path=str(tmp_path / "hirag.gpickle"), llm_func=fake_extract_func
+    )
+    index = HiRAG(
+        vdb=vdb,
+        gdb=gdb,
+        entity_summarizer=IncrementalFoldSummarizer(extract_func=fake_extract_func),
+        **kwargs,
+    )
+    await index.initialize_tables()
+    return index
 
 
 @pytest.mark.asyncio
@@ -22,3 +84,273 @@ async def test_index():
         content_type=content_type,
         document_meta=document_meta,
     )
+
+
+@pytest.mark.asyncio
+async def test_registry_lookups_are_batched(tmp_path):
+    index = await make_index(tmp_path, chunk_lookup_batch_size=2)
+    for document_key, chunk_ids in [(1, [10, 11, 12]), (2, [12, 13])]:
+        produced = {
+            "segment_id": document_key,
+            "chunk_ids": chunk_ids,
+            "entity_ids": [],
+            "entity_descriptions": [],
+            "entity_chunk_ids": [],
+            "edges": [],
+        }
+        await index._register_document(
+            document_key, 0, {}, False, [document_key], [produced]
+        )
+
+    assert await index._registered_chunk_ids({10, 12, 13, 14, 15}) == {10, 12, 13}
+    # a record matching several batches is returned once
+    records = await index._query_documents_having(
+        "chunk_ids", [10, 11, 12, 13, 14], ["chunk_ids"]
+    )
+    assert sorted(record["document_key"] for record in records) == [1, 2]
+    records = await index._query_documents_having(
+        "chunk_ids", [10, 11, 12, 13, 14], ["chunk_ids"], "document_key != 1"
+    )
+    assert [record["document_key"] for record in records] == [2]
+
+
+@pytest.mark.asyncio
+async def test_retract_chunks(tmp_path):
+    index = await make_index(tmp_path)
+
+    def _entity(name, description, chunk_ids):
+        return Entity(
+            id=compute_xxhash_id(name),
+            page_content=name,
+            metadata={
+                "entity_type": "ORGANIZATION",
+                "description": description,
+                "chunk_ids": chunk_ids,
+            },
+        )
+
+    # HUB is also in chunk 3 of another document, LONE and SOLO have no relation
+    entities = [
+        _entity("HUB", "Hub description", [1, 2, 3]),
+        _entity("LEAF 1", "Leaf description 1", [1]),
+        _entity("LEAF 2", "Leaf description 2", [2]),
+        _entity("LONE", "Lone description", [1, 2]),
+        _entity("SOLO", "Solo description", [1]),
+    ]
+    await index.vdb.upsert_texts(
+        texts_to_embed=[ent.metadata.description for ent in entities],
+        properties_list=[
+            {"document_key": ent.id, "text": ent.page_content, **ent.metadata.__dict__}
+            for ent in entities
+        ],
+        table=index.entities_table,
+    )
+    await index.gdb.upsert_relations(
+        [
+            Relation(
+                source=_entity("HUB", f"Hub description {i}", [i]),
+                target=_entity(f"LEAF {i}", f"Leaf description {i}", [i]),
+                properties={"description": "related", "weight": 1.0, "chunk_id": i},
+            )
+            for i in (1, 2)
+        ]
+    )
+    # the document has a segment per chunk
+    entries = [
+        ("HUB", "Hub description 1", 1),
+        ("HUB", "Hub description 2", 2),
+        ("LEAF 1", "Leaf description 1", 1),
+        ("LEAF 2", "Leaf description 2", 2),
+        ("LONE", "Lone description 1", 1),
+        ("LONE", "Lone description 2", 2),
+        ("SOLO", "Solo description", 1),
+    ]
+    produced = [
+        {
+            "segment_id": segment_id,
+            "chunk_ids": [segment_id],
+            "entity_ids": [
+                compute_xxhash_id(name) for name, _, cid in entries if cid == segment_id
+            ],
+            "entity_descriptions": [
+                description for _, description, cid in entries if cid == segment_id
+            ],
+            "entity_chunk_ids": [cid for _, _, cid in entries if cid == segment_id],
+            "edges": [],
+        }
+        for segment_id in (1, 2)
+    ]
+    await index._register_document(1, 0, {}, True, [1, 2], produced)
+    registered = await index._get_registered_document(1)
+
+    # the first segment is removed from the document
+    dropped = await index._retract_chunks(1, {1}, registered)
+
+    assert dropped == {
+        compute_xxhash_id("LEAF 1"),
+        compute_xxhash_id("SOLO"),
+    }
+    rows = {
+        row["text"]: row
+        for row in await index.entities_table.query()
+        .select(["text", "description", "chunk_ids"])
+        .to_list()
+    }
+    assert set(rows) == {"HUB", "LEAF 2", "LONE"}
+    # the chunk ids only the table holds are kept
+    assert rows["HUB"]["chunk_ids"] == [2, 3]
+    assert rows["HUB"]["description"] == "Hub description 2"
+    # the description extracted from the removed chunk is dropped
+    assert rows["LONE"]["chunk_ids"] == [2]
+    assert rows["LONE"]["description"] == "Lone description 2"
+
+    hub = await index.gdb.query_node(compute_xxhash_id("HUB"))
+    assert hub.metadata.chunk_ids == [2]
+    assert hub.metadata.description == "Hub description 2"
+    assert compute_xxhash_id("LEAF 1") not in index.gdb.graph
+    assert index.gdb.graph.number_of_edges() == 1
+
+
+@pytest.mark.asyncio
+async def test_process_documents(tmp_path):
+    index = await make_index(
+        tmp_path, chunker=FixTokenChunk(chunk_size=50, chunk_overlap=5)
+    )
+    embedded = []
+
+    async def recording_embedding_func(texts):
+        embedded.append(len(texts))
+        return await fake_embedding_func(texts)
+
+    index.vdb.embedding_func = recording_embedding_func
+    documents = [
+        File(
+            id=i,
+            page_content=f"Page {i} of the guide to the healthcare system. " * 20,
+            metadata={
+                "type": "pdf",
+                "filename": "guide.pdf",
+                "page_number": 1,
+                "uri": "guide.pdf",
+                "private": False,
+            },
+        )
+        for i in range(2)
+    ]
+
+    produced = await index._process_documents(documents, with_graph=False)
+
+    # the caller's list is left as is
+    assert [document.id for document in documents] == [0, 1]
+    chunk_ids = list({cid for p in produced for cid in p["chunk_ids"]})
+    assert await index.chunks_table.count_rows() == len(chunk_ids)
+    # each batch is embedded with a single request
+    assert len(embedded) == len(produced) == 2
+
+    async def failing_embedding_func(texts):
+        raise ValueError("embedding service unavailable")
+
+    index.vdb.embedding_func = failing_embedding_func
+    index._known_chunk_ids.clear()
+    await index.vdb.delete_by_document_keys(index.chunks_table, chunk_ids)
+    with pytest.raises(ValueError) as exc_info:
+        await index._process_documents(documents, with_graph=False)
+    assert isinstance(exc_info.value.__cause__, ExceptionGroup)
+
+
+@pytest.mark.asyncio
+async def test_insert_reports_the_triage(tmp_path, monkeypatch, caplog):
+    document_path = tmp_path / "guide.pdf"
+    document_path.write_text("Alice manages the Acme Corporation team in Paris.\f12")
+    document_meta = {
+        "type": "pdf",
+        "filename": "guide.pdf",
+        "uri": "https://example.com/guide.pdf",
+        "private": False,
+    }
+    monkeypatch.setattr("hirag_prod.hirag.aload_document", fake_aload_document)
+    entity_extractor = VanillaEntity.create(
+        extract_func=fake_llm_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+    )
+    index = await make_index(tmp_path, entity_extractor=entity_extractor)
+
+    await index.insert_to_kb(str(document_path), "application/pdf", True, document_meta)
+
+    assert (
+        f"Skipped 2 LLM calls on low-information chunks of {document_path}"
+        in caplog.text
+    )
+    assert not entity_extractor.triage_skipped_calls
+
+
+@pytest.mark.asyncio
+async def test_insert_reports_the_triage_of_each_document(
+    tmp_path, monkeypatch, caplog
+):
+    # documents without uri, ingested concurrently
+    document_paths = []
+    for name, text in [
+        ("first", "Alice manages Acme.\f12"),
+        ("second", "Bob builds robots.\f27\f28"),
+    ]:
+        document_path = tmp_path / f"{name}.pdf"
+        document_path.write_text(text)
+        document_paths.append(document_path)
+    monkeypatch.setattr("hirag_prod.hirag.aload_document", fake_aload_document)
+    entity_extractor = VanillaEntity.create(
+        extract_func=fake_llm_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+    )
+    index = await make_index(tmp_path, entity_extractor=entity_extractor)
+
+    await asyncio.gather(
+        *[
+            index.insert_to_kb(str(document_path), "application/pdf")
+            for document_path in document_paths
+        ]
+    )
+
+    for document_path, skipped_calls in zip(document_paths, [2, 4]):
+        assert (
+            f"Skipped {skipped_calls} LLM calls on low-information chunks of {document_path}"
+            in caplog.text
+        )
+    assert not entity_extractor.triage_skipped_calls
+
+
+@pytest.mark.asyncio
+async def test_insert_retries_the_chunks_of_a_failed_insert(tmp_path, monkeypatch):
+    document_path = tmp_path / "guide.pdf"
+    document_path.write_text("Alice manages the Acme Corporation team in Paris.")
+    calls = []
+    failing = True
+
+    async def flaky_llm_func(model, prompt, **kwargs):
+        if failing:
+            raise RuntimeError("LLM unavailable")
+        calls.append(prompt)
+        return await fake_llm_func(model, prompt, **kwargs)
+
+    monkeypatch.setattr("hirag_prod.hirag.aload_document", fake_aload_document)
+    entity_extractor = VanillaEntity.create(
+        extract_func=flaky_llm_func,
+        entity_extract_max_gleaning=0,
+        relation_extract_max_gleaning=0,
+    )
+    index = await make_index(tmp_path, entity_extractor=entity_extractor)
+
+    with pytest.raises(RuntimeError):
+        await index.insert_to_kb(str(document_path), "application/pdf")
+    failing = False
+    await index.insert_to_kb(str(document_path), "application/pdf")
+
+    # the chunks claimed by the failed insert are extracted by the retry
+    assert calls
+    assert await index.entities_table.count_rows() == 1
+    registered = await index._get_registered_document(
+        compute_xxhash_id(str(document_path))
+    )
+    assert registered["entity_ids"] == [compute_xxhash_id("ALICE")]
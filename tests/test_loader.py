@@ -1,6 +1,10 @@
 import os
 
+import httpx
+import pytest
+
 from hirag_prod.loader import load_document
+from hirag_prod.loader.markify_loader import AsyncMarkifyClient
 
 
 def test_load_pdf_langchain():
@@ -23,7 +27,7 @@ def test_load_pdf_langchain():
     assert len(documents) > 0
     assert documents[0].page_content is not None
     assert documents[0].metadata is not None
-    assert documents[0].id.startswith("doc-")
+    assert isinstance(documents[0].id, int)
 
 
 def test_load_pdf_mineru():
@@ -41,7 +45,7 @@ def test_load_pdf_mineru():
     assert len(documents) > 0
     assert documents[0].page_content is not None
     assert documents[0].metadata is not None
-    assert documents[0].id.startswith("doc-")
+    assert isinstance(documents[0].id, int)
 
 
 def test_parse_pptx():
@@ -77,3 +81,62 @@ def test_parse_pptx():
     assert os.path.isdir(os.path.join(work_dir, "slide_images"))
     assert os.path.isdir(os.path.join(work_dir, "images"))
     assert os.path.isdir(os.path.join(work_dir, "template_images"))
+
+
+@pytest.mark.asyncio
+async def test_async_markify_client(tmp_path):
+    jobs, polls, uploads = {}, {}, []
+    active, peak = 0, 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal active, peak
+        if request.method == "POST":
+            body = request.read()
+            if not uploads:
+                # a first failure, which is retried
+                uploads.append(None)
+                return httpx.Response(503)
+            job_id = f"job-{len(jobs)}"
+            jobs[job_id] = next(
+                name
+                for name in ("a", "b", "c")
+                if f"content of {name}".encode() in body
+            )
+            polls[job_id] = 0
+            uploads.append(job_id)
+            active += 1
+            peak = max(peak, active)
+            return httpx.Response(200, json={"job_id": job_id})
+        job_id = request.url.path.split("/")[3]
+        if request.url.path.endswith("/result"):
+            active -= 1
+            return httpx.Response(200, text=f"# Converted {jobs[job_id]}")
+        polls[job_id] += 1
+        status = "completed" if polls[job_id] > 2 else "processing"
+        return httpx.Response(200, json={"status": status})
+
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.pdf"
+        path.write_text(f"content of {name}")
+        paths.append(str(path))
+
+    async with AsyncMarkifyClient(
+        base_url="http://markify",
+        max_concurrency=2,
+        poll_min_interval=0.001,
+        poll_max_interval=0.01,
+        transport=httpx.MockTransport(handler),
+    ) as client:
+        results = await client.convert_many(paths)
+        assert results == ["# Converted a", "# Converted b", "# Converted c"]
+        assert peak <= 2
+        assert all(count == 3 for count in polls.values())
+
+        # the results are streamed to disk
+        output_dir = tmp_path / "output"
+        output_dir.mkdir()
+        assert await client.convert_many(paths[:1], output_dir=str(output_dir)) == [
+            None
+        ]
+        assert (output_dir / "a.md").read_text() == "# Converted a"
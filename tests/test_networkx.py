@@ -1,120 +1,129 @@
 import pytest
 
 from hirag_prod._llm import ChatCompletion
+from hirag_prod._utils import compute_xxhash_id
 from hirag_prod.schema import Entity, Relation
 from hirag_prod.storage.networkx import NetworkXGDB
 
+# Ids computed as in the pipeline: chunks from their text, entities from their name
+FIRST_CHUNK_ID = compute_xxhash_id(
+    "A Very General Overview of How the U.S. Health Care System Works"
+)
+SECOND_CHUNK_ID = compute_xxhash_id(
+    "Private insurance companies then use the volume of insured patients"
+)
+
 
 @pytest.mark.asyncio
 async def test_networkx_gdb():
     relations = [
         Relation(
             source=Entity(
-                id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+                id=compute_xxhash_id("UNITED STATES"),
                 page_content="UNITED STATES",
                 metadata={
                     "entity_type": "GEO",
                     "description": "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-5a28a79d61d9ba7001246e3fdebbe108",
+                id=compute_xxhash_id("HEALTH CARE SYSTEM"),
                 page_content="HEALTH CARE SYSTEM",
                 metadata={
                     "entity_type": "EVENT",
                     "description": "The Health Care System in the United States refers to the organized provision of medical services, which relies on a combination of privatized and government insurance. This system encompasses a variety of healthcare providers and services aimed at delivering medical care to the population, ensuring access to needed health resources through different forms of insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             properties={
                 "description": "The United States operates a free market health care system, which defines its overall structure and operation.",
                 "weight": 9.0,
-                "chunk_id": "chunk-5b8421d1da0999a82176b7836b795235",
+                "chunk_id": FIRST_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-5a28a79d61d9ba7001246e3fdebbe108",
+                id=compute_xxhash_id("HEALTH CARE SYSTEM"),
                 page_content="HEALTH CARE SYSTEM",
                 metadata={
                     "entity_type": "EVENT",
                     "description": "The Health Care System in the United States refers to the organized provision of medical services, which relies on a combination of privatized and government insurance. This system encompasses a variety of healthcare providers and services aimed at delivering medical care to the population, ensuring access to needed health resources through different forms of insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+                id=compute_xxhash_id("INSURANCE COMPANIES"),
                 page_content="INSURANCE COMPANIES",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                     "chunk_ids": [
-                        "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                        "chunk-5b8421d1da0999a82176b7836b795235",
+                        SECOND_CHUNK_ID,
+                        FIRST_CHUNK_ID,
                     ],
                 },
             ),
             properties={
                 "description": "The health care system in the U.S. is heavily influenced by insurance companies that provide policies to consumers and sign contracts with healthcare providers.",
                 "weight": 8.0,
-                "chunk_id": "chunk-5b8421d1da0999a82176b7836b795235",
+                "chunk_id": FIRST_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+                id=compute_xxhash_id("UNITED STATES"),
                 page_content="UNITED STATES",
                 metadata={
                     "entity_type": "GEO",
                     "description": "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+                id=compute_xxhash_id("INSURANCE COMPANIES"),
                 page_content="INSURANCE COMPANIES",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                     "chunk_ids": [
-                        "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                        "chunk-5b8421d1da0999a82176b7836b795235",
+                        SECOND_CHUNK_ID,
+                        FIRST_CHUNK_ID,
                     ],
                 },
             ),
             properties={
                 "description": "Insurance companies operate within the framework of the U.S. health care system, affecting how services are delivered and financed.",
                 "weight": 7.0,
-                "chunk_id": "chunk-5b8421d1da0999a82176b7836b795235",
+                "chunk_id": FIRST_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+                id=compute_xxhash_id("INSURANCE COMPANIES"),
                 page_content="INSURANCE COMPANIES",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                     "chunk_ids": [
-                        "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                        "chunk-5b8421d1da0999a82176b7836b795235",
+                        SECOND_CHUNK_ID,
+                        FIRST_CHUNK_ID,
                     ],
                 },
             ),
             target=Entity(
-                id="ent-8ac4883b1b6f421ea5f0196eb317b2ba",
+                id=compute_xxhash_id("HEALTH CARE PROVIDERS"),
                 page_content="HEALTH CARE PROVIDERS",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Health Care Providers are the professionals or facilities that offer medical treatments and services to patients, regardless of their insurance status, whether they are insured or uninsured.",
-                    "chunk_ids": ["chunk-d66c81e0b32e3d4e6777f0dfbabe81a8"],
+                    "chunk_ids": [SECOND_CHUNK_ID],
                 },
             ),
             properties={
                 "description": "Insurance companies restrict payment to health care providers based on contracts that set fixed fees for services.",
                 "weight": 8.0,
-                "chunk_id": "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
+                "chunk_id": SECOND_CHUNK_ID,
             },
         ),
     ]
@@ -139,21 +148,21 @@ async def test_merge_node():
     description1 = "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage."
     description2 = "The medical system in the United States is a complex network of hospitals, clinics, and other healthcare providers that provide medical care to the population."
     node1 = Entity(
-        id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+        id=compute_xxhash_id("UNITED STATES"),
         page_content="UNITED STATES",
         metadata={
             "entity_type": "GEO",
             "description": description1,
-            "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+            "chunk_ids": [FIRST_CHUNK_ID],
         },
     )
     node2 = Entity(
-        id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+        id=compute_xxhash_id("UNITED STATES"),
         page_content="UNITED STATES",
         metadata={
             "entity_type": "GEO",
             "description": description2,
-            "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+            "chunk_ids": [FIRST_CHUNK_ID],
         },
     )
     await gdb.upsert_node(node1)
@@ -173,136 +182,136 @@ async def test_query_one_hop():
     relations = [
         Relation(
             source=Entity(
-                id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+                id=compute_xxhash_id("UNITED STATES"),
                 page_content="UNITED STATES",
                 metadata={
                     "entity_type": "GEO",
                     "description": "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-5a28a79d61d9ba7001246e3fdebbe108",
+                id=compute_xxhash_id("HEALTH CARE SYSTEM"),
                 page_content="HEALTH CARE SYSTEM",
                 metadata={
                     "entity_type": "EVENT",
                     "description": "The Health Care System in the United States refers to the organized provision of medical services, which relies on a combination of privatized and government insurance. This system encompasses a variety of healthcare providers and services aimed at delivering medical care to the population, ensuring access to needed health resources through different forms of insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             properties={
                 "description": "The United States operates a free market health care system, which defines its overall structure and operation.",
                 "weight": 9.0,
-                "chunk_id": "chunk-5b8421d1da0999a82176b7836b795235",
+                "chunk_id": FIRST_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-5a28a79d61d9ba7001246e3fdebbe108",
+                id=compute_xxhash_id("HEALTH CARE SYSTEM"),
                 page_content="HEALTH CARE SYSTEM",
                 metadata={
                     "entity_type": "EVENT",
                     "description": "The Health Care System in the United States refers to the organized provision of medical services, which relies on a combination of privatized and government insurance. This system encompasses a variety of healthcare providers and services aimed at delivering medical care to the population, ensuring access to needed health resources through different forms of insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+                id=compute_xxhash_id("INSURANCE COMPANIES"),
                 page_content="INSURANCE COMPANIES",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                     "chunk_ids": [
-                        "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                        "chunk-5b8421d1da0999a82176b7836b795235",
+                        SECOND_CHUNK_ID,
+                        FIRST_CHUNK_ID,
                     ],
                 },
             ),
             properties={
                 "description": "The health care system in the U.S. is heavily influenced by insurance companies that provide policies to consumers and sign contracts with healthcare providers.",
                 "weight": 8.0,
-                "chunk_id": "chunk-5b8421d1da0999a82176b7836b795235",
+                "chunk_id": FIRST_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+                id=compute_xxhash_id("UNITED STATES"),
                 page_content="UNITED STATES",
                 metadata={
                     "entity_type": "GEO",
                     "description": "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+                id=compute_xxhash_id("INSURANCE COMPANIES"),
                 page_content="INSURANCE COMPANIES",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                     "chunk_ids": [
-                        "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                        "chunk-5b8421d1da0999a82176b7836b795235",
+                        SECOND_CHUNK_ID,
+                        FIRST_CHUNK_ID,
                     ],
                 },
             ),
             properties={
                 "description": "Insurance companies operate within the framework of the U.S. health care system, affecting how services are delivered and financed.",
                 "weight": 7.0,
-                "chunk_id": "chunk-5b8421d1da0999a82176b7836b795235",
+                "chunk_id": FIRST_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-2a422318fc58c5302a5ba9365bcbc0be",
+                id=compute_xxhash_id("INSURANCE COMPANIES"),
                 page_content="INSURANCE COMPANIES",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Insurance Companies are private entities that offer health insurance coverage and establish payment processes for healthcare services based on contracts with providers. They play a crucial role in the healthcare system by managing risk and ensuring that individuals have access to necessary medical services through their insurance plans.",
                     "chunk_ids": [
-                        "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
-                        "chunk-5b8421d1da0999a82176b7836b795235",
+                        SECOND_CHUNK_ID,
+                        FIRST_CHUNK_ID,
                     ],
                 },
             ),
             target=Entity(
-                id="ent-8ac4883b1b6f421ea5f0196eb317b2ba",
+                id=compute_xxhash_id("HEALTH CARE PROVIDERS"),
                 page_content="HEALTH CARE PROVIDERS",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Health Care Providers are the professionals or facilities that offer medical treatments and services to patients, regardless of their insurance status, whether they are insured or uninsured.",
-                    "chunk_ids": ["chunk-d66c81e0b32e3d4e6777f0dfbabe81a8"],
+                    "chunk_ids": [SECOND_CHUNK_ID],
                 },
             ),
             properties={
                 "description": "Insurance companies restrict payment to health care providers based on contracts that set fixed fees for services.",
                 "weight": 8.0,
-                "chunk_id": "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
+                "chunk_id": SECOND_CHUNK_ID,
             },
         ),
         Relation(
             source=Entity(
-                id="ent-8ac4883b1b6f421ea5f0196eb317b2ba",
+                id=compute_xxhash_id("HEALTH CARE PROVIDERS"),
                 page_content="HEALTH CARE PROVIDERS",
                 metadata={
                     "entity_type": "ORGANIZATION",
                     "description": "Health Care Providers are the professionals or facilities that offer medical treatments and services to patients, regardless of their insurance status, whether they are insured or uninsured.",
-                    "chunk_ids": ["chunk-d66c81e0b32e3d4e6777f0dfbabe81a8"],
+                    "chunk_ids": [SECOND_CHUNK_ID],
                 },
             ),
             target=Entity(
-                id="ent-3ff39c0f9a2e36a5d47ded059ba14673",
+                id=compute_xxhash_id("UNITED STATES"),
                 page_content="UNITED STATES",
                 metadata={
                     "entity_type": "GEO",
                     "description": "The United States is a country characterized by a free market health care system that encompasses a diverse array of insurance providers and health care facilities. This system allows for competition among various organizations, which can lead to a wide range of options for consumers seeking medical care and insurance coverage.",
-                    "chunk_ids": ["chunk-5b8421d1da0999a82176b7836b795235"],
+                    "chunk_ids": [FIRST_CHUNK_ID],
                 },
             ),
             properties={
                 "description": "Health care providers are the professionals or facilities that offer medical treatments and services to patients, regardless of their insurance status, whether they are insured or uninsured.",
                 "weight": 8.0,
-                "chunk_id": "chunk-d66c81e0b32e3d4e6777f0dfbabe81a8",
+                "chunk_id": SECOND_CHUNK_ID,
             },
         ),
     ]
@@ -315,18 +324,223 @@ async def test_query_one_hop():
 
     for relation in relations:
         await gdb.upsert_relation(relation)
-    neighbors, edges = await gdb.query_one_hop("ent-8ac4883b1b6f421ea5f0196eb317b2ba")
+    neighbors, edges = await gdb.query_one_hop(
+        compute_xxhash_id("HEALTH CARE PROVIDERS")
+    )
     assert len(neighbors) == 2
     assert len(edges) == 2
     assert set([n.id for n in neighbors]) == {
-        "ent-3ff39c0f9a2e36a5d47ded059ba14673",
-        "ent-2a422318fc58c5302a5ba9365bcbc0be",
+        compute_xxhash_id("UNITED STATES"),
+        compute_xxhash_id("INSURANCE COMPANIES"),
     }
     assert set([e.source.id for e in edges]) == {
-        "ent-8ac4883b1b6f421ea5f0196eb317b2ba",
-        "ent-8ac4883b1b6f421ea5f0196eb317b2ba",
+        compute_xxhash_id("HEALTH CARE PROVIDERS"),
+        compute_xxhash_id("HEALTH CARE PROVIDERS"),
     }
     assert set([e.target.id for e in edges]) == {
-        "ent-3ff39c0f9a2e36a5d47ded059ba14673",
-        "ent-2a422318fc58c5302a5ba9365bcbc0be",
+        compute_xxhash_id("UNITED STATES"),
+        compute_xxhash_id("INSURANCE COMPANIES"),
     }
+
+
+@pytest.mark.asyncio
+async def test_upsert_relations_merges_each_node_once(tmp_path):
+    summarize_calls = []
+
+    async def fake_llm_func(model, prompt, **kwargs):
+        summarize_calls.append(prompt)
+        return "merged description"
+
+    gdb = NetworkXGDB.create(
+        path=str(tmp_path / "test.gpickle"),
+        llm_func=fake_llm_func,
+    )
+
+    def _entity(name, description, chunk_id):
+        return Entity(
+            id=compute_xxhash_id(name),
+            page_content=name,
+            metadata={
+                "entity_type": "ORGANIZATION",
+                "description": description,
+                "chunk_ids": [chunk_id],
+            },
+        )
+
+    hub_descriptions = [f"Hub description {i}" for i in range(5)]
+    relations = [
+        Relation(
+            source=_entity("HUB", description, i),
+            target=_entity(f"LEAF {i}", f"Leaf description {i}", i),
+            properties={
+                "description": "related",
+                "weight": 1.0,
+                "chunk_id": i,
+            },
+        )
+        for i, description in enumerate(hub_descriptions)
+    ]
+    await gdb.upsert_relations(relations)
+
+    # Only the hub has conflicting descriptions, and they are merged in a single call
+    assert len(summarize_calls) == 1
+    hub = await gdb.query_node(compute_xxhash_id("HUB"))
+    assert hub.metadata.description == "merged description"
+    assert set(hub.metadata.chunk_ids) == set(range(5))
+    assert gdb.graph.number_of_edges() == 5
+
+
+@pytest.mark.asyncio
+async def test_buffered_relations_are_written_on_flush(tmp_path):
+    summarize_calls = []
+
+    async def fake_llm_func(model, prompt, **kwargs):
+        summarize_calls.append(prompt)
+        return "merged description"
+
+    gdb = NetworkXGDB.create(
+        path=str(tmp_path / "test.gpickle"),
+        llm_func=fake_llm_func,
+    )
+
+    def _relation(i):
+        return Relation(
+            source=Entity(
+                id=compute_xxhash_id("HUB"),
+                page_content="HUB",
+                metadata={
+                    "entity_type": "ORGANIZATION",
+                    "description": f"Hub description {i}",
+                    "chunk_ids": [i],
+                },
+            ),
+            target=Entity(
+                id=compute_xxhash_id(f"LEAF {i}"),
+                page_content=f"LEAF {i}",
+                metadata={
+                    "entity_type": "ORGANIZATION",
+                    "description": f"Leaf description {i}",
+                    "chunk_ids": [i],
+                },
+            ),
+            properties={
+                "description": "related",
+                "weight": 1.0,
+                "chunk_id": i,
+            },
+        )
+
+    # Two documents buffer their relations, nothing is written until the flush
+    gdb.buffer_relations([_relation(i) for i in range(3)])
+    gdb.buffer_relations([_relation(i) for i in range(3, 6)])
+    assert gdb.graph.number_of_nodes() == 0
+
+    await gdb.flush()
+    assert gdb.graph.number_of_nodes() == 7
+    assert gdb.graph.number_of_edges() == 6
+    assert len(summarize_calls) == 1
+    assert gdb.write_buffer == []
+
+
+@pytest.mark.asyncio
+async def test_merged_version_supersedes_the_others(tmp_path):
+    summarize_calls = []
+
+    async def fake_llm_func(model, prompt, **kwargs):
+        summarize_calls.append(prompt)
+        return "summarized description"
+
+    gdb = NetworkXGDB.create(
+        path=str(tmp_path / "test.gpickle"),
+        llm_func=fake_llm_func,
+    )
+
+    def _hub(description, chunk_ids):
+        return Entity(
+            id=compute_xxhash_id("HUB"),
+            page_content="HUB",
+            metadata={
+                "entity_type": "ORGANIZATION",
+                "description": description,
+                "chunk_ids": chunk_ids,
+            },
+        )
+
+    def _relation(hub, i):
+        leaf = Entity(
+            id=compute_xxhash_id(f"LEAF {i}"),
+            page_content=f"LEAF {i}",
+            metadata={
+                "entity_type": "ORGANIZATION",
+                "description": f"Leaf description {i}",
+                "chunk_ids": [i],
+            },
+        )
+        return Relation(
+            source=hub,
+            target=leaf,
+            properties={"description": "related", "weight": 1.0, "chunk_id": i},
+        )
+
+    await gdb.upsert_node(_hub("Hub in the first document", [0]))
+    # the hub merged with the knowledge base after each of two documents
+    second = _hub("Hub in the first two documents", [0, 1])
+    third = _hub("Hub in the first three documents", [0, 1, 2])
+    await gdb.upsert_relations(
+        [_relation(second, 1), _relation(second, 3), _relation(third, 2)]
+    )
+
+    node = await gdb.query_node(compute_xxhash_id("HUB"))
+    assert node.metadata.description == "Hub in the first three documents"
+    assert sorted(node.metadata.chunk_ids) == [0, 1, 2]
+    assert summarize_calls == []
+
+
+@pytest.mark.asyncio
+async def test_retract_chunks(tmp_path):
+    async def fake_llm_func(model, prompt, **kwargs):
+        return "merged description"
+
+    gdb = NetworkXGDB.create(
+        path=str(tmp_path / "test.gpickle"),
+        llm_func=fake_llm_func,
+    )
+
+    def _entity(name, description, chunk_id):
+        return Entity(
+            id=compute_xxhash_id(name),
+            page_content=name,
+            metadata={
+                "entity_type": "ORGANIZATION",
+                "description": description,
+                "chunk_ids": [chunk_id],
+            },
+        )
+
+    relations = [
+        Relation(
+            source=_entity("HUB", f"Hub description {i}", i),
+            target=_entity(f"LEAF {i}", f"Leaf description {i}", i),
+            properties={
+                "description": "related",
+                "weight": 1.0,
+                "chunk_id": i,
+            },
+        )
+        for i in range(3)
+    ]
+    await gdb.upsert_relations(relations)
+
+    hub_id = compute_xxhash_id("HUB")
+    dropped = await gdb.retract_chunks(
+        # an entity without relation is not in the graph
+        [hub_id, compute_xxhash_id("LEAF 0"), compute_xxhash_id("LONE ENTITY")],
+        {0},
+        {hub_id: "Hub description 1"},
+    )
+
+    assert dropped == [compute_xxhash_id("LEAF 0")]
+    hub = await gdb.query_node(hub_id)
+    assert hub.metadata.description == "Hub description 1"
+    assert set(hub.metadata.chunk_ids) == {1, 2}
+    assert gdb.graph.number_of_edges() == 2
@@ -1,7 +1,12 @@
 import pytest
 
 from hirag_prod._llm import ChatCompletion
-from hirag_prod.summarization import TrancatedAggregateSummarizer
+from hirag_prod._utils import encode_strings_by_tiktoken
+from hirag_prod.summarization import (
+    IncrementalFoldSummarizer,
+    MapReduceSummarizer,
+    TrancatedAggregateSummarizer,
+)
 
 
 @pytest.mark.asyncio
@@ -18,3 +23,84 @@ async def test_summarizer():
         ],
     )
     assert summary is not None
+
+
+@pytest.mark.asyncio
+async def test_incremental_fold_summarizer():
+    prompts = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        prompts.append(prompt)
+        return f"Summary {len(prompts)}"
+
+    summarizer = IncrementalFoldSummarizer(
+        extract_func=fake_extract_func, concat_max_tokens=100
+    )
+    # short descriptions are kept verbatim, without any LLM call
+    summary = await summarizer.summarize_entity(
+        "HUB", ["Hub is a company", "Hub sells"]
+    )
+    assert summary == "Hub is a company\nHub sells"
+    assert prompts == []
+
+    # a covered description is skipped
+    assert await summarizer.summarize_entity("HUB", [summary, "Hub sells"]) == summary
+
+    # a new description containing the summary replaces it
+    extended = summary + " in many countries"
+    assert (
+        await summarizer.summarize_entity("HUB", [summary, extended, "Hub sells"])
+        == extended
+    )
+    assert await summarizer.summarize_entity("HUB", [extended, "Hub sells"]) == extended
+    assert prompts == []
+
+    # over the threshold, only the new description is folded into the summary
+    long_description = "Hub is a hub company which sells hubs to many customers " * 10
+    summary = await summarizer.summarize_entity("HUB", [summary, long_description])
+    assert summary == "Summary 1"
+    assert len(prompts) == 1
+    assert "Hub is a company\nHub sells" in prompts[0]
+    assert long_description in prompts[0]
+
+    # the summary remembers the descriptions it covers
+    assert (
+        await summarizer.summarize_entity(
+            "HUB", [summary, long_description, "Hub sells"]
+        )
+        == "Summary 1"
+    )
+    assert len(prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_map_reduce_summarizer():
+    prompts = []
+
+    async def fake_extract_func(model, prompt, **kwargs):
+        prompts.append(prompt)
+        return f"Summary {len(prompts)}"
+
+    descriptions = [f"Description {i} " + "of the hub " * 20 for i in range(6)]
+    tokens = max(len(t) for t in encode_strings_by_tiktoken(descriptions))
+    summarizer = MapReduceSummarizer(
+        extract_func=fake_extract_func,
+        input_max_tokens=2 * tokens + 1,
+        output_max_tokens=tokens // 2,
+    )
+    summary = await summarizer.summarize_entity("HUB", descriptions)
+
+    # three groups of two descriptions, then one reduce of the group summaries
+    assert len(prompts) == 4
+    for description in descriptions:
+        assert sum(description in prompt for prompt in prompts[:3]) == 1
+    assert all(f"Summary {i}" in prompts[3] for i in range(1, 4))
+    assert summary == "Summary 4"
+
+    # two group summaries must fit in one reduce call
+    with pytest.raises(ValueError):
+        MapReduceSummarizer(
+            extract_func=fake_extract_func,
+            input_max_tokens=2000,
+            output_max_tokens=1000,
+        )